@@ -0,0 +1,328 @@
+import argparse
+import asyncio
+import configparser
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+import psycopg2
+
+"""
+Load test of the share and receive hot paths. Starts the server with uvicorn on a throwaway database, simulates users with several devices
+that register, log in, share text and files with their other devices, poll for data and receive it, and reports the throughput, the p50/p99
+latency and the SQL statements per request of every endpoint. The statements are counted by the server for the beamit_db_statements metric.
+
+The database server and credentials are taken from db.conf, the user needs the privilege to create databases. httpx has to be installed.
+
+    python benchmark.py --users 20 --devices 3 --save baseline.json
+    python benchmark.py --users 20 --devices 3 --baseline baseline.json --tolerance 0.25
+
+With --baseline the run is compared with a stored run and the exit code is 1 if an endpoint got slower or needs more statements.
+The baseline has to be measured with the same users, devices, shares, polls, file size, concurrency and workers.
+"""
+
+# the request that runs in each phase, the statements of a phase are attributed to these endpoints
+phaseEndpoints = {"register": "/user/register", "login": "/user/login", "share": "/beamit/share", "poll": "/beamit/checkAvailableData", "receive": "/beamit/receive", "acknowledge": "/beamit/acknowledge"}
+dbStatementPattern = re.compile(r'^beamit_db_statements_total\{query="([^"]+)"\} ([0-9.e+]+)$', re.MULTILINE)
+# options of a run that the results depend on, a baseline is only compared with runs of the same options
+configKeys = ["users", "devices", "shares", "polls", "filesize", "concurrency", "workers"]
+
+"""
+Collects the latencies and errors of the requests of one endpoint.
+"""
+class endpointstats():
+    latencies = None
+    errors = 0
+    duration = 0
+    dbStatements = 0
+    def __init__(self) -> None:
+        self.latencies = []
+
+    """
+    Returns the latency in milliseconds below which the given fraction of the requests finished.
+    """
+    def percentile(self, fraction: float):
+        if not self.latencies:
+            return 0
+        latencies = sorted(self.latencies)
+        return latencies[min(len(latencies) - 1, round(fraction * (len(latencies) - 1)))] * 1000
+
+    """
+    Returns the summary of the endpoint as it is printed and stored.
+    """
+    def summary(self):
+        requests = len(self.latencies)
+        return {"requests": requests, "errors": self.errors, "throughput": requests / self.duration if self.duration else 0, "p50": self.percentile(0.5), "p99": self.percentile(0.99), "dbStatementsPerRequest": self.dbStatements / requests if requests else 0}
+
+"""
+Simulated clients of one run. Every phase sends one kind of request for all users and devices concurrently, at most concurrency requests at a time.
+"""
+class benchmark():
+    client = None
+    semaphore = None
+    stats = None
+    users = None
+    devices = None
+    tokens = None
+    etags = None
+    content = b""
+    pending = None
+    def __init__(self, client: httpx.AsyncClient, users: int, devices: int, filesize: int, concurrency: int) -> None:
+        self.client = client
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.stats = {}
+        self.users = ["bench" + str(user).zfill(4) for user in range(users)]
+        self.devices = ["device" + str(device) for device in range(devices)]
+        self.tokens = {}
+        self.etags = {}
+        self.content = os.urandom(filesize)
+        self.pending = []
+
+    """
+    Sends one request and records its latency. Requests that fail or are answered with "successfull": false count as errors.
+    Returns the response or None if the request failed.
+    """
+    async def request(self, endpoint: str, user: str, device: str = None, data: dict = None, files: list = None, headers: dict = None, expectSuccess: bool = True):
+        headers = dict(headers or {})
+        if (user, device) in self.tokens:
+            headers["Authorization"] = "Bearer " + self.tokens[(user, device)]
+        async with self.semaphore:
+            start = time.perf_counter()
+            try:
+                response = await self.client.post(endpoint, data=data, files=files, headers=headers)
+            except httpx.HTTPError:
+                response = None
+            latency = time.perf_counter() - start
+        stats = self.stats.setdefault(endpoint, endpointstats())
+        stats.latencies.append(latency)
+        if response is None or response.status_code >= 400:
+            stats.errors += 1
+            return None
+        if expectSuccess and response.headers.get("content-type", "").startswith("application/json") and response.json().get("successfull") is False:
+            stats.errors += 1
+        return response
+
+    """
+    Returns the number of statements of all database methods so far, without the ones of the /metrics scrapes.
+    """
+    async def dbStatements(self):
+        response = await self.client.get("/metrics")
+        return sum(float(count) for query, count in dbStatementPattern.findall(response.text) if query != "countPendingShares")
+
+    async def register(self, user: str):
+        await self.request("/user/register", user, data={"username": user, "password": "benchmark-" + user})
+
+    async def login(self, user: str, device: str):
+        response = await self.request("/user/login", user, data={"username": user, "password": "benchmark-" + user, "devicename": device})
+        if response is not None and response.json()["successfull"]:
+            self.tokens[(user, device)] = response.json()["message"]["token"]
+
+    """
+    Shares with all other devices of the user, alternating between a text and a file.
+    """
+    async def share(self, user: str, device: str, number: int):
+        data = {"username": user, "devicename": device, "targetDevices": "{" + ", ".join(target for target in self.devices if target != device) + "}", "autoOpen": "false", "encrypted": "false"}
+        if number % 2:
+            await self.request("/beamit/share", user, device, data=data, files=[("files", ("file" + str(number) + ".bin", self.content))])
+        else:
+            await self.request("/beamit/share", user, device, data={**data, "text": "benchmark text " + str(number)})
+
+    """
+    Polls for pending shares with the ETag of the previous poll, like a client that polls periodically, and remembers the shares of the
+    last poll for the receive phase. An empty inbox is not an error.
+    """
+    async def poll(self, user: str, device: str, remember: bool):
+        headers = {"If-None-Match": self.etags[(user, device)]} if (user, device) in self.etags and not remember else None
+        response = await self.request("/beamit/checkAvailableData", user, device, data={"username": user, "devicename": device}, headers=headers, expectSuccess=False)
+        if response is None or response.status_code == 304:
+            return
+        self.etags[(user, device)] = response.headers.get("etag")
+        body = response.json()
+        if remember and body["successfull"]:
+            self.pending.extend((user, device, share[0], share[3]) for share in body["message"])
+
+    async def receive(self, user: str, device: str, timestamp: str):
+        await self.request("/beamit/receive", user, device, data={"username": user, "devicename": device, "timestamp": timestamp})
+
+    async def acknowledge(self, user: str, device: str, timestamp: str):
+        await self.request("/beamit/acknowledge", user, device, data={"username": user, "devicename": device, "timestamp": timestamp})
+
+    """
+    Runs all phases one after another and returns the statistics per endpoint. The statements are read from the metrics of the server
+    before and after each phase.
+    """
+    async def run(self, shares: int, polls: int):
+        devices = [(user, device) for user in self.users for device in self.devices]
+        phases = [
+            ("register", lambda: [self.register(user) for user in self.users]),
+            ("login", lambda: [self.login(user, device) for user, device in devices]),
+            ("share", lambda: [self.share(user, device, number) for user, device in devices for number in range(shares)]),
+            ("poll", lambda: [self.poll(user, device, remember=number == polls - 1) for user, device in devices for number in range(polls)]),
+            ("receive", lambda: [self.receive(user, device, timestamp) for user, device, timestamp, _ in self.pending]),
+            ("acknowledge", lambda: [self.acknowledge(user, device, timestamp) for user, device, timestamp, shareType in self.pending if shareType == "file"]),
+        ]
+        for phase, tasks in phases:
+            before = await self.dbStatements()
+            start = time.perf_counter()
+            await asyncio.gather(*tasks())
+            duration = time.perf_counter() - start
+            stats = self.stats.setdefault(phaseEndpoints[phase], endpointstats())
+            stats.duration = duration
+            stats.dbStatements = await self.dbStatements() - before
+            print(phase + ": " + str(len(stats.latencies)) + " requests in " + format(duration, ".2f") + " s", file=sys.stderr)
+        return {endpoint: stats.summary() for endpoint, stats in self.stats.items()}
+
+"""
+Function that creates a database for the run and writes a db.conf for it to workdir. Login rate limits are disabled, as all simulated
+clients share one address, and the sweeper does not run, so its statements are not counted for the endpoints.
+"""
+def createDatabase(config: configparser.ConfigParser, host: str, port: int, workdir: str):
+    name = config['DBCONFIG']['name'] + "_benchmark"
+    connection = psycopg2.connect(host=host, port=port, dbname="postgres", user=config['DBCONFIG']['user'], password=config['DBCONFIG']['password'])
+    connection.autocommit = True
+    with connection.cursor() as cursor:
+        cursor.execute('DROP DATABASE IF EXISTS "' + name + '"')
+        cursor.execute('CREATE DATABASE "' + name + '"')
+    connection.close()
+    config['DBCONFIG']['name'] = name
+    config['DBCONFIG']['host'] = host
+    config['DBCONFIG']['port'] = str(port)
+    if not config.has_section('LOGIN'):
+        config.add_section('LOGIN')
+    config['LOGIN']['clientattempts'] = "0"
+    config['LOGIN']['userattempts'] = "0"
+    if not config.has_section('SWEEPER'):
+        config.add_section('SWEEPER')
+    config['SWEEPER']['interval'] = str(24 * 60 * 60)
+    with open(os.path.join(workdir, "db.conf"), "w") as configfile:
+        config.write(configfile)
+    return name
+
+"""
+Function to drop the database of the run.
+"""
+def dropDatabase(config: configparser.ConfigParser, host: str, port: int, name: str):
+    connection = psycopg2.connect(host=host, port=port, dbname="postgres", user=config['DBCONFIG']['user'], password=config['DBCONFIG']['password'])
+    connection.autocommit = True
+    with connection.cursor() as cursor:
+        cursor.execute('DROP DATABASE IF EXISTS "' + name + '" WITH (FORCE)')
+    connection.close()
+
+"""
+Function that starts the server in workdir and waits until it answers requests.
+"""
+def startServer(workdir: str, port: int, workers: int):
+    env = dict(os.environ, PROMETHEUS_MULTIPROC_DIR=os.path.join(workdir, "prometheus"))
+    os.makedirs(env["PROMETHEUS_MULTIPROC_DIR"])
+    server = subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--app-dir", os.path.dirname(os.path.abspath(__file__)), "--host", "127.0.0.1", "--port", str(port), "--workers", str(workers), "--log-level", "warning"], cwd=workdir, env=env)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError("Server exited with code " + str(server.returncode))
+        try:
+            if httpx.get("http://127.0.0.1:" + str(port) + "/metrics").status_code == 200:
+                return server
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError("Server did not start within 30 seconds")
+
+"""
+Function that prints the results as a table.
+"""
+def printReport(results: dict):
+    print("endpoint".ljust(28) + "requests".rjust(10) + "errors".rjust(8) + "req/s".rjust(10) + "p50 ms".rjust(10) + "p99 ms".rjust(10) + "statements".rjust(12))
+    for endpoint, result in results.items():
+        print(endpoint.ljust(28) + str(result["requests"]).rjust(10) + str(result["errors"]).rjust(8) + format(result["throughput"], ".1f").rjust(10) + format(result["p50"], ".1f").rjust(10) + format(result["p99"], ".1f").rjust(10) + format(result["dbStatementsPerRequest"], ".2f").rjust(12))
+
+"""
+Function that compares the results with a baseline. Latencies may grow and the throughput may drop by the tolerance, e.g. 0.25 for 25%,
+the statements per request by statementTolerance, as concurrent requests of a device may all miss the token cache. Returns the list of regressions.
+"""
+def compare(results: dict, baseline: dict, tolerance: float, statementTolerance: float):
+    regressions = []
+    for endpoint, old in baseline.items():
+        new = results.get(endpoint)
+        if new is None:
+            regressions.append(endpoint + ": not measured")
+            continue
+        for key in ["p50", "p99"]:
+            if new[key] > old[key] * (1 + tolerance):
+                regressions.append(endpoint + ": " + key + " " + format(old[key], ".1f") + " ms -> " + format(new[key], ".1f") + " ms")
+        if new["throughput"] < old["throughput"] * (1 - tolerance):
+            regressions.append(endpoint + ": throughput " + format(old["throughput"], ".1f") + " -> " + format(new["throughput"], ".1f") + " req/s")
+        if new["dbStatementsPerRequest"] > old["dbStatementsPerRequest"] * (1 + statementTolerance) + 0.01:
+            regressions.append(endpoint + ": statements per request " + format(old["dbStatementsPerRequest"], ".2f") + " -> " + format(new["dbStatementsPerRequest"], ".2f"))
+        if new["errors"] > old["errors"]:
+            regressions.append(endpoint + ": errors " + str(old["errors"]) + " -> " + str(new["errors"]))
+    return regressions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Load test of the share and receive endpoints against a throwaway database")
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--devices', type=int, default=3, help="devices per user, each device shares with all other devices of its user")
+    parser.add_argument('--shares', type=int, default=4, help="shares per device, every second share is a file")
+    parser.add_argument('--polls', type=int, default=5, help="checkAvailableData requests per device")
+    parser.add_argument('--filesize', type=int, default=64 * 1024)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--config', default="db.conf", help="db.conf with the database credentials")
+    parser.add_argument('--dbhost', default="localhost")
+    parser.add_argument('--dbport', type=int, default=5432)
+    parser.add_argument('--save', help="store the results as baseline in this file")
+    parser.add_argument('--baseline', help="compare the results with the baseline in this file")
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    parser.add_argument('--statementtolerance', type=float, default=0.1)
+    args = parser.parse_args()
+    if args.devices < 2:
+        parser.error("--devices must be at least 2, shares go to the other devices of a user")
+
+    runConfig = {key: value for key, value in vars(args).items() if key in configKeys}
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        # throughput and latency depend on the load, so runs with other options cannot be compared
+        differences = [key + " " + str(baseline["config"].get(key)) + " -> " + str(value) for key, value in runConfig.items() if baseline["config"].get(key) != value]
+        if differences:
+            parser.error("The baseline was measured with other options: " + ", ".join(differences))
+
+    config = configparser.ConfigParser()
+    if not config.read(args.config):
+        parser.error("Could not read " + args.config)
+    workdir = tempfile.mkdtemp(prefix="beamit-benchmark-")
+    dbname = createDatabase(config, args.dbhost, args.dbport, workdir)
+    server = None
+    try:
+        server = startServer(workdir, args.port, args.workers)
+
+        async def main():
+            async with httpx.AsyncClient(base_url="http://127.0.0.1:" + str(args.port), timeout=60) as client:
+                return await benchmark(client, args.users, args.devices, args.filesize, args.concurrency).run(args.shares, args.polls)
+        results = asyncio.run(main())
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        dropDatabase(config, args.dbhost, args.dbport, dbname)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    printReport(results)
+    if args.save:
+        with open(args.save, "w") as file:
+            json.dump({"config": runConfig, "results": results}, file, indent=2)
+    if baseline is not None:
+        regressions = compare(results, baseline["results"], args.tolerance, args.statementtolerance)
+        for regression in regressions:
+            print("Regression: " + regression)
+        if regressions:
+            sys.exit(1)
+        print("No regressions compared with " + args.baseline)
@@ -0,0 +1,224 @@
+import json
+import os
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+"""
+Compression of request and response bodies with gzip and, if the zstandard package is installed, zstd.
+"""
+
+# file types that are compressed already, compressing them again costs CPU without saving space
+compressedExtensions = {".7z", ".apk", ".avif", ".br", ".bz2", ".docx", ".epub", ".flac", ".gif", ".gz", ".heic", ".jar", ".jpeg", ".jpg", ".m4a", ".mkv", ".mov", ".mp3", ".mp4", ".odp", ".ods", ".odt", ".ogg", ".opus", ".pdf", ".png", ".pptx", ".rar", ".tgz", ".webm", ".webp", ".xlsx", ".xz", ".zip", ".zst"}
+# response types compressed by the middleware, files are sent as application/octet-stream and handled by the endpoints
+compressibleTypes = ("application/json", "text/")
+# bytes of input passed to the zstd decompressor at once, which bounds the output of a single call
+zstdInputSlice = 256
+
+"""
+Function that returns the encodings the server supports, the preferred one first.
+"""
+def supportedEncodings():
+    return ["zstd", "gzip"] if zstandard is not None else ["gzip"]
+
+"""
+Function that returns if an Accept-Encoding header accepts the encoding.
+"""
+def accepts(acceptEncoding: str | None, encoding: str):
+    accepted = {}
+    for part in (acceptEncoding or "").lower().split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        if params.strip().startswith("q="):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0
+        accepted[name.strip()] = quality
+    return accepted.get(encoding, accepted.get("*", 0)) > 0
+
+"""
+Function that chooses the encoding for a response from an Accept-Encoding header. Returns None if the client accepts none of them.
+"""
+def negotiate(acceptEncoding: str | None):
+    for encoding in supportedEncodings():
+        if accepts(acceptEncoding, encoding):
+            return encoding
+    return None
+
+"""
+Function that returns if a file is worth compressing, judged by its extension and by compressing a sample of its first bytes.
+"""
+def isCompressible(filename: str, sample: bytes, minRatio: float = 0.9):
+    if os.path.splitext(filename)[1].lower() in compressedExtensions or not sample:
+        return False
+    return len(zlib.compress(sample, 1)) < len(sample) * minRatio
+
+"""
+Streaming compressor for one response or file.
+"""
+class streamcompressor():
+    compressor = None
+    def __init__(self, encoding: str, level: int = 6) -> None:
+        if encoding == "gzip":
+            self.compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+        elif encoding == "zstd" and zstandard is not None:
+            self.compressor = zstandard.ZstdCompressor(level=min(level, 19)).compressobj()
+        else:
+            raise ValueError("Unsupported encoding " + encoding)
+
+    def compress(self, data: bytes):
+        return self.compressor.compress(data)
+
+    def flush(self):
+        return self.compressor.flush()
+
+"""
+Streaming decompressor for one request body. Every call returns at most about maxLength bytes per chunk, so small compressed inputs
+can not expand to huge buffers at once.
+"""
+class streamdecompressor():
+    encoding = ""
+    decompressor = None
+    maxLength = 0
+    def __init__(self, encoding: str, maxLength: int = 1024 * 1024) -> None:
+        self.encoding = encoding
+        self.maxLength = maxLength
+        if encoding == "gzip":
+            self.decompressor = zlib.decompressobj(31)
+        elif encoding == "zstd" and zstandard is not None:
+            self.decompressor = zstandard.ZstdDecompressor().decompressobj()
+        else:
+            raise ValueError("Unsupported encoding " + encoding)
+
+    """
+    Generator that yields the decompressed chunks of data.
+    """
+    def decompress(self, data: bytes):
+        if self.encoding == "gzip":
+            while data:
+                chunk = self.decompressor.decompress(data, self.maxLength)
+                data = self.decompressor.unconsumed_tail
+                if chunk:
+                    yield chunk
+        else:
+            for start in range(0, len(data), zstdInputSlice):
+                chunk = self.decompressor.decompress(data[start:start + zstdInputSlice])
+                if chunk:
+                    yield chunk
+
+    """
+    Returns if the compressed stream was complete.
+    """
+    def finished(self):
+        return self.decompressor.eof
+
+"""
+ASGI middleware that decompresses request bodies sent with Content-Encoding gzip or zstd and compresses JSON and text responses of at least
+minimumSize bytes with the encoding preferred by the client. Responses that already have a Content-Encoding are passed through unchanged.
+"""
+class compressionmiddleware():
+    minimumSize = 1024
+    level = 6
+    def __init__(self, app, minimumSize: int = 1024, level: int = 6) -> None:
+        self.app = app
+        self.minimumSize = minimumSize
+        self.level = level
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope["headers"])
+        contentEncoding = headers.get(b"content-encoding", b"identity").decode("latin-1").strip().lower()
+        if contentEncoding != "identity":
+            if contentEncoding not in supportedEncodings():
+                await self.__reject(send, "Content-Encoding " + contentEncoding + " is not supported")
+                return
+            # the body is passed on decompressed, so its length is unknown. The scope is changed in place, so the route the router stores in
+            # it is seen by the metrics middleware around this one
+            scope["headers"] = [(name, value) for name, value in scope["headers"] if name not in (b"content-encoding", b"content-length")]
+            receive = self.__decompressingReceive(receive, streamdecompressor(contentEncoding))
+        encoding = negotiate(headers.get(b"accept-encoding", b"").decode("latin-1"))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        await self.app(scope, receive, self.__compressingSend(send, encoding))
+
+    """
+    Method that wraps receive, so the application receives the decompressed body chunk by chunk. A truncated or corrupt body is passed on
+    as a disconnect of the client. After the body, receive is passed through, so the application still notices a disconnect.
+    """
+    def __decompressingReceive(self, receive, decompressor: streamdecompressor):
+        state = {"chunks": iter(()), "moreBody": True, "done": False}
+
+        async def decompressingReceive():
+            while not state["done"]:
+                try:
+                    chunk = next(state["chunks"], None)
+                    if chunk is not None:
+                        return {"type": "http.request", "body": chunk, "more_body": True}
+                    if not state["moreBody"]:
+                        if not decompressor.finished():
+                            raise ValueError("Compressed request body is incomplete")
+                        state["done"] = True
+                        return {"type": "http.request", "body": b"", "more_body": False}
+                except Exception:
+                    state["done"] = True
+                    return {"type": "http.disconnect"}
+                message = await receive()
+                if message["type"] != "http.request":
+                    return message
+                state["moreBody"] = message.get("more_body", False)
+                state["chunks"] = decompressor.decompress(message.get("body", b""))
+            return await receive()
+        return decompressingReceive
+
+    """
+    Method that wraps send, so JSON and text responses are compressed. Small responses sent in one message are left uncompressed.
+    """
+    def __compressingSend(self, send, encoding: str):
+        state = {"start": None, "compressor": None, "passthrough": False}
+
+        async def compressingSend(message):
+            if message["type"] == "http.response.start":
+                headers = dict(message.get("headers", []))
+                contentType = headers.get(b"content-type", b"").decode("latin-1")
+                if b"content-encoding" in headers or not contentType.startswith(compressibleTypes) or message["status"] in (204, 304):
+                    state["passthrough"] = True
+                    await send(message)
+                else:
+                    state["start"] = message
+                return
+            if state["passthrough"] or message["type"] != "http.response.body":
+                await send(message)
+                return
+            body, moreBody = message.get("body", b""), message.get("more_body", False)
+            if state["start"] is not None:
+                start, state["start"] = state["start"], None
+                if not moreBody and len(body) < self.minimumSize:
+                    state["passthrough"] = True
+                    await send(start)
+                    await send(message)
+                    return
+                state["compressor"] = streamcompressor(encoding, self.level)
+                headers = [(name, value) for name, value in start.get("headers", []) if name != b"content-length"]
+                headers += [(b"content-encoding", encoding.encode()), (b"vary", b"Accept-Encoding")]
+                await send(dict(start, headers=headers))
+            data = state["compressor"].compress(body)
+            if not moreBody:
+                data += state["compressor"].flush()
+            if data or not moreBody:
+                await send({"type": "http.response.body", "body": data, "more_body": moreBody})
+        return compressingSend
+
+    """
+    Method that answers a request with an unsupported Content-Encoding with 415 Unsupported Media Type.
+    """
+    async def __reject(self, send, message: str):
+        body = json.dumps({"message": message, "successfull": False}).encode()
+        await send({"type": "http.response.start", "status": 415, "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]})
+        await send({"type": "http.response.body", "body": body})
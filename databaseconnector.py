@@ -1,48 +1,119 @@
 import psycopg2
-import pwcrypt
-import re
+import psycopg2.errors
+import psycopg2.extensions
+import psycopg2.pool
+from tokencache import tokencache
+import validation
+import metrics
+import asyncio
+import functools
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from typing import List
 
+"""
+Raised inside a transaction when a user exceeds the storage quota.
+"""
+class QuotaExceeded(Exception):
+    pass
+
+"""
+Raised inside a transaction when a resumable upload to be shared does not exist (anymore).
+"""
+class UploadNotFound(Exception):
+    pass
+
+# name of the database method run by db.run in the current thread, used as label of the statement counter
+currentQuery = threading.local()
+
+"""
+Cursor that counts the statements it executes by the database method that runs them.
+"""
+class countingcursor(psycopg2.extensions.cursor):
+    def execute(self, query, vars=None):
+        metrics.dbStatements.labels(getattr(currentQuery, "label", None) or "direct").inc()
+        return super().execute(query, vars)
+
+"""
+Function that hashes the timestamps of a page of pending entries to its ETag. more and limit are part of the response, so a full page
+that gets further entries later or is requested with another limit has another ETag.
+"""
+def pageTag(timestamps: list, metadataOnly: bool, more: bool, limit: int | None):
+    page = ",".join(timestamp.isoformat() for timestamp in timestamps) + (";metadata" if metadataOnly else "") + (";more" if more else "") + ";limit=" + str(limit)
+    return '"' + hashlib.sha256(page.encode()).hexdigest()[:32] + '"'
+
 class dbconnectors_postgresql():
     logger = None
-    connection = None
-    usernameregex = "^[a-zA-Z0-9]{4,20}$"
-    devicenameregex = "^[a-zA-Z0-9-_.]{4,64}$"
+    pool = None
+    poolSemaphore = None
+    executor = None
+    tokenCache = None
+    connectionParameters: dict = {}
+    # channel for notifications about new shares, the payload is a JSON object with "Username", "DeviceName" and "Timestamp"
+    shareChannel = "beamit_share"
+    # channel for changed device tokens, the payload is a JSON object with "Username" and "DeviceName", which is null for all devices of the user
+    tokenChannel = "beamit_token"
+    connectionLastUsed: dict = {}
+    # connections idle for longer than this (seconds) are pinged before they are handed out again
+    healthcheckInterval = 30
+    # bytes and number of files a user may store in shares if the user has no own limit in the "UserLimits" table, 0 is unlimited
+    quotaBytes = 0
+    quotaFiles = 0
+    # attempts to find timestamps for new shares that no concurrent share of the same user took
+    shareInsertAttempts = 5
     def __init__(self, logger) -> None:
         self.logger = logger
+        self.tokenCache = tokencache()
 
     """
-    Initializes the database connection and creates necessary tables if they do not exist.
+    Initializes the database connection pool and creates necessary tables if they do not exist.
+    minconn is the number of idle connections kept open, maxconn the upper limit of concurrently checked out connections.
+    Without initTables only the pool is opened, e.g. in workers started after the tables were created, since migrations lock the tables.
     """
-    def initdb(self, host, port, dbname, user, password):
+    def initdb(self, host, port, dbname, user, password, minconn=2, maxconn=10, initTables=True):
         self.logger.debug("Connecting to posgresql database...")
         try:
-            self.connection = psycopg2.connect(user=user, host=host, port=port, password=password, dbname=dbname)
+            self.connectionParameters = {"user": user, "host": host, "port": port, "password": password, "dbname": dbname}
+            self.pool = psycopg2.pool.ThreadedConnectionPool(minconn, maxconn, cursor_factory=countingcursor, **self.connectionParameters)
+            # block instead of failing with PoolError when all connections are checked out
+            self.poolSemaphore = threading.BoundedSemaphore(maxconn)
+            # one worker per connection, so queries awaited from the event loop never wait for a free connection inside a thread
+            self.executor = ThreadPoolExecutor(max_workers=maxconn, thread_name_prefix="db")
+            self.connectionLastUsed = {}
+            if not initTables:
+                self.logger.debug("Database connected successfully")
+                return True
             existingtables = self.__execute_read_query("SELECT table_name FROM information_schema.tables WHERE table_schema = 'public';")
-            self.logger.debug("Existing Tables: " + str(existingtables))
+            self.logger.debug("Existing Tables: %s", existingtables)
+            if existingtables is False:
+                return False
+            existingtables = {table[0] for table in existingtables}
             # if there are no existing tables, create new ones
-            if existingtables == []:
+            if not existingtables:
                 self.logger.info("New database detected, creating tables...")
-                self.__initTables()
-                return True
-            # if all tables don't exist, the database is corrupt
-            if str(existingtables) != "[('User',), ('Device',), ('ShareData',)]":
+            # if the base tables don't exist, the database is corrupt
+            elif not {"User", "Device", "ShareData"} <= existingtables:
                 self.logger.error("Database corrupt, not all tables exist")
                 return False
-            else:
-                self.logger.debug("Database connected successfully")
-                return True
+            # create tables and indexes added by later versions and migrate existing data
+            self.__initTables(existingtables)
+            self.logger.debug("Database connected successfully")
+            return True
         # handle exceptions related to connection issues
         except psycopg2.Error as e:
             self.logger.error("Could not open database: " + str(e))
             return False
         
     """
-    Closes the database connection.
+    Closes all connections of the database connection pool.
     """     
     def closedb(self):
         try:
-            self.connection.close()
+            self.executor.shutdown(wait=True)
+            self.pool.closeall()
             self.logger.debug("Closed database connection")
             return True
         except psycopg2.Error as e:
@@ -50,133 +121,274 @@ class dbconnectors_postgresql():
             return False
 
     """
-    Creates necessary tables in the database.
+    Opens a new connection outside of the pool, e.g. for listening to notifications. The caller has to close it.
     """
-    def __initTables(self):
-        user_table = 'CREATE TABLE "User" ("Username" TEXT NOT NULL, "PasswordHash" TEXT NOT NULL, "PasswordSalt" TEXT NOT NULL, PRIMARY KEY("Username"));'
-        device_table = 'CREATE TABLE "Device" ("DeviceName" TEXT NOT NULL, "Username" TEXT NOT NULL, "DeviceToken" TEXT NOT NULL, PRIMARY KEY("DeviceName", "Username"));'
-        sharedata_table = 'CREATE TABLE "ShareData" ("Timestamp" TIMESTAMPTZ NOT NULL,"Username" TEXT NOT NULL, "targetDevices" TEXT NOT NULL, "DataType" TEXT NOT NULL, "Data" TEXT NOT NULL, "AutoOpen" BOOLEAN NOT NULL, "Encrypted" BOOLEAN NOT NULL, PRIMARY KEY("Timestamp", "Username"));'
-        
-        self.__execute_write_query(user_table, [])
-        self.__execute_write_query(device_table, [])
-        self.__execute_write_query(sharedata_table, [])
+    def newConnection(self):
+        connection = psycopg2.connect(cursor_factory=countingcursor, **self.connectionParameters)
+        connection.set_session(autocommit=True)
+        return connection
 
     """
-    Checks if the username and password are valid and match a user in the database.
+    Method that tries to take the session level advisory lock with the given key on a new connection, so of several processes only one
+    runs a task at a time. Returns the connection holding the lock, which releases it when it is closed, or None if another process holds it.
     """
-    def login(self, username: str, password: str):
-        if self.checkUserNameExists(username=username):
-            # retrieve user's hashed password and salt
-            user = self.__execute_read_query('SELECT "PasswordHash", "PasswordSalt" FROM "User" Where "Username" = %s;', [username])
-             # check if the password is correct using the password hash and salt
-            if pwcrypt.is_correct_password(user[0][1], user[0][0], password):
-                return True
-            else:
-                return False
+    def tryAdvisoryLock(self, key: int):
+        try:
+            connection = self.newConnection()
+        except psycopg2.Error as e:
+            self.logger.error("Could not open connection for advisory lock: " + str(e))
+            return None
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT pg_try_advisory_lock(%s);", [key])
+                if cursor.fetchone()[0]:
+                    return connection
+        except psycopg2.Error as e:
+            self.logger.error("Could not take advisory lock: " + str(e))
+        connection.close()
+        return None
+
+    """
+    Runs a blocking method of this class in the database thread pool, so it can be awaited without stalling the event loop.
+    The duration of the method is recorded in the metrics, labeled with its name.
+    """
+    async def run(self, method, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(self.__timed, method, kwargs))
+
+    """
+    Method that executes a method with the given arguments and records its duration and statements, called in the database thread pool.
+    """
+    def __timed(self, method, kwargs: dict):
+        label = method.__name__
+        currentQuery.label = label
+        start = time.perf_counter()
+        try:
+            return method(**kwargs)
+        except Exception:
+            metrics.dbQueryErrors.labels(label).inc()
+            raise
+        finally:
+            metrics.dbQueryDuration.labels(label).observe(time.perf_counter() - start)
+            currentQuery.label = None
+
+    """
+    Creates necessary tables and indexes in the database if they do not exist and migrates data of existing tables.
+    All statements are idempotent and executed in one transaction.
+    """
+    def __initTables(self, existingtables: set):
+        user_table = 'CREATE TABLE IF NOT EXISTS "User" ("Username" TEXT NOT NULL, "PasswordHash" TEXT NOT NULL, "PasswordSalt" TEXT NOT NULL, PRIMARY KEY("Username"));'
+        # PBKDF2 iterations of the password hash, users created before the column existed were hashed with 100000 iterations
+        user_iterations = 'ALTER TABLE "User" ADD COLUMN IF NOT EXISTS "PasswordIterations" INTEGER NOT NULL DEFAULT 100000;'
+        # "DeviceToken" holds the SHA-256 hex digest of the token, the token itself is only known to the device
+        device_table = 'CREATE TABLE IF NOT EXISTS "Device" ("DeviceName" TEXT NOT NULL, "Username" TEXT NOT NULL, "DeviceToken" TEXT NOT NULL, PRIMARY KEY("DeviceName", "Username"), CONSTRAINT "Device_User_fkey" FOREIGN KEY("Username") REFERENCES "User" ("Username") ON DELETE CASCADE);'
+        device_username_index = 'CREATE INDEX IF NOT EXISTS "Device_Username_idx" ON "Device" ("Username");'
+        # tokens issued before only hashes were stored start with "T-", a hex digest never does
+        device_token_migration = 'UPDATE "Device" SET "DeviceToken" = encode(sha256(convert_to("DeviceToken", \'UTF8\')), \'hex\') WHERE "DeviceToken" LIKE \'T-%\';'
+        sharedata_table = 'CREATE TABLE IF NOT EXISTS "ShareData" ("Timestamp" TIMESTAMPTZ NOT NULL,"Username" TEXT NOT NULL, "targetDevices" TEXT NOT NULL, "DataType" TEXT NOT NULL, "Data" TEXT NOT NULL, "AutoOpen" BOOLEAN NOT NULL, "Encrypted" BOOLEAN NOT NULL, PRIMARY KEY("Timestamp", "Username"), CONSTRAINT "ShareData_User_fkey" FOREIGN KEY("Username") REFERENCES "User" ("Username") ON DELETE CASCADE);'
+        sharedata_index = 'CREATE INDEX IF NOT EXISTS "ShareData_Username_idx" ON "ShareData" ("Username", "Timestamp");'
+        # files are stored once per content, "RefCount" is the number of "ShareData" rows referencing the blob by "BlobHash"
+        blob_table = 'CREATE TABLE IF NOT EXISTS "Blob" ("Hash" TEXT NOT NULL, "Size" BIGINT NOT NULL, "RefCount" INTEGER NOT NULL, PRIMARY KEY("Hash"));'
+        sharedata_blobhash = 'ALTER TABLE "ShareData" ADD COLUMN IF NOT EXISTS "BlobHash" TEXT;'
+        # one row per device a share is still pending for, the primary key serves the per-device inbox lookup
+        sharetarget_table = 'CREATE TABLE IF NOT EXISTS "ShareTarget" ("Timestamp" TIMESTAMPTZ NOT NULL, "Username" TEXT NOT NULL, "DeviceName" TEXT NOT NULL, PRIMARY KEY("Username", "DeviceName", "Timestamp"), FOREIGN KEY("Timestamp", "Username") REFERENCES "ShareData" ("Timestamp", "Username") ON DELETE CASCADE, CONSTRAINT "ShareTarget_Device_fkey" FOREIGN KEY("DeviceName", "Username") REFERENCES "Device" ("DeviceName", "Username") ON DELETE CASCADE ON UPDATE CASCADE);'
+        sharetarget_index = 'CREATE INDEX IF NOT EXISTS "ShareTarget_Share_idx" ON "ShareTarget" ("Timestamp", "Username");'
+        # files stay on the server after a device received them until the device acknowledges them or the retention time is over
+        sharetarget_received = 'ALTER TABLE "ShareTarget" ADD COLUMN IF NOT EXISTS "Received" TIMESTAMPTZ;'
+        sharetarget_received_index = 'CREATE INDEX IF NOT EXISTS "ShareTarget_Received_idx" ON "ShareTarget" ("Received") WHERE "Received" IS NOT NULL;'
+        # resumable uploads and the byte ranges received so far
+        upload_table = 'CREATE TABLE IF NOT EXISTS "Upload" ("UploadID" TEXT NOT NULL, "Username" TEXT NOT NULL, "Filename" TEXT NOT NULL, "Size" BIGINT NOT NULL, "targetDevices" TEXT[] NOT NULL, "AutoOpen" BOOLEAN NOT NULL, "Encrypted" BOOLEAN NOT NULL, "Created" TIMESTAMPTZ NOT NULL DEFAULT NOW(), PRIMARY KEY("UploadID"), CONSTRAINT "Upload_User_fkey" FOREIGN KEY("Username") REFERENCES "User" ("Username") ON DELETE CASCADE);'
+        uploadchunk_table = 'CREATE TABLE IF NOT EXISTS "UploadChunk" ("UploadID" TEXT NOT NULL, "Offset" BIGINT NOT NULL, "Length" BIGINT NOT NULL, PRIMARY KEY("UploadID", "Offset"), FOREIGN KEY("UploadID") REFERENCES "Upload" ("UploadID") ON DELETE CASCADE);'
+        # limits of single users overriding the configured defaults, NULL means the default applies
+        # "ShareTTL" is the number of seconds a share is kept (0 keeps shares forever), "MaxShares" the number of shares kept per user (0 is unlimited)
+        userlimits_table = 'CREATE TABLE IF NOT EXISTS "UserLimits" ("Username" TEXT NOT NULL, "ShareTTL" INTEGER, "MaxShares" INTEGER, PRIMARY KEY("Username"), FOREIGN KEY("Username") REFERENCES "User" ("Username") ON DELETE CASCADE);'
+        # storage quota in bytes and number of files, 0 is unlimited
+        userlimits_maxbytes = 'ALTER TABLE "UserLimits" ADD COLUMN IF NOT EXISTS "MaxBytes" BIGINT;'
+        userlimits_maxfiles = 'ALTER TABLE "UserLimits" ADD COLUMN IF NOT EXISTS "MaxFiles" INTEGER;'
+        # bytes and number of files in the file shares of a user, updated in the transactions creating and deleting shares
+        userusage_table = 'CREATE TABLE IF NOT EXISTS "UserUsage" ("Username" TEXT NOT NULL, "Bytes" BIGINT NOT NULL, "Files" INTEGER NOT NULL, PRIMARY KEY("Username"), FOREIGN KEY("Username") REFERENCES "User" ("Username") ON DELETE CASCADE);'
+        userusage_migration = 'INSERT INTO "UserUsage" ("Username", "Bytes", "Files") SELECT "ShareData"."Username", sum("Blob"."Size"), count(*) FROM "ShareData" JOIN "Blob" ON "Blob"."Hash" = "ShareData"."BlobHash" JOIN "User" ON "User"."Username" = "ShareData"."Username" GROUP BY "ShareData"."Username" ON CONFLICT DO NOTHING;'
+        # shares created before the ShareTarget table existed only have their pending devices in "targetDevices", e.g. "{device1, device2}"
+        sharetarget_migration = 'INSERT INTO "ShareTarget" ("Timestamp", "Username", "DeviceName") SELECT DISTINCT "Timestamp", "ShareData"."Username", trim(device) FROM "ShareData", unnest(string_to_array(trim(both \'{}\' from "targetDevices"), \',\')) AS device WHERE trim(device) <> \'\' AND EXISTS (SELECT 1 FROM "Device" WHERE "Device"."Username" = "ShareData"."Username" AND "Device"."DeviceName" = trim(device)) ON CONFLICT DO NOTHING;'
+        # tables created before the foreign keys existed may contain rows of removed users and devices, which are deleted before the key is added
+        foreignkey_migrations = [
+            ("Device_User_fkey", 'DELETE FROM "Device" WHERE NOT EXISTS (SELECT 1 FROM "User" WHERE "User"."Username" = "Device"."Username");', 'ALTER TABLE "Device" ADD CONSTRAINT "Device_User_fkey" FOREIGN KEY("Username") REFERENCES "User" ("Username") ON DELETE CASCADE;'),
+            ("ShareData_User_fkey", 'WITH removed AS (DELETE FROM "ShareData" WHERE NOT EXISTS (SELECT 1 FROM "User" WHERE "User"."Username" = "ShareData"."Username") RETURNING "BlobHash") UPDATE "Blob" SET "RefCount" = "Blob"."RefCount" - released.count FROM (SELECT "BlobHash", count(*) AS count FROM removed WHERE "BlobHash" IS NOT NULL GROUP BY "BlobHash") AS released WHERE "Blob"."Hash" = released."BlobHash";', 'ALTER TABLE "ShareData" ADD CONSTRAINT "ShareData_User_fkey" FOREIGN KEY("Username") REFERENCES "User" ("Username") ON DELETE CASCADE;'),
+            ("ShareTarget_Device_fkey", 'DELETE FROM "ShareTarget" WHERE NOT EXISTS (SELECT 1 FROM "Device" WHERE "Device"."Username" = "ShareTarget"."Username" AND "Device"."DeviceName" = "ShareTarget"."DeviceName");', 'ALTER TABLE "ShareTarget" ADD CONSTRAINT "ShareTarget_Device_fkey" FOREIGN KEY("DeviceName", "Username") REFERENCES "Device" ("DeviceName", "Username") ON DELETE CASCADE ON UPDATE CASCADE;'),
+            ("Upload_User_fkey", 'DELETE FROM "Upload" WHERE NOT EXISTS (SELECT 1 FROM "User" WHERE "User"."Username" = "Upload"."Username");', 'ALTER TABLE "Upload" ADD CONSTRAINT "Upload_User_fkey" FOREIGN KEY("Username") REFERENCES "User" ("Username") ON DELETE CASCADE;'),
+        ]
+
+        with self.__transaction() as cursor:
+            for query in [user_table, user_iterations, device_table, device_username_index, device_token_migration, sharedata_table, sharedata_index, blob_table, sharedata_blobhash, sharetarget_table, sharetarget_index, sharetarget_received, sharetarget_received_index, upload_table, uploadchunk_table, userlimits_table, userlimits_maxbytes, userlimits_maxfiles, userusage_table]:
+                cursor.execute(query)
+            if existingtables and "ShareTarget" not in existingtables:
+                self.logger.info("Migrating share targets to table ShareTarget...")
+                cursor.execute(sharetarget_migration)
+            for constraint, cleanup, migration in foreignkey_migrations:
+                cursor.execute('SELECT 1 FROM pg_constraint WHERE conname = %s;', [constraint])
+                if cursor.fetchone() is None:
+                    self.logger.info("Adding foreign key " + constraint + "...")
+                    cursor.execute(cleanup)
+                    cursor.execute(migration)
+            if existingtables and "UserUsage" not in existingtables:
+                self.logger.info("Counting storage usage of all users...")
+                cursor.execute(userusage_migration)
+
+    """
+    Method to retrieve the salt, password hash and PBKDF2 iterations of a user to check a login.
+    """
+    def getPasswordHash(self, username: str):
+        user = self.__execute_read_query('SELECT "PasswordSalt", "PasswordHash", "PasswordIterations" FROM "User" Where "Username" = %s;', [username])
+        if user:
+            return user[0], True
         else:
-            return False
+            return "User does not exist", False
+
+    """
+    Method to replace the password hash of a user, e.g. to rehash it with a different number of iterations.
+    """
+    def updatePasswordHash(self, username: str, salt: str, pw_hash: str, iterations: int):
+        return self.__execute_write_query('UPDATE "User" SET "PasswordHash" = %s, "PasswordSalt" = %s, "PasswordIterations" = %s WHERE "Username" = %s;', [pw_hash, salt, iterations, username])
 
     """
-    Method to add a user to the database.
+    Method to check if a new user can be added with the given username, before the password is hashed.
     """
-    def addUser(self, username: str, password: str):
+    def checkNewUser(self, username: str):
         # Check if username follows the required format
-        if not re.match(self.usernameregex , username):
+        if not validation.isUsername(username):
             self.logger.error("Could not add user \"" + username + "\" - invalid combination of characters") 
-            return "Username is not valid. Username must be a combination of 4 to 20 uppercase letters, lowercase letters, and numbers", False
+            return validation.usernameMessage, False
         # Check if the username already exists in the database
-        if self.checkUserNameExists(username):
+        exists, result = self.checkUserNameExists(username)
+        if not result:
+            return "Error occoured", False
+        if exists:
             self.logger.debug("User \"" + username + "\" already exists")
             return "User already exists", False
-        else:
-            try: 
-                salt, pw_hash = pwcrypt.hash_new_password(password)
-                self.__execute_write_query('INSERT INTO "User" ("Username", "PasswordHash", "PasswordSalt") VALUES (%s, %s, %s);', [username, pw_hash, salt])
-                self.logger.debug("Add User \"" + username + "\" successfully")
-                return "User registered successfully", True
-            except:
-                self.logger.error("Could not add user!") 
-                return "Error occurred, could not add user!", False
+        return "", True
+
+    """
+    Method to add a user with an already hashed password to the database.
+    """
+    def addUser(self, username: str, salt: str, pw_hash: str, iterations: int):
+        if not validation.isUsername(username):
+            return validation.usernameMessage, False
+        try:
+            # A user registered concurrently with the same name is detected by the primary key instead of a preceding check
+            with self.__transaction() as cursor:
+                cursor.execute('INSERT INTO "User" ("Username", "PasswordHash", "PasswordSalt", "PasswordIterations") VALUES (%s, %s, %s, %s) ON CONFLICT ("Username") DO NOTHING RETURNING 1;', [username, pw_hash, salt, iterations])
+                added = cursor.fetchone() is not None
+        except psycopg2.Error as e:
+            self.logger.error("Could not add user: " + str(e))
+            return "Error occurred, could not add user!", False
+        if not added:
+            self.logger.debug("User \"" + username + "\" already exists")
+            return "User already exists", False
+        self.logger.debug("Add User \"" + username + "\" successfully")
+        return "User registered successfully", True
             
     """
-    Method to delete an user from the database.
+    Method to delete a user with all devices, shares and uploads in one transaction. Returns the deleted shares and the IDs of the
+    deleted uploads, whose files have to be removed afterwards.
     """
     def removeUser(self, username: str):
-        # Check if the user exists in the database
-        if not self.checkUserNameExists(username):
+        try:
+            # The shares are deleted first to release their blobs, deleting the user cascades to the devices, share targets, uploads, limits and usage
+            with self.__transaction() as cursor:
+                cursor.execute('DELETE FROM "ShareData" WHERE "Username" = %s RETURNING *', [username])
+                shareData = cursor.fetchall()
+                self.__releaseBlobs(cursor, shareData)
+                cursor.execute('DELETE FROM "Upload" WHERE "Username" = %s RETURNING "UploadID"', [username])
+                uploads = [upload[0] for upload in cursor.fetchall()]
+                cursor.execute('DELETE FROM "User" WHERE "Username" = %s RETURNING 1', [username])
+                removed = cursor.fetchone() is not None
+                if removed:
+                    self.__notifyTokenChange(cursor, username, [None])
+        except psycopg2.Error as e:
+            self.logger.error("Error occurred, could not remove user: " + str(e))
+            return "Error occurred, could not remove user!", False
+        if not removed:
             self.logger.debug("User \"" + username + "\" does not exist")
             return "User does not exist", False
-        # Remove the user and all their devices from the database
-        else:
-            try: 
-                self.__execute_write_query('DELETE FROM "User" WHERE "Username" = %s', [username])
-                self.__execute_write_query('DELETE FROM "Device" WHERE "Username" = %s', [username])
-                self.logger.debug("User \"" + username + "\" and Devices removed successfully")
-                return "User and Devices removed successfully", True
-            except:
-                self.logger.error("Error occurred, could not remove user!") 
-                return "Error occurred, could not remove user!", False
+        self.tokenCache.invalidate(username=username)
+        self.logger.debug("User \"" + username + "\" and Devices removed successfully")
+        return {"shares": shareData, "uploads": uploads}, True
 
     """
     Method to add a device.
     """
     def addDevice(self, username: str, devicename: str, devicetoken: str):
         # Check if the device name follows the required format
-        if not re.match(self.devicenameregex , devicename):
+        if not validation.isDevicename(devicename):
             self.logger.error("Could not add device \"" + devicename + "\" - invalid combination of characters") 
-            return "Devicename is not valid. Devicename must be a combination of 4 to 20 uppercase letters, lowercase letters, and numbers", False
-        if self.checkDeviceNameExists(username=username, devicename=devicename):
-            self.removeDevice(username=username, targetDevice=devicename)
-        # Add the device to the database
-        self.__execute_write_query('INSERT INTO "Device" ("DeviceName", "Username", "DeviceToken") VALUES (%s, %s, %s);', [devicename, username, devicetoken])
+            return validation.devicenameMessage, False
+        # Add the device to the database or replace the token of an existing device, keeping the shares pending for it
+        try:
+            with self.__transaction() as cursor:
+                cursor.execute('INSERT INTO "Device" ("DeviceName", "Username", "DeviceToken") VALUES (%s, %s, %s) ON CONFLICT ("DeviceName", "Username") DO UPDATE SET "DeviceToken" = EXCLUDED."DeviceToken";', [devicename, username, tokencache.hashToken(devicetoken)])
+                self.__notifyTokenChange(cursor, username, [devicename])
+        except psycopg2.Error as e:
+            self.logger.error("Could not add device: " + str(e))
+            return "Error occurred, could not add device!", False
+        self.tokenCache.invalidate(username=username, devicename=devicename)
         self.logger.debug("Add Device \"" + devicename + "\" from \"" + username + "\" successfully")
         return "", True
 
     """
-    Method to delete a device.
+    Method to delete a device and its pending shares in one transaction, shares pending for other devices are kept.
+    Returns the deleted shares, whose files have to be removed afterwards.
     """
     def removeDevice(self, username: str, targetDevice: str):
-        # Check if the user exists
-        if not self.checkUserNameExists(username):
-            self.logger.debug("User \"" + username + "\" does not exist")
-            return "User does not exist", False
-        else:
-            # Check if the device exists
-            if not self.checkDeviceNameExists(username, targetDevice):
-                self.logger.debug("Device \"" + targetDevice + "\" from user \"" + username + "\" does not exist")
-                return "Device does not exist", False
-            else:
-                try:
-                    # Remove the device from the database 
-                    self.__execute_write_query('DELETE FROM "Device" WHERE "Username" = %s AND "DeviceName" = %s' , [username, targetDevice])
-                    self.logger.debug('Device "' + targetDevice + '" from user "' + username + '" removed successfully')
-                    return "Device removed successfully", True
-                except:
-                    self.logger.error("Could not remove device!") 
-                    return "Error occurred, could  not remove device!", False
+        try:
+            with self.__transaction() as cursor:
+                # The shares pending for the device are locked in the same order as receiveShares, so concurrent deliveries see the final targets
+                cursor.execute('SELECT "ShareData"."Timestamp" FROM "ShareData" JOIN "ShareTarget" USING ("Timestamp", "Username") WHERE "ShareTarget"."Username" = %s AND "ShareTarget"."DeviceName" = %s ORDER BY "ShareData"."Timestamp" FOR UPDATE OF "ShareData"', [username, targetDevice])
+                timestamps = [share[0] for share in cursor.fetchall()]
+                # Deleting the device cascades to its share targets, shares without other target devices are deleted as well
+                cursor.execute('DELETE FROM "Device" WHERE "Username" = %s AND "DeviceName" = %s RETURNING 1', [username, targetDevice])
+                removed = cursor.fetchone() is not None
+                if removed:
+                    self.__notifyTokenChange(cursor, username, [targetDevice])
+                cursor.execute('DELETE FROM "ShareData" WHERE "Username" = %s AND "Timestamp" = ANY(%s) AND NOT EXISTS (SELECT 1 FROM "ShareTarget" WHERE "ShareTarget"."Username" = "ShareData"."Username" AND "ShareTarget"."Timestamp" = "ShareData"."Timestamp") RETURNING *', [username, timestamps])
+                shareData = cursor.fetchall()
+                self.__releaseBlobs(cursor, shareData)
+        except psycopg2.Error as e:
+            self.logger.error("Could not remove device: " + str(e))
+            return "Error occurred, could  not remove device!", False
+        if not removed:
+            self.logger.debug("Device \"" + targetDevice + "\" from user \"" + username + "\" does not exist")
+            return "Device does not exist", False
+        self.tokenCache.invalidate(username=username, devicename=targetDevice)
+        self.logger.debug('Device "' + targetDevice + '" from user "' + username + '" removed successfully')
+        return shareData, True
 
     """
     Method to give a device a new name.
     """
     def renameDevice(self, username: str, deviceNameOld: str, deviceNameNew: str):
         # Check if the new device name is valid
-        if not re.match(self.devicenameregex , deviceNameNew):
+        if not validation.isDevicename(deviceNameNew):
             self.logger.error("Could not rename device \"" + deviceNameOld + "\" to \"" + deviceNameNew + "\"- invalid combination of characters") 
-            return "Devicename is not valid. New devicename must be a combination of 4 to 20 uppercase letters, lowercase letters, and numbers", False
-        # Check if the new device name already exists
-        if self.checkDeviceNameExists(username, deviceNameNew):
+            return validation.devicenameMessage, False
+        try:
+            # Renaming the device moves its pending shares with the foreign key, an existing device of the new name violates the primary key
+            with self.__transaction() as cursor:
+                cursor.execute('Update "Device" Set "DeviceName" = %s Where "Username" = %s AND "DeviceName" = %s', [deviceNameNew, username, deviceNameOld])
+                renamed = cursor.rowcount > 0
+                if renamed:
+                    self.__notifyTokenChange(cursor, username, [deviceNameOld, deviceNameNew])
+        except psycopg2.errors.UniqueViolation:
             self.logger.debug("Could not rename device \"" + deviceNameOld + "\" to \"" + deviceNameNew + "\" - \"" + deviceNameNew + "\" already does not exist!")
             return "Could not rename device \"" + deviceNameOld + "\" to \"" + deviceNameNew + "\" - \"" + deviceNameNew + "\" already does not exist!", False
-        try:
-            # Rename the device in the database
-            if self.__execute_write_query('Update "Device" Set "DeviceName" = %s Where "Username" = %s AND "DeviceName" = %s', [deviceNameNew, username, deviceNameOld]):
-                self.logger.debug('Device "' + deviceNameOld + '" from user "' + username + '" renamed to "' + deviceNameNew + '" successfully')
-                return "Device renamed successfully", True
-            else:
-                return "Error", False
-        except:
-            self.logger.error("Could not remove device!") 
+        except psycopg2.Error as e:
+            self.logger.error("Could not rename device: " + str(e))
             return "Error occurred, could  not remove device!", False
+        if not renamed:
+            return "Error", False
+        self.tokenCache.invalidate(username=username, devicename=deviceNameOld)
+        self.tokenCache.invalidate(username=username, devicename=deviceNameNew)
+        self.logger.debug('Device "' + deviceNameOld + '" from user "' + username + '" renamed to "' + deviceNameNew + '" successfully')
+        return "Device renamed successfully", True
 
     """
     Method to get a list of devices associated with a user.
@@ -190,20 +402,96 @@ class dbconnectors_postgresql():
         return devices, True
         
     """
-    Method to check if the device token is valid for the device.
+    Method to notify all server processes that the tokens of the devices changed, so they drop them from their token cache.
+    The notifications are sent when the transaction commits. A devicename of None stands for all devices of the user.
+    """
+    def __notifyTokenChange(self, cursor, username: str, devicenames: list):
+        cursor.execute('SELECT pg_notify(%s, json_build_object(\'Username\', %s, \'DeviceName\', device)::text) FROM unnest(%s::text[]) AS device;', [self.tokenChannel, username, devicenames])
+
+    """
+    Method to check if the device token is valid for the device. Only the hash of the token is compared, using the primary key of the device.
+    Validated tokens are cached, so repeated checks skip the database.
     """
     def checkDeviceToken(self, username: str, devicename: str, devicetoken: str):
-        if self.__execute_read_query('Select * FROM "Device" Where "Username" = %s AND "DeviceName" = %s AND "DeviceToken" = %s', [username, devicename, devicetoken]):
+        if not devicetoken:
+            return False
+        if self.tokenCache.check(username=username, devicename=devicename, devicetoken=devicetoken):
+            metrics.tokenCacheRequests.labels("hit").inc()
+            return True
+        metrics.tokenCacheRequests.labels("miss").inc()
+        generation = self.tokenCache.generation
+        if self.__execute_read_query('SELECT 1 FROM "Device" Where "Username" = %s AND "DeviceName" = %s AND "DeviceToken" = %s', [username, devicename, tokencache.hashToken(devicetoken)]):
+            self.tokenCache.add(username=username, devicename=devicename, devicetoken=devicetoken, generation=generation)
             return True
         else:
             return False
         
     """
-    Method to create a new file share.
+    Method to create a new file share. The content of the file is referenced by the hash of its blob.
     """
-    def newFileShare(self, username: str, targetDevices: List[str], filename: str | None, autoOpen: bool, encrypted: bool):
-        return self.__newShare(username=username, targetDevices=targetDevices, dataType="file", data=filename, autoOpen=autoOpen, encrypted=encrypted)
+    def newFileShare(self, username: str, targetDevices: List[str], filename: str | None, autoOpen: bool, encrypted: bool, blobHash: str | None = None, size: int = 0):
+        return self.__newShare(username=username, targetDevices=targetDevices, dataType="file", data=filename, autoOpen=autoOpen, encrypted=encrypted, blobHash=blobHash, size=size)
     
+    """
+    Method to reference the blobs of files before they are stored, files is a list of dicts with filename, hash and size of the blob.
+    The reference counts and the storage usage of the user are increased, so the quota is checked and the garbage collection does not
+    delete a blob while its file is uploaded to the storage outside of a transaction. The references are taken over by newFileShares or
+    given back with releaseBlobs.
+    """
+    def reserveBlobs(self, username: str, files: List[dict]):
+        try:
+            with self.__transaction() as cursor:
+                self.__addUsage(cursor, username=username, size=sum(file["size"] for file in files), files=len(files))
+                # hashes are locked in a fixed order, so concurrent uploads of the same files can't deadlock
+                cursor.execute('INSERT INTO "Blob" ("Hash", "Size", "RefCount") SELECT hash, max(size), count(*) FROM unnest(%s::text[], %s::bigint[]) AS blob(hash, size) GROUP BY hash ORDER BY hash ON CONFLICT ("Hash") DO UPDATE SET "RefCount" = "Blob"."RefCount" + EXCLUDED."RefCount";', [[file["hash"] for file in files], [file["size"] for file in files]])
+            return "", True
+        except QuotaExceeded as e:
+            return str(e), False
+        except psycopg2.Error as e:
+            self.logger.error("Could not reserve blobs: " + str(e))
+            return "Error occurred, could not share files", False
+
+    """
+    Method to give back the references of reserveBlobs if the files are not shared. Blobs without references are deleted by removeBlob.
+    """
+    def releaseBlobs(self, username: str, files: List[dict]):
+        try:
+            with self.__transaction() as cursor:
+                cursor.execute('UPDATE "UserUsage" SET "Bytes" = "Bytes" - %s, "Files" = "Files" - %s WHERE "Username" = %s;', [sum(file["size"] for file in files), len(files), username])
+                cursor.execute('UPDATE "Blob" SET "RefCount" = "Blob"."RefCount" - released.count FROM (SELECT hash, count(*) AS count FROM unnest(%s::text[]) AS hash GROUP BY hash) AS released WHERE "Blob"."Hash" = released.hash;', [[file["hash"] for file in files]])
+            return True
+        except psycopg2.Error as e:
+            self.logger.error("Could not release blobs: " + str(e))
+            return False
+
+    """
+    Method to create one file share per file in a single transaction. files is a list of dicts with filename, hash and size of blobs that
+    were referenced with reserveBlobs and stored before, so the files exist before a device is notified.
+    If uploadId is given, the resumable upload is deleted in the same transaction, so it is only removed once its share is committed and
+    concurrent or retried finalizations of the upload share it only once.
+    Returns the timestamps identifying the created shares in the order of files.
+    """
+    def newFileShares(self, username: str, targetDevices: List[str], files: List[dict], autoOpen: bool, encrypted: bool, uploadId: str | None = None):
+        try:
+            with self.__transaction() as cursor:
+                if uploadId is not None:
+                    # the row stays locked until the commit, a concurrent finalization waits and then finds it deleted
+                    cursor.execute('DELETE FROM "Upload" WHERE "UploadID" = %s AND "Username" = %s RETURNING "UploadID";', [uploadId, username])
+                    if cursor.fetchone() is None:
+                        raise UploadNotFound("Upload " + uploadId + " does not exist")
+                # the timestamps are made unique within the transaction by the position of the file
+                timestamps = sorted(self.__insertShares(cursor, 'INSERT INTO "ShareData" ("Timestamp", "Username", "targetDevices", "DataType", "Data", "AutoOpen", "Encrypted", "BlobHash") SELECT now.timestamp + file.position * INTERVAL \'1 microsecond\', %s, %s, \'file\', file.filename, %s, %s, file.hash FROM (SELECT GREATEST(clock_timestamp(), (SELECT max("Timestamp") FROM "ShareData" WHERE "Username" = %s)) AS timestamp) AS now CROSS JOIN unnest(%s::text[], %s::text[]) WITH ORDINALITY AS file(filename, hash, position) RETURNING "Timestamp";', [username, targetDevices, autoOpen, encrypted, username, [file["filename"] for file in files], [file["hash"] for file in files]]))
+                cursor.execute('INSERT INTO "ShareTarget" ("Timestamp", "Username", "DeviceName") SELECT timestamp, %s, device FROM unnest(%s::timestamptz[]) AS timestamp CROSS JOIN unnest(%s::text[]) AS device ON CONFLICT DO NOTHING;', [username, timestamps, targetDevices])
+                # one notification per device is enough to wake up its subscribers
+                cursor.execute('SELECT pg_notify(%s, json_build_object(\'Username\', %s, \'DeviceName\', device, \'Timestamp\', %s)::text) FROM unnest(%s::text[]) AS device;', [self.shareChannel, username, timestamps[-1], targetDevices])
+            self.logger.debug("New file shares of user \"%s\" for %s: %d", username, targetDevices, len(timestamps))
+            return timestamps, True
+        except UploadNotFound as e:
+            return str(e), False
+        except psycopg2.Error as e:
+            self.logger.error("Could not create file shares: " + str(e))
+            return "Error occurred, could not share files", False
+
     """
     Method to create a new text share.
     """
@@ -217,83 +505,472 @@ class dbconnectors_postgresql():
         return self.__newShare(username=username, targetDevices=targetDevices, dataType="url", data=url, autoOpen=autoOpen, encrypted=encrypted)
     
     """
-    Method to retrieve all shared data for the given username.
+    Method to retrieve all shared data pending for the given device.
     """
     def checkAvailableData(self, username: str, devicename: str):
-        shareData = self.__execute_read_query('Select * FROM "ShareData" Where "Username" = %s', [username])
-        devices: list[str]
-        responseData: list[tuple] = []
-        # Iterate through each shared data entry and check if devicename is present in targetDevices list
+        shareData = self.__execute_read_query('Select "ShareData".* FROM "ShareTarget" JOIN "ShareData" USING ("Timestamp", "Username") Where "ShareTarget"."Username" = %s AND "ShareTarget"."DeviceName" = %s AND "ShareTarget"."Received" IS NULL ORDER BY "Timestamp"', [username, devicename])
         if shareData:
-            for entry in shareData:
-                devices = entry[2].strip('}{').split(',')
-                if devicename in devices:
-                    responseData.append(entry)
-            return responseData, True
+            return shareData, True
         else:
             return "No shared data for " + devicename, False
-        
+
+    """
+    Method to retrieve one page of the shared data pending for the given device, the at most limit oldest entries after the timestamp since.
+    With metadataOnly the data of text and url entries is omitted. Entries never change, so the page is identified by its timestamps, which
+    are hashed to an ETag together with the limit and whether there are further entries. If it equals etag only the timestamps are read and "shares" is None.
+    Returns a dict with the entries as "shares", "more" if there are further entries and the "etag".
+    """
+    def getPendingShares(self, username: str, devicename: str, since: str = None, limit: int = None, metadataOnly: bool = False, etag: str = None):
+        condition = 'Where "ShareTarget"."Username" = %s AND "ShareTarget"."DeviceName" = %s AND "ShareTarget"."Received" IS NULL AND (%s::timestamptz IS NULL OR "Timestamp" > %s::timestamptz)'
+        data = [username, devicename, since, since, limit + 1 if limit else None]
+        try:
+            with self.__transaction() as cursor:
+                if etag is not None:
+                    cursor.execute('Select "Timestamp" FROM "ShareTarget" ' + condition + ' ORDER BY "Timestamp" LIMIT %s', data)
+                    timestamps = [row[0] for row in cursor.fetchall()]
+                    more = bool(limit) and len(timestamps) > limit
+                    if pageTag(timestamps[:limit] if more else timestamps, metadataOnly, more, limit) == etag:
+                        return {"shares": None, "more": more, "etag": etag}, True
+                cursor.execute('Select "Timestamp", "Username", "targetDevices", "DataType", CASE WHEN %s AND "DataType" <> \'file\' THEN NULL ELSE "Data" END, "AutoOpen", "Encrypted", "BlobHash" FROM "ShareTarget" JOIN "ShareData" USING ("Timestamp", "Username") ' + condition + ' ORDER BY "Timestamp" LIMIT %s', [metadataOnly] + data)
+                shareData = cursor.fetchall()
+            more = bool(limit) and len(shareData) > limit
+            if more:
+                shareData = shareData[:limit]
+            return {"shares": shareData, "more": more, "etag": pageTag([share[0] for share in shareData], metadataOnly, more, limit)}, True
+        except psycopg2.Error as e:
+            self.logger.error("Could not get pending shares: " + str(e))
+            return "Error occoured", False
+
     """
     Method to retrieve the shared data entry for the given username and timestamp.
+    Text and url entries are marked as delivered to the device, the entry is deleted once it was delivered to all of its target devices.
+    File entries are only marked as received, so an interrupted download can be resumed until the device acknowledges the file.
     """
     def getShare(self, username: str, devicename: str, timestamp: str):
-        shareData = self.__execute_read_query('Select * FROM "ShareData" Where "Username" = %s AND "Timestamp" = %s', [username, timestamp])
-        if shareData:
-            devices: List[str] = shareData[0][2].strip('}{').split(',')
-            # Check if devicename is present in targetDevices list for the given entry
-            if devicename in devices:
-                devices.remove(devicename)
-                if devices == []:
-                    if self.__execute_write_query('Delete FROM "ShareData" Where "Username" = %s AND "Timestamp" = %s', [username, timestamp]):
-                        return shareData, True
-                    else:
-                        return "Error occoured", False
-                else:
-                    if self.__execute_write_query('Update "ShareData" Set "targetDevices" = %s Where "Username" = %s AND "Timestamp" = %s', [devices, username, timestamp]):
-                        return shareData, True
-                    else:
-                        return "Error occoured", False
-            else:
-                return "No shared data for " + devicename + " with timestamp " + timestamp, False
-        else:
-            return "No shared data for " + devicename + " with timestamp " + timestamp, False
+        try:
+            with self.__transaction() as cursor:
+                cursor.execute('Select "ShareData".* FROM "ShareTarget" JOIN "ShareData" USING ("Timestamp", "Username") Where "ShareTarget"."Username" = %s AND "ShareTarget"."DeviceName" = %s AND "Timestamp" = %s', [username, devicename, timestamp])
+                shareData = cursor.fetchall()
+                # Check if the entry is pending for devicename
+                if not shareData:
+                    return "No shared data for " + devicename + " with timestamp " + timestamp, False
+                if shareData[0][3] == "file":
+                    cursor.execute('Update "ShareTarget" Set "Received" = NOW() Where "Username" = %s AND "DeviceName" = %s AND "Timestamp" = %s AND "Received" IS NULL', [username, devicename, timestamp])
+                # A concurrent request of the device may have delivered the entry since it was read
+                elif not self.__removeShareTarget(cursor, username=username, devicename=devicename, timestamp=timestamp)[0]:
+                    return "No shared data for " + devicename + " with timestamp " + timestamp, False
+            return shareData, True
+        except psycopg2.Error as e:
+            self.logger.error("Could not get share: " + str(e))
+            return "Error occoured", False
 
     """
-    Method to create a new row in the "ShareData" table with the given parameters.
+    Method to acknowledge the complete receipt of a file entry by the device.
+    Returns the deleted entry if it was delivered to all of its target devices, so its file can be removed, otherwise None.
     """
-    def __newShare(self, username: str, targetDevices: List[str], dataType: str, data: str | None, autoOpen: bool, encrypted: bool):
-        if self.__execute_write_query('INSERT INTO "ShareData" ("Timestamp", "Username", "targetDevices", "DataType", "Data", "AutoOpen", "Encrypted") VALUES (NOW(), %s, %s, %s, %s, %s, %s);', [username, targetDevices, dataType, data, autoOpen, encrypted]):
+    def acknowledgeShare(self, username: str, devicename: str, timestamp: str):
+        try:
+            with self.__transaction() as cursor:
+                removed, shareData = self.__removeShareTarget(cursor, username=username, devicename=devicename, timestamp=timestamp, received=True)
+                if not removed:
+                    return "No received data for " + devicename + " with timestamp " + timestamp, False
+            return shareData, True
+        except psycopg2.Error as e:
+            self.logger.error("Could not acknowledge share: " + str(e))
+            return "Error occoured", False
+
+    """
+    Method to receive all text and url entries pending for the device, or only those with the given timestamps, in one transaction.
+    They are marked as delivered like in getShare, concurrent calls never return the same entry twice.
+    With files the file entries of the device are returned as well and marked as received, they still have to be acknowledged.
+    Returns a dict with the entries as "shares" and the file entries as "files", both ordered by timestamp.
+    """
+    def receiveShares(self, username: str, devicename: str, timestamps: List[str] = None, files: bool = False):
+        condition = '"ShareTarget"."Username" = %s AND "ShareTarget"."DeviceName" = %s AND "ShareData"."Username" = "ShareTarget"."Username" AND "ShareData"."Timestamp" = "ShareTarget"."Timestamp" AND (%s::timestamptz[] IS NULL OR "ShareTarget"."Timestamp" = ANY(%s::timestamptz[]))'
+        data = [username, devicename, timestamps, timestamps]
+        try:
+            with self.__transaction() as cursor:
+                # lock the entries in a fixed order like __removeShareTarget, so the last device receiving an entry deletes it
+                cursor.execute('SELECT 1 FROM "ShareData" JOIN "ShareTarget" USING ("Timestamp", "Username") WHERE ' + condition + ' ORDER BY "Timestamp" FOR UPDATE OF "ShareData"', data)
+                cursor.execute('DELETE FROM "ShareTarget" USING "ShareData" WHERE ' + condition + ' AND "ShareTarget"."Received" IS NULL AND "ShareData"."DataType" <> \'file\' RETURNING "ShareData".*', data)
+                shares = sorted(cursor.fetchall())
+                if shares:
+                    # entries delivered to all of their target devices are deleted
+                    cursor.execute('DELETE FROM "ShareData" WHERE "Username" = %s AND "Timestamp" = ANY(%s) AND NOT EXISTS (SELECT 1 FROM "ShareTarget" WHERE "ShareTarget"."Username" = "ShareData"."Username" AND "ShareTarget"."Timestamp" = "ShareData"."Timestamp")', [username, [share[0] for share in shares]])
+                fileShares = []
+                if files:
+                    cursor.execute('UPDATE "ShareTarget" SET "Received" = COALESCE("ShareTarget"."Received", NOW()) FROM "ShareData" WHERE ' + condition + ' AND "ShareData"."DataType" = \'file\' RETURNING "ShareData".*', data)
+                    fileShares = sorted(cursor.fetchall())
+            self.logger.debug("Received %s entries and %s files for %s", len(shares), len(fileShares), devicename)
+            return {"shares": shares, "files": fileShares}, True
+        except psycopg2.Error as e:
+            self.logger.error("Could not receive shares: " + str(e))
+            return "Error occoured", False
+
+    """
+    Method to remove the targets of at most limit file entries that received them more than retention seconds ago without acknowledging it.
+    Returns the entries deleted because they were delivered to all of their target devices.
+    """
+    def expireReceivedShares(self, retention: int, limit: int):
+        try:
+            with self.__transaction() as cursor:
+                # the entries are locked before their targets in the order of receiveShares, entries locked by a request are left for the next sweep
+                cursor.execute('Select "Timestamp", "Username" FROM "ShareData" Where EXISTS (Select 1 FROM "ShareTarget" Where "ShareTarget"."Username" = "ShareData"."Username" AND "ShareTarget"."Timestamp" = "ShareData"."Timestamp" AND "ShareTarget"."Received" < NOW() - %s * INTERVAL \'1 second\') ORDER BY "Timestamp" LIMIT %s FOR UPDATE SKIP LOCKED', [retention, limit])
+                locked = cursor.fetchall()
+                if not locked:
+                    return [], True
+                cursor.execute('Delete FROM "ShareTarget" Where "Received" < NOW() - %s * INTERVAL \'1 second\' AND ("Timestamp", "Username") IN (Select * FROM unnest(%s::timestamptz[], %s::text[])) RETURNING "Timestamp", "Username"', [retention, [share[0] for share in locked], [share[1] for share in locked]])
+                expired = cursor.fetchall()
+                cursor.execute('Delete FROM "ShareData" Where ("Timestamp", "Username") IN (Select * FROM unnest(%s::timestamptz[], %s::text[])) AND NOT EXISTS (Select 1 FROM "ShareTarget" Where "ShareTarget"."Username" = "ShareData"."Username" AND "ShareTarget"."Timestamp" = "ShareData"."Timestamp") RETURNING *', [[share[0] for share in expired], [share[1] for share in expired]])
+                shareData = cursor.fetchall()
+                self.__releaseBlobs(cursor, shareData)
+            self.logger.debug("Expired %d received shares, deleted %d", len(expired), len(shareData))
+            return shareData, True
+        except psycopg2.Error as e:
+            self.logger.error("Could not expire received shares: " + str(e))
+            return "Error occoured", False
+
+    """
+    Method to delete at most limit shares that are older than the share TTL of their user. The TTL is taken from the "UserLimits" table,
+    or defaultTTL if the user has no own TTL. A TTL of 0 keeps the shares forever. Returns the deleted entries.
+    """
+    def expireShares(self, defaultTTL: int, limit: int):
+        # the lowest TTL in use bounds the scan to the oldest shares by the primary key, which starts with the timestamp
+        return self.__deleteShares("expired shares", 'Delete FROM "ShareData" Where ("Timestamp", "Username") IN (Select "ShareData"."Timestamp", "ShareData"."Username" FROM "ShareData" LEFT JOIN "UserLimits" ON "UserLimits"."Username" = "ShareData"."Username" Where "ShareData"."Timestamp" < NOW() - (Select min(ttl) FROM (Select NULLIF(%s, 0) AS ttl UNION ALL Select "ShareTTL" FROM "UserLimits" Where "ShareTTL" > 0) AS ttls) * INTERVAL \'1 second\' AND COALESCE("UserLimits"."ShareTTL", %s) > 0 AND "ShareData"."Timestamp" < NOW() - COALESCE("UserLimits"."ShareTTL", %s) * INTERVAL \'1 second\' ORDER BY "ShareData"."Timestamp" LIMIT %s FOR UPDATE OF "ShareData" SKIP LOCKED) RETURNING *', [defaultTTL, defaultTTL, defaultTTL, limit])
+
+    """
+    Method to delete at most limit of the oldest shares of users that have more shares than allowed. The number of shares is taken from the
+    "UserLimits" table, or defaultMaxShares if the user has no own limit. A limit of 0 allows any number of shares. Returns the deleted entries.
+    """
+    def evictShares(self, defaultMaxShares: int, limit: int):
+        return self.__deleteShares("shares above the limit", 'Delete FROM "ShareData" Where ("Timestamp", "Username") IN (Select "Timestamp", "Username" FROM (Select "ShareData"."Timestamp", "ShareData"."Username", row_number() OVER (PARTITION BY "ShareData"."Username" ORDER BY "ShareData"."Timestamp" DESC) AS position, COALESCE("UserLimits"."MaxShares", %s) AS maxshares FROM "ShareData" LEFT JOIN "UserLimits" ON "UserLimits"."Username" = "ShareData"."Username") AS shares Where maxshares > 0 AND position > maxshares LIMIT %s) RETURNING *', [defaultMaxShares, limit])
+
+    """
+    Method to delete at most limit share targets of devices that do not exist anymore, and at most limit shares without any target device.
+    Returns the deleted entries.
+    """
+    def removeOrphanedShares(self, limit: int):
+        try:
+            with self.__transaction() as cursor:
+                cursor.execute('Delete FROM "ShareTarget" Where ("Username", "DeviceName", "Timestamp") IN (Select "Username", "DeviceName", "Timestamp" FROM "ShareTarget" Where NOT EXISTS (Select 1 FROM "Device" Where "Device"."Username" = "ShareTarget"."Username" AND "Device"."DeviceName" = "ShareTarget"."DeviceName") LIMIT %s)', [limit])
+                targets = cursor.rowcount
+                cursor.execute('Delete FROM "ShareData" Where ("Timestamp", "Username") IN (Select "Timestamp", "Username" FROM "ShareData" Where NOT EXISTS (Select 1 FROM "ShareTarget" Where "ShareTarget"."Username" = "ShareData"."Username" AND "ShareTarget"."Timestamp" = "ShareData"."Timestamp") LIMIT %s) RETURNING *', [limit])
+                shareData = cursor.fetchall()
+                self.__releaseBlobs(cursor, shareData)
+            if targets or shareData:
+                self.logger.debug("Removed %d targets of removed devices and %d shares without target devices", targets, len(shareData))
+            return shareData, True
+        except psycopg2.Error as e:
+            self.logger.error("Could not remove orphaned shares: " + str(e))
+            return "Error occoured", False
+
+    """
+    Method to delete shares selected by query in one transaction and release their blobs. Returns the deleted entries.
+    """
+    def __deleteShares(self, description: str, query: str, data):
+        try:
+            with self.__transaction() as cursor:
+                cursor.execute(query, data)
+                shareData = cursor.fetchall()
+                self.__releaseBlobs(cursor, shareData)
+            if shareData:
+                self.logger.debug("Deleted %d %s", len(shareData), description)
+            return shareData, True
+        except psycopg2.Error as e:
+            self.logger.error("Could not delete " + description + ": " + str(e))
+            return "Error occoured", False
+
+    """
+    Method to delete the target row of the device and the entry itself if no other target devices are left, using the cursor of the current transaction.
+    The entry is locked first, so of several devices removing their targets concurrently the last one sees that no targets are left and deletes it.
+    Returns if the target row existed and the deleted entry or None.
+    """
+    def __removeShareTarget(self, cursor, username: str, devicename: str, timestamp: str, received: bool = False):
+        cursor.execute('Select 1 FROM "ShareData" Where "Username" = %s AND "Timestamp" = %s FOR UPDATE', [username, timestamp])
+        cursor.execute('Delete FROM "ShareTarget" Where "Username" = %s AND "DeviceName" = %s AND "Timestamp" = %s' + (' AND "Received" IS NOT NULL' if received else ''), [username, devicename, timestamp])
+        if cursor.rowcount == 0:
+            return False, None
+        cursor.execute('Delete FROM "ShareData" Where "Username" = %s AND "Timestamp" = %s AND NOT EXISTS (Select 1 FROM "ShareTarget" Where "Username" = %s AND "Timestamp" = %s) RETURNING *', [username, timestamp, username, timestamp])
+        shareData = cursor.fetchall()
+        self.__releaseBlobs(cursor, shareData)
+        return True, shareData[0] if shareData else None
+
+    """
+    Method to decrement the reference counts of the blobs referenced by deleted "ShareData" rows and the storage usage of their users,
+    using the cursor of the current transaction. Blobs without references are deleted by removeBlob.
+    """
+    def __releaseBlobs(self, cursor, shareData: list):
+        shares = [share for share in shareData if share[7] is not None]
+        if shares:
+            cursor.execute('UPDATE "UserUsage" SET "Bytes" = "UserUsage"."Bytes" - released.bytes, "Files" = "UserUsage"."Files" - released.files FROM (SELECT share.username, sum("Blob"."Size") AS bytes, count(*) AS files FROM unnest(%s::text[], %s::text[]) AS share(username, hash) JOIN "Blob" ON "Blob"."Hash" = share.hash GROUP BY share.username) AS released WHERE "UserUsage"."Username" = released.username;', [[share[1] for share in shares], [share[7] for share in shares]])
+            cursor.execute('UPDATE "Blob" SET "RefCount" = "Blob"."RefCount" - released.count FROM (SELECT hash, count(*) AS count FROM unnest(%s::text[]) AS hash GROUP BY hash) AS released WHERE "Blob"."Hash" = released.hash;', [[share[7] for share in shares]])
+
+    """
+    Method to add stored bytes and files to the usage of a user, using the cursor of the current transaction.
+    Raises QuotaExceeded if the user exceeds the storage quota afterwards, which rolls back the transaction.
+    The usage row stays locked until the end of the transaction, so concurrent uploads of the user are checked one after another.
+    """
+    def __addUsage(self, cursor, username: str, size: int, files: int):
+        cursor.execute('INSERT INTO "UserUsage" ("Username", "Bytes", "Files") VALUES (%s, %s, %s) ON CONFLICT ("Username") DO UPDATE SET "Bytes" = "UserUsage"."Bytes" + EXCLUDED."Bytes", "Files" = "UserUsage"."Files" + EXCLUDED."Files" RETURNING "Bytes", "Files";', [username, size, files])
+        usedBytes, usedFiles = cursor.fetchone()
+        cursor.execute('SELECT COALESCE("MaxBytes", %s), COALESCE("MaxFiles", %s) FROM (SELECT %s::text AS "Username") AS quota LEFT JOIN "UserLimits" USING ("Username");', [self.quotaBytes, self.quotaFiles, username])
+        maxBytes, maxFiles = cursor.fetchone()
+        if maxBytes > 0 and usedBytes > maxBytes:
+            raise QuotaExceeded("Storage quota exceeded, " + str(max(maxBytes - usedBytes + size, 0)) + " bytes left")
+        if maxFiles > 0 and usedFiles > maxFiles:
+            raise QuotaExceeded("File quota exceeded, " + str(max(maxFiles - usedFiles + files, 0)) + " files left")
+
+    """
+    Method to retrieve the bytes and number of files the user can still store in shares. None means unlimited.
+    """
+    def getRemainingQuota(self, username: str):
+        quota = self.__execute_read_query('SELECT COALESCE("UserLimits"."MaxBytes", %s), COALESCE("UserLimits"."MaxFiles", %s), COALESCE("UserUsage"."Bytes", 0), COALESCE("UserUsage"."Files", 0) FROM (SELECT %s::text AS "Username") AS quota LEFT JOIN "UserLimits" USING ("Username") LEFT JOIN "UserUsage" USING ("Username");', [self.quotaBytes, self.quotaFiles, username])
+        if not quota:
+            return "Error occoured", False
+        maxBytes, maxFiles, usedBytes, usedFiles = quota[0]
+        return (max(maxBytes - usedBytes, 0) if maxBytes > 0 else None, max(maxFiles - usedFiles, 0) if maxFiles > 0 else None), True
+
+    """
+    Method to delete a blob that is not referenced by any share anymore. remove is called with the hash to delete the file before the
+    deletion is committed, so a new share of the same content waits until the file is gone and stores it again.
+    Returns the size of the deleted blob, 0 if it is still referenced.
+    """
+    def removeBlob(self, blobHash: str, remove):
+        try:
+            with self.__transaction() as cursor:
+                cursor.execute('DELETE FROM "Blob" WHERE "Hash" = %s AND "RefCount" <= 0 RETURNING "Size";', [blobHash])
+                blob = cursor.fetchone()
+                if blob is None:
+                    return 0, True
+                remove(blobHash)
+            return blob[0], True
+        except psycopg2.Error as e:
+            self.logger.error("Could not remove blob: " + str(e))
+            return "Error occoured", False
+
+    """
+    Method to retrieve at most limit blobs that are not referenced by any share, e.g. because their file was not deleted after the last share.
+    """
+    def getUnreferencedBlobs(self, limit: int):
+        blobs = self.__execute_read_query('SELECT "Hash" FROM "Blob" WHERE "RefCount" <= 0 LIMIT %s;', [limit])
+        if blobs is False:
+            return "Error occoured", False
+        return [blob[0] for blob in blobs], True
+
+    """
+    Method to delete blob files without a row in the "Blob" table. A placeholder row is inserted for every hash without a row and held
+    until the file was deleted by remove, so a new share of the same content waits and stores the file again. Returns the deleted hashes.
+    """
+    def removeOrphanedBlobs(self, blobHashes: List[str], remove):
+        try:
+            with self.__transaction() as cursor:
+                cursor.execute('INSERT INTO "Blob" ("Hash", "Size", "RefCount") SELECT unnest(%s::text[]), 0, 0 ON CONFLICT ("Hash") DO NOTHING RETURNING "Hash";', [blobHashes])
+                orphaned = [blob[0] for blob in cursor.fetchall()]
+                for blobHash in orphaned:
+                    remove(blobHash)
+                cursor.execute('DELETE FROM "Blob" WHERE "Hash" = ANY(%s);', [orphaned])
+            return orphaned, True
+        except psycopg2.Error as e:
+            self.logger.error("Could not remove orphaned blobs: " + str(e))
+            return "Error occoured", False
+
+    """
+    Method to retrieve the filenames of the shares of a user whose files are stored in the folder of the user, from before blobs existed.
+    """
+    def getUserFiles(self, username: str):
+        files = self.__execute_read_query('SELECT "Data" FROM "ShareData" WHERE "Username" = %s AND "DataType" = \'file\' AND "BlobHash" IS NULL;', [username])
+        if files is False:
+            return "Error occoured", False
+        return set(file[0] for file in files), True
+
+    """
+    Method to create a new row in the "ShareData" table with the given parameters and one row per target device in the "ShareTarget" table.
+    """
+    def __newShare(self, username: str, targetDevices: List[str], dataType: str, data: str | None, autoOpen: bool, encrypted: bool, blobHash: str | None = None, size: int = 0):
+        try:
+            with self.__transaction() as cursor:
+                if blobHash is not None:
+                    self.__addUsage(cursor, username=username, size=size, files=1)
+                    cursor.execute('INSERT INTO "Blob" ("Hash", "Size", "RefCount") VALUES (%s, %s, 1) ON CONFLICT ("Hash") DO UPDATE SET "RefCount" = "Blob"."RefCount" + 1;', [blobHash, size])
+                timestamp = self.__insertShares(cursor, 'INSERT INTO "ShareData" ("Timestamp", "Username", "targetDevices", "DataType", "Data", "AutoOpen", "Encrypted", "BlobHash") VALUES (GREATEST(clock_timestamp(), (SELECT max("Timestamp") FROM "ShareData" WHERE "Username" = %s) + INTERVAL \'1 microsecond\'), %s, %s, %s, %s, %s, %s, %s) RETURNING "Timestamp";', [username, username, targetDevices, dataType, data, autoOpen, encrypted, blobHash])[0]
+                cursor.execute('INSERT INTO "ShareTarget" ("Timestamp", "Username", "DeviceName") SELECT %s, %s, unnest(%s::text[]) ON CONFLICT DO NOTHING;', [timestamp, username, targetDevices])
+                # notify subscribed devices in all server processes, notifications are sent on commit
+                cursor.execute('SELECT pg_notify(%s, json_build_object(\'Username\', %s, \'DeviceName\', device, \'Timestamp\', %s)::text) FROM unnest(%s::text[]) AS device;', [self.shareChannel, username, timestamp, targetDevices])
+            self.logger.debug("New %s share of user \"%s\" for %s", dataType, username, targetDevices)
             return True
-        else:
+        except QuotaExceeded as e:
+            self.logger.debug("%s", e)
+            return False
+        except psycopg2.Error as e:
+            self.logger.error("Could not create share: " + str(e))
             return False
 
     """
-    Method to to check if the given username exists in the "User" table.
+    Method that runs query inserting shares and returns their timestamps. The queries take timestamps after clock_timestamp() and the latest
+    share of the user. A timestamp identifies a share of the user, so if a concurrent transaction of the same user took one of them, the
+    insert is repeated after it committed, which then starts after its shares.
+    """
+    def __insertShares(self, cursor, query: str, data: list):
+        for attempt in range(self.shareInsertAttempts):
+            cursor.execute("SAVEPOINT insert_shares;")
+            try:
+                cursor.execute(query, data)
+                return [share[0] for share in cursor.fetchall()]
+            except psycopg2.errors.UniqueViolation:
+                if attempt + 1 == self.shareInsertAttempts:
+                    raise
+                cursor.execute("ROLLBACK TO SAVEPOINT insert_shares;")
+
+    """
+    Method to create a new resumable upload.
+    """
+    def newUpload(self, username: str, uploadId: str, filename: str, size: int, targetDevices: List[str], autoOpen: bool, encrypted: bool):
+        return self.__execute_write_query('INSERT INTO "Upload" ("UploadID", "Username", "Filename", "Size", "targetDevices", "AutoOpen", "Encrypted") VALUES (%s, %s, %s, %s, %s, %s, %s);', [uploadId, username, filename, size, targetDevices, autoOpen, encrypted])
+
+    """
+    Method to retrieve a resumable upload of the given user. Returns filename, size, target devices, autoOpen and encrypted.
+    """
+    def getUpload(self, username: str, uploadId: str):
+        upload = self.__execute_read_query('SELECT "Filename", "Size", "targetDevices", "AutoOpen", "Encrypted" FROM "Upload" WHERE "UploadID" = %s AND "Username" = %s;', [uploadId, username])
+        if upload:
+            return upload[0], True
+        else:
+            return "Upload " + uploadId + " does not exist", False
+
+    """
+    Method to record that a byte range of a resumable upload was received.
+    """
+    def addUploadChunk(self, uploadId: str, offset: int, length: int):
+        return self.__execute_write_query('INSERT INTO "UploadChunk" ("UploadID", "Offset", "Length") VALUES (%s, %s, %s) ON CONFLICT ("UploadID", "Offset") DO UPDATE SET "Length" = GREATEST("UploadChunk"."Length", EXCLUDED."Length");', [uploadId, offset, length])
+
+    """
+    Method to retrieve the received byte ranges of a resumable upload as a sorted list of merged [start, end) ranges.
+    """
+    def getUploadRanges(self, uploadId: str):
+        chunks = self.__execute_read_query('SELECT "Offset", "Offset" + "Length" FROM "UploadChunk" WHERE "UploadID" = %s ORDER BY "Offset";', [uploadId])
+        if chunks is False:
+            return "Error occoured", False
+        ranges: list = []
+        for start, end in chunks:
+            if ranges and start <= ranges[-1][1]:
+                ranges[-1][1] = max(ranges[-1][1], end)
+            else:
+                ranges.append([start, end])
+        return ranges, True
+
+    """
+    Method to delete a resumable upload and its received ranges.
+    """
+    def removeUpload(self, uploadId: str):
+        return self.__execute_write_query('DELETE FROM "Upload" WHERE "UploadID" = %s;', [uploadId])
+
+    """
+    Method to delete at most limit resumable uploads that were started more than ttl seconds ago. Returns the ids of the deleted uploads.
+    """
+    def expireUploads(self, ttl: int, limit: int):
+        try:
+            with self.__transaction() as cursor:
+                cursor.execute('DELETE FROM "Upload" WHERE "UploadID" IN (SELECT "UploadID" FROM "Upload" WHERE "Created" < NOW() - %s * INTERVAL \'1 second\' LIMIT %s) RETURNING "UploadID";', [ttl, limit])
+                uploads = [upload[0] for upload in cursor.fetchall()]
+            return uploads, True
+        except psycopg2.Error as e:
+            self.logger.error("Could not expire uploads: " + str(e))
+            return "Error occoured", False
+
+    """
+    Method to count the shares that were not yet delivered to a target device.
+    """
+    def countPendingShares(self):
+        count = self.__execute_read_query('SELECT count(*) FROM "ShareTarget" WHERE "Received" IS NULL;')
+        if count is False:
+            return "Error occoured", False
+        return count[0][0], True
+
+    """
+    Method to to check if the given username exists in the "User" table. Returns if the user exists and if the check succeeded, so a
+    failed query is not mistaken for a missing user.
     """  
     def checkUserNameExists(self, username: str):
-        if self.__execute_read_query('SELECT * FROM "User" Where "Username" = %s;', [username]):
-            return True
-        else:
-            return False
+        users = self.__execute_read_query('SELECT "Username" FROM "User" Where "Username" = %s;', [username])
+        if users is False:
+            return False, False
+        return len(users) > 0, True
     
     """
-    Method to to check if the given devicename exists for the given username in the "Device" table.
-    """  
-    def checkDeviceNameExists(self, username: str, devicename: str):
-        if self.__execute_read_query('SELECT * FROM "Device" Where "Username" = %s AND "DeviceName" = %s;', [username, devicename]):
+    Method to check with one query which of the given devicenames do not exist for the given username. Returns the missing devicenames.
+    """
+    def checkDeviceNamesExist(self, username: str, devicenames: List[str]):
+        existing = self.__execute_read_query('SELECT "DeviceName" FROM "Device" WHERE "Username" = %s AND "DeviceName" = ANY(%s);', [username, devicenames])
+        if existing is False:
+            return devicenames, False
+        existing = {device[0] for device in existing}
+        return [device for device in devicenames if device not in existing], True
+
+    """
+    Checks out a connection from the pool and returns it afterwards.
+    Connections that were closed or idle for too long are health checked and replaced by a new connection if broken.
+    """
+    @contextmanager
+    def __connection(self):
+        with self.poolSemaphore:
+            connection = self.pool.getconn()
+            if not self.__isHealthy(connection):
+                self.logger.warning("Replacing broken database connection")
+                self.pool.putconn(connection, close=True)
+                connection = self.pool.getconn()
+            try:
+                yield connection
+            finally:
+                self.pool.putconn(connection, close=bool(connection.closed))
+                # the pool closes connections exceeding minconn on return
+                if connection.closed:
+                    self.connectionLastUsed.pop(id(connection), None)
+                else:
+                    self.connectionLastUsed[id(connection)] = time.monotonic()
+
+    """
+    Method to check if a pooled connection is still usable. Connections idle for longer than healthcheckInterval are pinged.
+    """
+    def __isHealthy(self, connection):
+        if connection.closed or connection.info.transaction_status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+            return False
+        if time.monotonic() - self.connectionLastUsed.get(id(connection), 0) < self.healthcheckInterval:
             return True
-        else:
+        try:
+            # the ping depends on the idle time and not on the method, so it is not counted as its statement
+            with connection.cursor(cursor_factory=psycopg2.extensions.cursor) as cursor:
+                cursor.execute("SELECT 1;")
+            connection.rollback()
+            return True
+        except psycopg2.Error:
             return False
 
+    """
+    Checks out a connection for one transaction and returns a cursor. Commits on success and rolls back on errors.
+    """
+    @contextmanager
+    def __transaction(self):
+        with self.__connection() as connection:
+            cursor = connection.cursor()
+            try:
+                yield cursor
+                connection.commit()
+            except BaseException:
+                if not connection.closed:
+                    connection.rollback()
+                raise
+            finally:
+                cursor.close()
+
     """
     Method to execute a write query with the given query and data parameters.
     """
     def __execute_write_query(self, query: str, data):
-        cursor = self.connection.cursor()
         try:
-            cursor.execute(query, data)
-            self.connection.commit()
-            self.logger.debug("Write query executed successfully: " + query + str(data))
+            with self.__transaction() as cursor:
+                cursor.execute(query, data)
+            # arguments are only formatted if debug logging is enabled
+            self.logger.debug("Write query executed successfully: %s%s", query, data)
             return True
         except psycopg2.Error as e:
             self.logger.error("Could not execute write DB-Query:" + str(e))
@@ -301,15 +978,23 @@ class dbconnectors_postgresql():
 
     """
     Method to execute a read query with the given query and data parameters.
+    Read queries are retried once on a new connection if the connection was lost.
     """
     def __execute_read_query(self, query: str, data=[]):
-        cursor = self.connection.cursor()
         result = None
-        try:
-            cursor.execute(query, data)
-            result = cursor.fetchall()
-            self.logger.debug("Read query executed successfully: " + query + " - Response: " + str(result))
-            return result
-        except psycopg2.Error as e:
-            self.logger.error("Could not execute read DB-Query:" + str(e))
-            return False
+        for attempt in range(2):
+            try:
+                with self.__transaction() as cursor:
+                    cursor.execute(query, data)
+                    result = cursor.fetchall()
+                self.logger.debug("Read query executed successfully: %s - Response: %s", query, result)
+                return result
+            except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+                if attempt == 0:
+                    self.logger.warning("Lost database connection, retrying read DB-Query: " + str(e))
+                    continue
+                self.logger.error("Could not execute read DB-Query:" + str(e))
+                return False
+            except psycopg2.Error as e:
+                self.logger.error("Could not execute read DB-Query:" + str(e))
+                return False
@@ -1,22 +1,65 @@
 from logging import Logger
 from databaseconnector import dbconnectors_postgresql
-from typing import List
+from typing import AsyncIterator, List
 import os
 import shutil
+import hashlib
+import secrets
+import time
+import json
+import gzip
+import zipfile
+import compression
+import storage
 import configparser
 
-from fastapi import UploadFile, responses
+from fastapi import UploadFile
+from fastapi.concurrency import run_in_threadpool
+
+"""
+Write-only stream that collects the bytes written by zipfile, so an archive can be sent while it is written.
+"""
+class archivebuffer():
+    chunks = None
+    def __init__(self) -> None:
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    """
+    Returns and removes the bytes written since the last call.
+    """
+    def take(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
 
 """
 Constructor method that initializes logger and db instance variables.
 """
 class datahandler():
     dataFolder="./SharedDataFiles/"
+    # bytes written to disk at once when storing uploads
+    chunkSize=1024 * 1024
+    # maximum size of one uploaded file in bytes, 0 means unlimited
+    maxUploadSize=0
+    # blobs of compressible files with at least compressMinSize bytes are stored gzip compressed if that saves at least 10%
+    compressFiles=True
+    compressMinSize=4096
+    compressionLevel=6
     logger=None
     db=None
+    # backend storing the blobs, see storage.py. Temporary files, resumable uploads and files stored before blobs existed stay in dataFolder
+    storage=None
     def __init__(self, logger: Logger, dbconnector: dbconnectors_postgresql) -> None:
         self.logger = logger
         self.db = dbconnector
+        self.storage = storage.localstorage(self.dataFolder + ".blobs/")
         
     """
     Method that creates a folder for the given username.
@@ -45,34 +88,370 @@ class datahandler():
             return False
         
     """
-    Method that stores the given list of files in a folder for the given username.
+    Method that stores the given list of files as blobs. Returns one dict per file with filename, hash, size and the temporary file,
+    which has to be passed to prepareBlob and then to commitBlob while the share referencing the blob is created.
+    Files exceeding the remaining storage quota of the user are rejected before they are copied, or as soon as the quota is exceeded while copying.
     """
     def storeFiles(self, username: str, files: List[UploadFile]):
+        blobs: list = []
+        quota, result = self.db.getRemainingQuota(username=username)
+        if not result:
+            return "Error occurred, could not check the storage quota!", False
+        remainingBytes = quota[0]
+        message = self.checkQuota(quota, size=sum(file.size or 0 for file in files), files=len(files))
+        if message is not None:
+            for file in files:
+                file.file.close()
+            return message, False
+        stored = 0
         for file in files:
-            destfile = self.dataFolder + username + "/" + str(file.filename)
-            self.logger.debug("Uploading file " + destfile)
+            self.logger.debug("Uploading file " + str(file.filename) + " of user " + username)
+            if self.maxUploadSize and file.size is not None and file.size > self.maxUploadSize:
+                file.file.close()
+                self.__discardBlobs(blobs)
+                return "File " + str(file.filename) + " exceeds the upload limit of " + str(self.maxUploadSize) + " bytes", False
+            tempfile = self.__tempFile()
+            digest = hashlib.sha256()
             try:
-                with open(destfile, 'wb') as f:
-                    while contents := file.file.read(1024 * 1024):
+                size = 0
+                with open(tempfile, 'wb') as f:
+                    while contents := file.file.read(self.chunkSize):
+                        size += len(contents)
+                        if self.maxUploadSize and size > self.maxUploadSize:
+                            raise ValueError("File " + str(file.filename) + " exceeds the upload limit of " + str(self.maxUploadSize) + " bytes")
+                        if remainingBytes is not None and stored + size > remainingBytes:
+                            raise ValueError("Storage quota exceeded, " + str(remainingBytes) + " bytes left")
+                        digest.update(contents)
                         f.write(contents)
-            except Exception:
-                os.remove(destfile + str(file.filename))
-                return responses.JSONResponse(status_code=500, content={"Error":f"There was an error uploading the file(s): {[file.filename for file in files]}"}), False
+                stored += size
+                blobs.append({"filename": str(file.filename), "hash": digest.hexdigest(), "size": size, "file": tempfile})
+            except Exception as e:
+                if os.path.exists(tempfile):
+                    os.remove(tempfile)
+                self.__discardBlobs(blobs)
+                if isinstance(e, ValueError):
+                    return str(e), False
+                return f"There was an error uploading the file(s): {[file.filename for file in files]}", False
             finally:
                 file.file.close()
-        return {"message": f"Successfuly uploaded {[file.filename for file in files]}"}, True
+        return blobs, True
 
     """
-    Method that returns the full  path to a file specified by username and filename parameters.
+    Method that stores a file streamed as chunks of bytes, e.g. a request body, as a blob. Returns the same dict as storeFiles.
+    Chunks are hashed and written as they arrive without blocking the event loop. The upload is aborted as soon as it exceeds maxUploadSize
+    or the remaining storage quota of the user. If the size of the file is known in advance, e.g. from the Content-Length header,
+    files that are too large are rejected before any byte is read.
     """
-    def getFilePath(self, username: str, filename: str):
-        destfile = self.dataFolder + username + "/" + filename
-        return destfile
+    async def storeStream(self, username: str, filename: str, stream: AsyncIterator[bytes], contentLength: int | None = None):
+        filename = os.path.basename(filename)
+        if filename in ("", ".", ".."):
+            return "Filename is not valid", False
+        if self.maxUploadSize and contentLength is not None and contentLength > self.maxUploadSize:
+            return "File " + filename + " exceeds the upload limit of " + str(self.maxUploadSize) + " bytes", False
+        quota, result = await self.db.run(self.db.getRemainingQuota, username=username)
+        if not result:
+            return "Error occurred, could not check the storage quota!", False
+        message = self.checkQuota(quota, size=contentLength or 0, files=1)
+        if message is not None:
+            return message, False
+        remainingBytes = quota[0]
+        tempfile = self.__tempFile()
+        self.logger.debug("Uploading file " + filename + " of user " + username)
+        size = 0
+        digest = hashlib.sha256()
+        buffer = bytearray()
+        try:
+            f = await run_in_threadpool(open, tempfile, 'wb')
+            try:
+                async for chunk in stream:
+                    size += len(chunk)
+                    if self.maxUploadSize and size > self.maxUploadSize:
+                        raise ValueError("File " + filename + " exceeds the upload limit of " + str(self.maxUploadSize) + " bytes")
+                    if remainingBytes is not None and size > remainingBytes:
+                        raise ValueError("Storage quota exceeded, " + str(remainingBytes) + " bytes left")
+                    buffer += chunk
+                    if len(buffer) >= self.chunkSize:
+                        digest.update(buffer)
+                        await run_in_threadpool(f.write, buffer)
+                        buffer.clear()
+                if buffer:
+                    digest.update(buffer)
+                    await run_in_threadpool(f.write, buffer)
+            finally:
+                await run_in_threadpool(f.close)
+        except Exception as e:
+            self.logger.error("Could not upload file " + filename + " of user " + username + ": " + str(e))
+            if os.path.exists(tempfile):
+                await run_in_threadpool(os.remove, tempfile)
+            if isinstance(e, ValueError):
+                return str(e), False
+            return "There was an error uploading the file " + filename, False
+        return {"filename": filename, "hash": digest.hexdigest(), "size": size, "file": tempfile}, True
+
+    """
+    Method that checks if size bytes in the given number of files fit into the remaining quota returned by getRemainingQuota.
+    Returns an error message if they do not fit, otherwise None.
+    """
+    def checkQuota(self, quota: tuple, size: int, files: int):
+        remainingBytes, remainingFiles = quota
+        if remainingFiles is not None and files > remainingFiles:
+            return "File quota exceeded, " + str(remainingFiles) + " files left"
+        if remainingBytes is not None and size > remainingBytes:
+            return "Storage quota exceeded, " + str(remainingBytes) + " bytes left"
+        return None
+
+    """
+    Method that prepares the temporary file of a stored blob for commitBlob, by compressing it if that is worth it. Blobs already in the
+    storage are skipped.
+    """
+    def prepareBlob(self, blob: dict):
+        key = self.__blobKey(blob["hash"])
+        try:
+            blob["compressed"] = False
+            if self.compressFiles and blob["size"] >= self.compressMinSize and not self.storage.exists(key) and not self.storage.exists(key + ".gz"):
+                blob["compressed"] = self.__compressBlob(blob)
+        except Exception as e:
+            self.logger.warning("Could not compress blob " + blob["hash"] + ": " + str(e))
+        return True
+
+    """
+    Method that moves the temporary file of a stored blob to its content-addressed location in the storage, compressed if prepareBlob
+    compressed it. Called outside of any transaction after the blob was referenced with reserveBlobs, so the garbage collection does not
+    delete it, and before the shares are created, so the file exists before a device is notified. With keepFile the temporary file is
+    stored without being moved or deleted, e.g. the partial file of an upload that has to stay until its share is committed. Temporary
+    files left over, e.g. because the blob already exists, are deleted with discardBlob. Returns if the blob is stored.
+    """
+    def commitBlob(self, blob: dict, keepFile: bool = False):
+        key = self.__blobKey(blob["hash"])
+        try:
+            if self.storage.exists(key) or self.storage.exists(key + ".gz"):
+                return True
+            if blob.get("compressed"):
+                self.storage.put(key + ".gz", blob["file"] + ".gz", contentEncoding="gzip")
+            else:
+                self.storage.put(key, blob["file"], keep=keepFile)
+            return True
+        except Exception as e:
+            self.logger.error("Could not store blob " + blob["hash"] + ": " + str(e))
+            return False
+
+    """
+    Method that writes a gzip compressed copy of the temporary file of a blob next to it, if the file is compressible and the copy
+    is at least 10% smaller. Returns if the copy was kept.
+    """
+    def __compressBlob(self, blob: dict):
+        with open(blob["file"], "rb") as source:
+            if not compression.isCompressible(blob["filename"], source.read(64 * 1024)):
+                return False
+            source.seek(0)
+            # mtime=0 keeps the compressed file identical for identical content
+            with gzip.GzipFile(blob["file"] + ".gz", "wb", compresslevel=self.compressionLevel, mtime=0) as target:
+                while contents := source.read(self.chunkSize):
+                    target.write(contents)
+        if os.path.getsize(blob["file"] + ".gz") < blob["size"] * 0.9:
+            return True
+        os.remove(blob["file"] + ".gz")
+        return False
+
+    """
+    Method that deletes the temporary file of a stored blob that will not be referenced. With keepFile only the compressed copy is
+    deleted, e.g. to keep the partial file of a resumable upload.
+    """
+    def discardBlob(self, blob: dict, keepFile: bool = False):
+        try:
+            for path in ([] if keepFile else [blob["file"]]) + [blob["file"] + ".gz"]:
+                if os.path.exists(path):
+                    os.remove(path)
+            return True
+        except Exception:
+            return False
+
+    """
+    Method that deletes the temporary files of a list of stored blobs.
+    """
+    def __discardBlobs(self, blobs: list):
+        for blob in blobs:
+            self.discardBlob(blob)
+
+    """
+    Method that returns a new temporary file for an upload.
+    """
+    def __tempFile(self):
+        os.makedirs(self.dataFolder + ".uploads/", exist_ok=True)
+        return self.dataFolder + ".uploads/" + secrets.token_hex(16) + ".part"
+
+    """
+    Method that returns the storage key of a blob, in a subfolder named after the first two characters of its SHA-256 hash.
+    The local blob folder starts with a dot, so it can not collide with the folder of a user.
+    """
+    def __blobKey(self, blobHash: str):
+        return blobHash[:2] + "/" + blobHash
+
+    """
+    Method that deletes the file of a blob, called by the database connector while the blob row is locked.
+    """
+    def __unlinkBlob(self, blobHash: str):
+        key = self.__blobKey(blobHash)
+        self.logger.debug("deleting blob " + key)
+        self.storage.remove(key)
+        self.storage.remove(key + ".gz")
+
+    """
+    Method that returns the path of the partial file of a resumable upload.
+    """
+    def __uploadFile(self, uploadId: str):
+        return self.dataFolder + ".uploads/" + uploadId + ".part"
+
+    """
+    Method that creates the partial file of a resumable upload with the final size of the file.
+    """
+    def createUpload(self, uploadId: str, size: int):
+        partfile = self.__uploadFile(uploadId)
+        self.logger.debug("Creating upload " + partfile)
+        try:
+            os.makedirs(os.path.dirname(partfile), exist_ok=True)
+            with open(partfile, 'wb') as f:
+                f.truncate(size)
+            return True
+        except Exception:
+            return False
+
+    """
+    Method that writes a chunk of a resumable upload, streamed as the request body, at the given offset of the partial file.
+    The received byte range is recorded in the database, also if the connection drops in the middle of the chunk.
+    """
+    async def storeChunk(self, uploadId: str, offset: int, size: int, stream: AsyncIterator[bytes]):
+        partfile = self.__uploadFile(uploadId)
+        written = 0
+        buffer = bytearray()
+        try:
+            fd = await run_in_threadpool(os.open, partfile, os.O_WRONLY)
+            try:
+                async for chunk in stream:
+                    if offset + written + len(buffer) + len(chunk) > size:
+                        raise ValueError("Chunk exceeds the file size of " + str(size) + " bytes")
+                    buffer += chunk
+                    if len(buffer) >= self.chunkSize:
+                        written += await run_in_threadpool(self.__pwrite, fd, buffer, offset + written)
+                        buffer.clear()
+                if buffer:
+                    written += await run_in_threadpool(self.__pwrite, fd, buffer, offset + written)
+            finally:
+                await run_in_threadpool(os.close, fd)
+        except Exception as e:
+            self.logger.error("Could not store chunk of upload " + uploadId + ": " + str(e))
+            if written:
+                await self.db.run(self.db.addUploadChunk, uploadId=uploadId, offset=offset, length=written)
+            if isinstance(e, ValueError):
+                return str(e), False
+            return "There was an error uploading the chunk, received " + str(written) + " bytes", False
+        if written and not await self.db.run(self.db.addUploadChunk, uploadId=uploadId, offset=offset, length=written):
+            return "Error occurred, could not store chunk", False
+        return {"received": written}, True
+
+    """
+    Method that writes all bytes of data to the file descriptor at the given offset and returns the number of bytes written.
+    """
+    def __pwrite(self, fd: int, data: bytearray, offset: int):
+        view = memoryview(data)
+        while view:
+            count = os.pwrite(fd, view, offset)
+            view = view[count:]
+            offset += count
+        return len(data)
+
+    """
+    Method that hashes the completed file of a resumable upload. Returns the same dict as storeFiles.
+    """
+    def finalizeUpload(self, uploadId: str, filename: str):
+        partfile = self.__uploadFile(uploadId)
+        self.logger.debug("Finalizing upload " + uploadId)
+        try:
+            size = 0
+            digest = hashlib.sha256()
+            with open(partfile, 'rb') as f:
+                while contents := f.read(self.chunkSize):
+                    size += len(contents)
+                    digest.update(contents)
+            return {"filename": filename, "hash": digest.hexdigest(), "size": size, "file": partfile}, True
+        except Exception:
+            return "Error occurred, could not finalize upload!", False
+
+    """
+    Method that deletes the partial file of a resumable upload.
+    """
+    def removeUpload(self, uploadId: str):
+        partfile = self.__uploadFile(uploadId)
+        self.logger.debug("deleting upload " + partfile)
+        try:
+            if os.path.exists(partfile):
+                os.remove(partfile)
+            return True
+        except Exception:
+            return False
 
     """
-    Method that deletes a file by the username and filename parameters.
+    Method that locates a file specified by its blob hash, or by username and filename for files stored before blobs existed.
+    Returns a dict with the storage "key", None for files outside of the storage, the "path" on the local disk, None if the storage is not
+    local, a "url" to download it directly from the storage, None if the storage can not serve downloads, and the "encoding" it is stored with,
+    "gzip" or None.
     """
-    def removeFile(self, username: str, filename: str):
+    def getFile(self, username: str, filename: str, blobHash: str | None = None):
+        if blobHash is None:
+            return {"key": None, "path": self.dataFolder + username + "/" + filename, "url": None, "encoding": None}
+        key, encoding = self.__blobKey(blobHash), None
+        if self.storage.exists(key + ".gz"):
+            key, encoding = key + ".gz", "gzip"
+        return {"key": key, "path": self.storage.path(key), "url": self.storage.url(key, filename), "encoding": encoding}
+
+    """
+    Generator that yields the content of a file located by getFile in chunks of chunkSize, decompressed unless decompress is False.
+    """
+    def readFile(self, file: dict, decompress: bool = True):
+        source = self.storage.open(file["key"]) if file["key"] is not None else open(file["path"], "rb")
+        with source:
+            reader = gzip.GzipFile(fileobj=source) if decompress and file["encoding"] == "gzip" else source
+            while contents := reader.read(self.chunkSize):
+                yield contents
+
+    """
+    Generator that streams a zip archive with the given file entries and a shares.json listing all entries. Text and url entries are only
+    contained in shares.json, files are stored as files/<number>-<filename> and referenced by "File" in shares.json.
+    The archive is written while it is sent, files are read in chunks of chunkSize and stored without compression.
+    """
+    def archiveShares(self, username: str, shares: list, files: list):
+        buffer = archivebuffer()
+        manifest = [{"Timestamp": share[0].isoformat(), "DataType": share[3], "Data": share[4], "AutoOpen": share[5], "Encrypted": share[6]} for share in shares]
+        with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_STORED) as archive:
+            for number, share in enumerate(files):
+                name = "files/" + str(number) + "-" + os.path.basename(share[4])
+                manifest.append({"Timestamp": share[0].isoformat(), "DataType": share[3], "Data": share[4], "AutoOpen": share[5], "Encrypted": share[6], "File": name})
+                try:
+                    chunks = self.readFile(self.getFile(username=username, filename=share[4], blobHash=share[7]))
+                    # reading the first chunk opens the file, so a missing file does not leave an empty entry
+                    first = next(chunks, b"")
+                    with archive.open(name, "w", force_zip64=True) as target:
+                        target.write(first)
+                        for chunk in chunks:
+                            target.write(chunk)
+                            yield buffer.take()
+                except Exception as e:
+                    self.logger.error("Could not add " + share[4] + " to archive: " + str(e))
+                    manifest[-1]["File"] = None
+                yield buffer.take()
+            archive.writestr("shares.json", json.dumps(sorted(manifest, key=lambda entry: entry["Timestamp"])))
+        yield buffer.take()
+
+    """
+    Method that deletes a file by the username and filename parameters. Blobs are only deleted if no share references them anymore.
+    """
+    def removeFile(self, username: str, filename: str, blobHash: str | None = None):
+        if blobHash is not None:
+            try:
+                self.removeBlob(blobHash=blobHash)
+                return True
+            except Exception:
+                return "Error while deliting blob " + blobHash + " of file " + filename, False
         destfile = self.dataFolder + username + "/" + filename
         self.logger.debug("deleting file " + destfile)
         try:
@@ -81,6 +460,126 @@ class datahandler():
         except Exception:
             return "Error while deliting file " + filename + " of user " + username, False
         
+    """
+    Method that deletes the files of deleted file shares, blobs only if no other share references them anymore.
+    """
+    def removeShareFiles(self, shareData: list):
+        for share in shareData:
+            if share[3] == "file":
+                self.removeFile(username=share[1], filename=share[4], blobHash=share[7])
+
+    """
+    Method that deletes a blob if no share references it anymore. Returns the size of the deleted blob, 0 if it is still referenced.
+    """
+    def removeBlob(self, blobHash: str):
+        return self.db.removeBlob(blobHash=blobHash, remove=self.__unlinkBlob)
+
+    """
+    Method that deletes blob files without a row in the database, e.g. left behind by a crash. The files are checked in batches of batchSize.
+    Returns the number of deleted files and their size in bytes.
+    """
+    def removeOrphanedBlobs(self, batchSize: int):
+        count, size = 0, 0
+        blobs: dict = {}
+        for blobHash, blobSize in self.__blobFiles():
+            blobs[blobHash] = blobSize
+            if len(blobs) >= batchSize:
+                count, size = self.__removeOrphanedBatch(blobs, count, size)
+        if blobs:
+            count, size = self.__removeOrphanedBatch(blobs, count, size)
+        return count, size
+
+    """
+    Method that deletes the orphaned blobs of a batch of blob files, given by hash and size, and clears the batch. Returns the updated totals.
+    """
+    def __removeOrphanedBatch(self, blobs: dict, count: int, size: int):
+        removed, result = self.db.removeOrphanedBlobs(blobHashes=list(blobs), remove=self.__unlinkBlob)
+        if result:
+            count += len(removed)
+            size += sum(blobs[blobHash] for blobHash in removed)
+        blobs.clear()
+        return count, size
+
+    """
+    Method that yields the hash and size of every stored blob file.
+    """
+    def __blobFiles(self):
+        for key, size in self.storage.list():
+            yield key.rsplit("/", 1)[-1].removesuffix(".gz"), size
+
+    """
+    Method that deletes temporary and partial upload files that were not modified within the last age seconds.
+    Returns the number of deleted files and their size in bytes.
+    """
+    def removeStaleUploads(self, age: float):
+        uploadfolder = self.dataFolder + ".uploads/"
+        count, size = 0, 0
+        if not os.path.isdir(uploadfolder):
+            return count, size
+        cutoff = time.time() - age
+        with os.scandir(uploadfolder) as entries:
+            for entry in entries:
+                try:
+                    stat = entry.stat()
+                    if entry.is_file() and stat.st_mtime < cutoff:
+                        os.remove(entry.path)
+                        count += 1
+                        size += stat.st_size
+                except FileNotFoundError:
+                    pass
+        return count, size
+
+    """
+    Method that deletes files in the folders of the users that no share references, and the folders of users that do not exist anymore.
+    Returns the number of deleted files and their size in bytes.
+    """
+    def removeOrphanedFiles(self):
+        count, size = 0, 0
+        if not os.path.isdir(self.dataFolder):
+            return count, size
+        with os.scandir(self.dataFolder) as folders:
+            userfolders = [folder for folder in folders if folder.is_dir() and not folder.name.startswith(".")]
+        for folder in userfolders:
+            exists, result = self.db.checkUserNameExists(folder.name)
+            # if the database can not be asked, the folder is kept instead of being taken for the folder of a removed user
+            if not result:
+                continue
+            if not exists:
+                for entry in self.__scanFiles(folder.path):
+                    try:
+                        size += entry.stat().st_size
+                        count += 1
+                    except FileNotFoundError:
+                        pass
+                self.removeFolder(username=folder.name)
+                continue
+            referenced, result = self.db.getUserFiles(username=folder.name)
+            if not result:
+                continue
+            for entry in self.__scanFiles(folder.path):
+                if entry.name in referenced:
+                    continue
+                # files may be deleted concurrently, e.g. by a request removing a share
+                try:
+                    fileSize = entry.stat().st_size
+                    self.logger.debug("deleting orphaned file " + entry.path)
+                    os.remove(entry.path)
+                    size += fileSize
+                    count += 1
+                except FileNotFoundError:
+                    pass
+        return count, size
+
+    """
+    Method that returns the files in the given folder, or no files if the folder does not exist anymore.
+    """
+    def __scanFiles(self, folder: str):
+        try:
+            with os.scandir(folder) as entries:
+                return [entry for entry in entries if entry.is_file()]
+        except FileNotFoundError:
+            return []
+
     """
     Method that retrieves the database credentials.
     """
@@ -0,0 +1,53 @@
+import os
+from urllib.parse import quote
+
+from starlette import responses
+
+"""
+Delivery of the files stored on the local disk for /beamit/receive. The mode decides who copies the file to the client:
+
+direct      the application reads the file in chunks of readAhead bytes and sends them. If the ASGI server offers the pathsend extension,
+            starlette passes it the path instead and the server sends the file.
+accel       the application only answers with an X-Accel-Redirect header and a fronting nginx sends the file from an internal location
+            that maps accelPrefix to the data folder
+xsendfile   the application only answers with an X-Sendfile header containing the absolute path and a fronting Apache (mod_xsendfile)
+            or lighttpd sends the file
+"""
+
+modes = ("direct", "accel", "xsendfile")
+
+"""
+FileResponse that reads the file in chunks of readAhead bytes.
+"""
+class fileresponse(responses.FileResponse):
+    def __init__(self, path: str, readAhead: int = 1024 * 1024, **kwargs) -> None:
+        super().__init__(path, **kwargs)
+        self.chunk_size = readAhead
+
+"""
+Class that builds the responses delivering stored files in the configured mode.
+"""
+class filedelivery():
+    mode = "direct"
+    readAhead = 1024 * 1024
+    accelPrefix = "/beamit-files/"
+    dataFolder = ""
+    def __init__(self, dataFolder: str) -> None:
+        self.dataFolder = dataFolder
+
+    """
+    Method that returns the response sending the file at path to the client as filename with the given headers. Compressed files are
+    always sent by the application, because the proxies would not send their Content-Encoding.
+    """
+    def response(self, path: str, filename: str, headers: dict, compressed: bool = False):
+        if self.mode in ("accel", "xsendfile") and not compressed:
+            headers = dict(headers)
+            headers["content-disposition"] = "attachment; filename*=utf-8''" + quote(filename)
+            if self.mode == "accel":
+                relativePath = os.path.relpath(path, self.dataFolder).replace(os.sep, "/")
+                headers["x-accel-redirect"] = self.accelPrefix.rstrip("/") + "/" + quote(relativePath)
+            else:
+                headers["x-sendfile"] = os.path.abspath(path)
+            return responses.Response(media_type="application/octet-stream", headers=headers)
+        return fileresponse(path, readAhead=self.readAhead, media_type="application/octet-stream", filename=filename, headers=headers)
+
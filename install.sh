@@ -90,7 +90,7 @@ create_user() {
 copy_files() {
   if [ -f "./databaseconnector.py" ]; then
     mkdir $INSTALLDIR
-    cp databaseconnector.py datahandler.py logutil.py main.py pwcrypt.py README.md run.py $INSTALLDIR
+    cp databaseconnector.py datahandler.py logutil.py main.py pwcrypt.py tokencache.py metrics.py compression.py storage.py download.py validation.py sharenotifier.py sharesweeper.py ratelimiter.py README.md run.py $INSTALLDIR
     mkdir $INSTALLDIR/SharedDataFiles
     chown -R beamit:beamit $INSTALLDIR
     chmod -R 755 $INSTALLDIR
@@ -112,6 +112,8 @@ WorkingDirectory=$INSTALLDIR
 ExecStart=$PYTHON ./run.py
 Type=simple
 Restart=always
+KillSignal=SIGTERM
+TimeoutStopSec=60
 User=beamit
 Group=beamit
 
@@ -135,6 +137,67 @@ EOF
 name = $DB_NAME
 user = $DB_USER
 password = $DB_USER_PASS
+host = localhost
+port = 5432
+poolmin = 2
+poolmax = 10
+tokencachesize = 10000
+tokencachettl = 30
+
+[SERVER]
+host = 0.0.0.0
+port = 8000
+workers = 0
+backlog = 2048
+keepalive = 5
+limitconcurrency = 0
+gracefultimeout = 30
+
+[DATA]
+chunksize = 1048576
+maxuploadsize = 0
+receivedretention = 86400
+quotabytes = 0
+quotafiles = 0
+compressfiles = true
+compressionlevel = 6
+
+[STORAGE]
+backend = local
+bucket =
+prefix = blobs/
+endpoint =
+region =
+accesskey =
+secretkey =
+urlexpiry = 300
+
+[DOWNLOAD]
+mode = direct
+readahead = 1048576
+accelprefix = /beamit-files/
+
+[SWEEPER]
+interval = 60
+reconcileinterval = 3600
+batchsize = 1000
+sharettl = 0
+maxshares = 0
+uploadttl = 86400
+
+[LOGIN]
+hashworkers = 2
+iterations = 100000
+clientattempts = 30
+userattempts = 10
+window = 60
+
+[LOG]
+level = info
+json = false
+maxbytes = 10485760
+backupdays = 14
+samplingburst = 10
 EOF
   
   chown beamit:beamit $DB_CONF_FILE
@@ -162,9 +225,13 @@ $STD apt install -y python3
 $STD apt install -y python3-pip
 
 $STD pip3 install fastapi
+$STD pip3 install "starlette>=0.39"
 $STD pip3 install uvicorn
 $STD pip3 install psycopg2
 $STD pip3 install python-multipart
+$STD pip3 install websockets
+$STD pip3 install prometheus_client
+$STD pip3 install zstandard
 
 
 msg_info "Installing BeamIT-Server"
@@ -1,10 +1,165 @@
 import logging
+import logging.handlers
+import atexit
+import glob
+import json
 import os
-from datetime import datetime
+import queue
+import threading
+import time
+from datetime import date, datetime, timedelta
 
+"""
+Handler that writes to one file per day, e.g. beamit-server-2026-01-31.log, and continues in beamit-server-2026-01-31.1.log and so on
+once a file reaches maxBytes. Files are never renamed, so several worker processes can append to the same file and switch to the next
+file consistently. Files older than backupDays days are deleted.
+"""
+class rotatingfilehandler(logging.Handler):
+    folder = ""
+    prefix = ""
+    maxBytes = 0
+    backupDays = 0
+    stream = None
+    path = None
+    day = None
+    index = 0
+    def __init__(self, folder: str, prefix: str = "beamit-server", maxBytes: int = 10 * 1024 * 1024, backupDays: int = 14) -> None:
+        super().__init__()
+        self.folder = folder
+        self.prefix = prefix
+        self.maxBytes = maxBytes
+        self.backupDays = backupDays
 
+    def emit(self, record):
+        try:
+            message = self.format(record)
+            self.__rotate()
+            self.stream.write(message + "\n")
+            self.stream.flush()
+        except Exception:
+            self.handleError(record)
 
-def init(level):
+    def close(self):
+        self.acquire()
+        try:
+            if self.stream is not None:
+                self.stream.close()
+                self.stream = None
+        finally:
+            self.release()
+        super().close()
+
+    """
+    Method that opens the file for the current day and size index if it changed.
+    """
+    def __rotate(self):
+        today = date.today()
+        if today != self.day:
+            self.day = today
+            self.index = 0
+            self.__removeOldFiles()
+        elif self.maxBytes and os.fstat(self.stream.fileno()).st_size < self.maxBytes:
+            return
+        # other processes may already have continued in a later file
+        while self.maxBytes and os.path.exists(self.__fileName()) and os.path.getsize(self.__fileName()) >= self.maxBytes:
+            self.index += 1
+        if self.__fileName() != self.path:
+            if self.stream is not None:
+                self.stream.close()
+            self.path = self.__fileName()
+            self.stream = open(self.path, "a", encoding="utf-8")
+
+    """
+    Method that returns the name of the file for the current day and size index.
+    """
+    def __fileName(self):
+        suffix = "." + str(self.index) if self.index else ""
+        return os.path.join(self.folder, self.prefix + "-" + self.day.isoformat() + suffix + ".log")
+
+    """
+    Method that deletes the files of days older than backupDays.
+    """
+    def __removeOldFiles(self):
+        if not self.backupDays:
+            return
+        oldest = (self.day - timedelta(days=self.backupDays)).isoformat()
+        for path in glob.glob(os.path.join(self.folder, self.prefix + "-*.log")):
+            day = os.path.basename(path)[len(self.prefix) + 1:][:10]
+            if day < oldest:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+"""
+Formatter that writes every record as one JSON object per line.
+"""
+class jsonformatter(logging.Formatter):
+    def format(self, record):
+        entry = {"time": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"), "level": record.levelname, "thread": record.threadName, "function": record.funcName, "message": record.getMessage()}
+        if getattr(record, "dropped", 0):
+            entry["dropped"] = record.dropped
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+"""
+Formatter for plain text lines that also shows how many similar messages were dropped by the sampling filter.
+"""
+class textformatter(logging.Formatter):
+    def format(self, record):
+        message = super().format(record)
+        if getattr(record, "dropped", 0):
+            message += " (" + str(record.dropped) + " similar messages dropped)"
+        return message
+
+"""
+Filter that limits records below WARNING to burst records per interval seconds for every line of code that logs them.
+The number of dropped records is attached to the next record of the same line as "dropped".
+"""
+class samplingfilter(logging.Filter):
+    interval = 0
+    burst = 0
+    windows = None
+    lock = None
+    def __init__(self, interval: float = 1, burst: int = 10) -> None:
+        super().__init__()
+        self.interval = interval
+        self.burst = burst
+        self.windows = {}
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        if self.burst <= 0 or record.levelno >= logging.WARNING:
+            return True
+        key = (record.pathname, record.lineno)
+        now = time.monotonic()
+        with self.lock:
+            window = self.windows.get(key)
+            if window is None or now - window[0] >= self.interval:
+                record.dropped = window[2] if window is not None else 0
+                self.windows[key] = [now, 1, 0]
+                return True
+            if window[1] < self.burst:
+                window[1] += 1
+                return True
+            window[2] += 1
+            return False
+
+"""
+Queue handler that puts the records on the queue as they are. The message is formatted by the listener thread,
+so logging only costs the caller a queue put and arguments passed to the logger must not be changed afterwards.
+"""
+class queuehandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        return record
+
+"""
+Function that configures the logger "log". Records are put on a queue by the logging threads and written to the console and the log
+files in ./log by a background thread. The listener is stopped and the queue flushed when the process exits.
+level is one of "debug", "info", "warning" or "error". Records below WARNING are sampled to samplingburst records per second and line of code.
+"""
+def init(level, jsonformat: bool = False, maxbytes: int = 10 * 1024 * 1024, backupdays: int = 14, samplingburst: int = 10):
     if not os.path.exists("./log"):
         os.makedirs("./log")
 
@@ -12,21 +167,30 @@ def init(level):
         level = logging.DEBUG
     if level == "error":
         level = logging.ERROR
+    if level == "warning":
+        level = logging.WARNING
     if level == "info":
         level = logging.INFO
-    
+
     logger = logging.getLogger("log")
     logger.setLevel(level)
+    if jsonformat:
+        formatter = jsonformatter()
+    else:
+        formatter = textformatter('%(asctime)s - %(threadName)s - %(funcName)s - %(levelname)s - %(message)s')
     l1 = logging.StreamHandler()
-    l1.setLevel(level)
-    l2 = logging.FileHandler(filename="./log/beamit-server-" + datetime.now().strftime('%Y-%m-%d') + ".log")
-    l2.setLevel(level)
-    formatter = logging.Formatter('%(asctime)s - %(threadName)s - %(funcName)s - %(levelname)s - %(message)s')
-    #formatter = logging.Formatter('%(asctime)s - %(threadName)s - %(levelname)s - %(message)s')
+    l2 = rotatingfilehandler(folder="./log", maxBytes=maxbytes, backupDays=backupdays)
     l1.setFormatter(formatter)
     l2.setFormatter(formatter)
-    logger.addHandler(l1)
-    logger.addHandler(l2)
+
+    handler = queuehandler(queue.SimpleQueue())
+    handler.addFilter(samplingfilter(burst=samplingburst))
+    logger.handlers.clear()
+    logger.addHandler(handler)
+    logger.propagate = False
+    listener = logging.handlers.QueueListener(handler.queue, l1, l2)
+    listener.start()
+    atexit.register(listener.stop)
 
     return logger
 
@@ -35,4 +199,4 @@ if __name__ == '__main__':
     logger.debug("debug")
     logger.error("error")
     logger.warning("waring")
-    logger.info("info")
\ No newline at end of file
+    logger.info("info")
@@ -1,17 +1,52 @@
 import logutil
 from databaseconnector import dbconnectors_postgresql
 from datahandler import datahandler
-import re
+from sharenotifier import sharenotifier
+from sharesweeper import sharesweeper
+from tokencache import tokencache
+from ratelimiter import ratelimiter
+import pwcrypt
+import metrics
+import compression
+import storage
+import download
+import validation
+from validation import Username, Devicename, TargetDevices
+from typing import Annotated
+import configparser
+import os
+import asyncio
 
-from fastapi import FastAPI, UploadFile, responses, Request, Form, BackgroundTasks
+from fastapi import FastAPI, UploadFile, responses, Request, Form, Header, Depends, BackgroundTasks, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
+from fastapi.exceptions import RequestValidationError
+from pydantic import ValidationError
+from fastapi.encoders import jsonable_encoder
 import secrets
+from urllib.parse import quote
 
 
 # Initializing logger, database connector, data handler and FastAPI application
-logger = logutil.init("info")
+logconfig = configparser.ConfigParser()
+logconfig.read('db.conf')
+logger = logutil.init(logconfig.get('LOG', 'level', fallback="info"), jsonformat=logconfig.getboolean('LOG', 'json', fallback=False), maxbytes=logconfig.getint('LOG', 'maxbytes', fallback=10 * 1024 * 1024), backupdays=logconfig.getint('LOG', 'backupdays', fallback=14), samplingburst=logconfig.getint('LOG', 'samplingburst', fallback=10))
 db = dbconnectors_postgresql(logger=logger)
 dh = datahandler(logger=logger, dbconnector=db)
+notifier = sharenotifier(logger=logger, dbconnector=db)
+sweeper = sharesweeper(logger=logger, dbconnector=db, datahandler=dh)
+delivery = download.filedelivery(dataFolder=dh.dataFolder)
 app = FastAPI()
+# the metrics middleware is added last, so it is the outermost and counts the compressed bytes
+app.add_middleware(compression.compressionmiddleware)
+app.add_middleware(metrics.metricsmiddleware)
+
+# Upper limit in seconds for how long a long-poll request waits for new data
+longPollMaxTimeout = 60
+# Upper limit for the number of entries per page of /beamit/checkAvailableData
+maxPageSize = 1000
+# Login and registration attempts per client address and failed logins per user allowed within the window
+clientLimiter = ratelimiter(maxAttempts=30)
+userLimiter = ratelimiter(maxAttempts=10)
 
 """
 Function to execute on application startup.
@@ -20,9 +55,38 @@ Function to execute on application startup.
 async def startup_event():
     logger.info("-")
     logger.info("BeamIT-Server starting...")
-    # Retrieving database configuration from file and initializing the database connection
+    # Retrieving database configuration from file and initializing the database connection, every worker process opens its own pool here.
+    # The tables are only created and migrated if run.py did not do it before starting the workers
     dbconfig = dh.getDatabaseConfig('db.conf')
-    db.initdb(host="localhost", port=5432, dbname=dbconfig['DBCONFIG']['name'], user=dbconfig['DBCONFIG']['user'], password=dbconfig['DBCONFIG']['password'])
+    db.tokenCache = tokencache(maxsize=dbconfig['DBCONFIG'].getint('tokencachesize', fallback=10000), ttl=dbconfig['DBCONFIG'].getfloat('tokencachettl', fallback=30))
+    db.initdb(host=dbconfig['DBCONFIG'].get('host', fallback="localhost"), port=dbconfig['DBCONFIG'].getint('port', fallback=5432), dbname=dbconfig['DBCONFIG']['name'], user=dbconfig['DBCONFIG']['user'], password=dbconfig['DBCONFIG']['password'], minconn=dbconfig['DBCONFIG'].getint('poolmin', fallback=2), maxconn=dbconfig['DBCONFIG'].getint('poolmax', fallback=10), initTables=os.environ.get("BEAMIT_SCHEMA_READY") != "1")
+    dh.chunkSize = dbconfig.getint('DATA', 'chunksize', fallback=dh.chunkSize)
+    dh.maxUploadSize = dbconfig.getint('DATA', 'maxuploadsize', fallback=dh.maxUploadSize)
+    dh.compressFiles = dbconfig.getboolean('DATA', 'compressfiles', fallback=dh.compressFiles)
+    dh.compressionLevel = dbconfig.getint('DATA', 'compressionlevel', fallback=dh.compressionLevel)
+    if dbconfig.get('STORAGE', 'backend', fallback="local") == "s3":
+        dh.storage = storage.s3storage(bucket=dbconfig['STORAGE']['bucket'], prefix=dbconfig.get('STORAGE', 'prefix', fallback=""), endpoint=dbconfig.get('STORAGE', 'endpoint', fallback=None), region=dbconfig.get('STORAGE', 'region', fallback=None), accessKey=dbconfig.get('STORAGE', 'accesskey', fallback=None), secretKey=dbconfig.get('STORAGE', 'secretkey', fallback=None), urlExpiry=dbconfig.getint('STORAGE', 'urlexpiry', fallback=300))
+    delivery.mode = dbconfig.get('DOWNLOAD', 'mode', fallback=delivery.mode)
+    if delivery.mode not in download.modes:
+        logger.warning("Unsupported download mode " + delivery.mode + ", files are sent directly")
+        delivery.mode = "direct"
+    delivery.readAhead = dbconfig.getint('DOWNLOAD', 'readahead', fallback=delivery.readAhead)
+    delivery.accelPrefix = dbconfig.get('DOWNLOAD', 'accelprefix', fallback=delivery.accelPrefix)
+    db.quotaBytes = dbconfig.getint('DATA', 'quotabytes', fallback=db.quotaBytes)
+    db.quotaFiles = dbconfig.getint('DATA', 'quotafiles', fallback=db.quotaFiles)
+    sweeper.receivedRetention = dbconfig.getint('DATA', 'receivedretention', fallback=sweeper.receivedRetention)
+    sweeper.interval = dbconfig.getfloat('SWEEPER', 'interval', fallback=sweeper.interval)
+    sweeper.reconcileInterval = dbconfig.getfloat('SWEEPER', 'reconcileinterval', fallback=sweeper.reconcileInterval)
+    sweeper.batchSize = dbconfig.getint('SWEEPER', 'batchsize', fallback=sweeper.batchSize)
+    sweeper.shareTTL = dbconfig.getint('SWEEPER', 'sharettl', fallback=sweeper.shareTTL)
+    sweeper.maxShares = dbconfig.getint('SWEEPER', 'maxshares', fallback=sweeper.maxShares)
+    sweeper.uploadTTL = dbconfig.getint('SWEEPER', 'uploadttl', fallback=sweeper.uploadTTL)
+    pwcrypt.init(max_workers=dbconfig.getint('LOGIN', 'hashworkers', fallback=2), new_iterations=dbconfig.getint('LOGIN', 'iterations', fallback=pwcrypt.iterations))
+    clientLimiter.maxAttempts = dbconfig.getint('LOGIN', 'clientattempts', fallback=clientLimiter.maxAttempts)
+    userLimiter.maxAttempts = dbconfig.getint('LOGIN', 'userattempts', fallback=userLimiter.maxAttempts)
+    clientLimiter.window = userLimiter.window = dbconfig.getfloat('LOGIN', 'window', fallback=userLimiter.window)
+    await notifier.start()
+    await sweeper.start()
     logger.info("BeamIT-Server has started")
 
 """
@@ -30,7 +94,11 @@ Function to execute on application shutdown.
 """
 @app.on_event("shutdown")
 async def shutdown_event():
+    logger.info("Token cache statistics: " + str(db.tokenCache.getStats()))
+    await sweeper.stop()
+    await notifier.stop()
     db.closedb()
+    metrics.markProcessDead(os.getpid())
     logger.info("Server stopped")
     
 """
@@ -41,6 +109,54 @@ async def root(request: Request):
     logger.debug("Root Adress was accessed")
     return responses.RedirectResponse(url=(request.url._url + "docs"))
 
+"""
+Function to export the metrics of all workers for Prometheus. The number of pending shares is counted on every scrape.
+"""
+@app.get("/metrics")
+async def get_metrics():
+    count, result = await db.run(db.countPendingShares)
+    if result:
+        metrics.pendingShares.set(count)
+    content, contentType = metrics.render()
+    return responses.Response(content=content, media_type=contentType)
+
+
+# Validated form parameters, a default value like = Form() would drop the validation of the annotated types
+UsernameForm = Annotated[Username, Form()]
+DevicenameForm = Annotated[Devicename, Form()]
+TargetDevicesForm = Annotated[TargetDevices, Form()]
+
+"""
+Function to get the token from an "Authorization: Bearer <token>" header.
+"""
+def bearerToken(authorization: str | None):
+    if authorization is not None:
+        scheme, _, token = authorization.partition(" ")
+        if scheme.lower() == "bearer":
+            return token.strip()
+    return None
+
+"""
+Dependency for endpoints with form parameters. The device token is read from the Authorization header or, for older clients, from the devicetoken form field.
+"""
+async def formDeviceToken(authorization: str | None = Header(default=None), devicetoken: str | None = Form(default=None)):
+    return bearerToken(authorization) or devicetoken or ""
+
+"""
+Dependency for endpoints that receive the file in the request body. The device token is read from the Authorization header or the devicetoken header.
+"""
+async def headerDeviceToken(authorization: str | None = Header(default=None), devicetoken: str | None = Header(default=None)):
+    return bearerToken(authorization) or devicetoken or ""
+
+"""
+Function to answer requests with missing or invalid parameters, e.g. a malformed username, before the device token or the database are checked.
+"""
+@app.exception_handler(RequestValidationError)
+async def validation_error(request: Request, exc: RequestValidationError):
+    errors = exc.errors()
+    name = str(errors[0]["loc"][-1]) if errors and errors[0].get("loc") else "request"
+    return responses.JSONResponse(status_code=422, content={"message": validation.errorMessage(name), "successfull": False})
+
 
 # User ----------------------------------------------------------------------------------------------------
 
@@ -48,9 +164,18 @@ async def root(request: Request):
 Function to handle user registration request.
 """
 @app.post("/user/register")
-async def user_register(username: str = Form(), password: str = Form()):
+async def user_register(request: Request, username: UsernameForm, password: str = Form()):
     logger.info("Registering new user \"" + username + "\"...")
-    response, result = db.addUser(username=username, password=password)
+    # Registrations are hashed like logins, so they count against the limit of the client address
+    client = request.client.host if request.client else ""
+    if not clientLimiter.allow(client):
+        return {"message": "Too many attempts. Please try again later", "successfull": False}
+    clientLimiter.hit(client)
+    response, result = await db.run(db.checkNewUser, username=username)
+    if not result:
+        return {"message": response, "successfull": False}
+    salt, pw_hash = await pwcrypt.hash_new_password_async(password)
+    response, result = await db.run(db.addUser, username=username, salt=salt, pw_hash=pw_hash, iterations=pwcrypt.iterations)
     if result:
         if dh.createFolder(username=username):
             return {"message": response, "successfull": True}
@@ -63,13 +188,17 @@ async def user_register(username: str = Form(), password: str = Form()):
 Function to handle user unregistration request.
 """
 @app.post("/user/unregister")
-async def user_unregister(username: str = Form(), devicename: str = Form(), devicetoken: str = Form()):
+async def user_unregister(background_tasks: BackgroundTasks, username: UsernameForm, devicename: DevicenameForm, devicetoken: str = Depends(formDeviceToken)):
     # Checking if the device token is valid for the given user and device name
-    if db.checkDeviceToken(username=username, devicename=devicename, devicetoken=devicetoken):
-        response, result = db.removeUser(username=username)
+    if await db.run(db.checkDeviceToken, username=username, devicename=devicename, devicetoken=devicetoken):
+        response, result = await db.run(db.removeUser, username=username)
         if result:
+            # The blobs of the deleted shares and the files of unfinished uploads are removed after the response was sent
+            background_tasks.add_task(func=dh.removeShareFiles, shareData=response["shares"])
+            for uploadId in response["uploads"]:
+                background_tasks.add_task(func=dh.removeUpload, uploadId=uploadId)
             if dh.removeFolder(username=username):
-                return {"message": response, "successfull": True}
+                return {"message": "User and Devices removed successfully", "successfull": True}
             else:
                 return {"message": "Error occurred, could not remove user!", "successfull": False}
         else:
@@ -81,18 +210,30 @@ async def user_unregister(username: str = Form(), devicename: str = Form(), devi
 Function to log in as a user with a password.
 """
 @app.post("/user/login")
-async def user_login(username: str = Form(), password: str = Form(), devicename: str = Form()):
-    # Check if login is successful using the login method from the database module
-    if db.login(username=username, password=password):
-        # If login is successful, generate a token using the secrets module and add the device to the database
-        token = "T-" + secrets.token_urlsafe(1024) + "##"
-        response, result = db.addDevice(username=username, devicename=devicename, devicetoken=token)
+async def user_login(request: Request, username: UsernameForm, devicename: DevicenameForm, password: str = Form()):
+    # Limit login attempts per client address and failed logins per user before any password is hashed
+    client = request.client.host if request.client else ""
+    if not clientLimiter.allow(client) or not userLimiter.allow(username):
+        return {"message": "Too many login attempts. Please try again later", "successfull": False}
+    clientLimiter.hit(client)
+    # Check if login is successful by comparing the password with the stored hash in the password hashing pool
+    stored, result = await db.run(db.getPasswordHash, username=username)
+    if result and await pwcrypt.is_correct_password_async(stored[0], stored[1], password, stored[2]):
+        userLimiter.reset(username)
+        # Rehash the password if the configured iterations changed since it was hashed
+        if stored[2] != pwcrypt.iterations:
+            salt, pw_hash = await pwcrypt.hash_new_password_async(password)
+            await db.run(db.updatePasswordHash, username=username, salt=salt, pw_hash=pw_hash, iterations=pwcrypt.iterations)
+        # If login is successful, generate a token with 32 random bytes and add the device to the database, which only stores its hash
+        token = secrets.token_urlsafe(32)
+        response, result = await db.run(db.addDevice, username=username, devicename=devicename, devicetoken=token)
         if result == True:
             return {"message": {'username' : username, 'devicename' : devicename, 'token' : token }, "successfull": True}
         else:
             return {"message": response, "successfull": False}
     # Return an error message if login was unsuccessful
     else:
+        userLimiter.hit(username)
         return {"message": "Login failed. Please check username and password", "successfull": False}
 
 
@@ -102,12 +243,13 @@ async def user_login(username: str = Form(), password: str = Form(), devicename:
 Function for removing a device from a user's account.
 """
 @app.post("/device/remove")
-async def device_remove(username: str = Form(), devicename: str = Form(), devicetoken: str = Form(), targetDevice: str = Form()):
+async def device_remove(background_tasks: BackgroundTasks, username: UsernameForm, devicename: DevicenameForm, targetDevice: DevicenameForm, devicetoken: str = Depends(formDeviceToken)):
     # Check if device token is valid for given user and device name
-    if db.checkDeviceToken(username=username, devicename=devicename, devicetoken=devicetoken):
-        response, result = db.removeDevice(username=username, targetDevice=targetDevice)
+    if await db.run(db.checkDeviceToken, username=username, devicename=devicename, devicetoken=devicetoken):
+        response, result = await db.run(db.removeDevice, username=username, targetDevice=targetDevice)
         if result:
-            return {"message": response, "successfull": True}
+            background_tasks.add_task(func=dh.removeShareFiles, shareData=response)
+            return {"message": "Device removed successfully", "successfull": True}
         else:
             return {"message": response, "successfull": False}
     else:
@@ -117,11 +259,11 @@ async def device_remove(username: str = Form(), devicename: str = Form(), device
 Function to return a list of devices for a given user.
 """
 @app.post("/device/list")
-async def device_list(username: str = Form(), devicename: str = Form(), devicetoken: str = Form()):
+async def device_list(username: UsernameForm, devicename: DevicenameForm, devicetoken: str = Depends(formDeviceToken)):
     # Check if the given device token is valid for the given user and device name
-    if db.checkDeviceToken(username=username, devicename=devicename, devicetoken=devicetoken):
+    if await db.run(db.checkDeviceToken, username=username, devicename=devicename, devicetoken=devicetoken):
         # Get a list of devices for the given user
-        response, result = db.getDevices(username=username)
+        response, result = await db.run(db.getDevices, username=username)
         if result:
             return {"message": response, "successfull": True}
         else:
@@ -133,10 +275,10 @@ async def device_list(username: str = Form(), devicename: str = Form(), deviceto
 Function to rename a device for a given user.
 """
 @app.post("/device/rename")
-async def device_rename(username: str = Form(), devicename: str = Form(), devicetoken: str = Form(), devicenameNew: str = Form()):
+async def device_rename(username: UsernameForm, devicename: DevicenameForm, devicenameNew: DevicenameForm, devicetoken: str = Depends(formDeviceToken)):
     # Check if the given device token is valid for the given user and device name
-    if db.checkDeviceToken(username=username, devicename=devicename, devicetoken=devicetoken):
-        response, result = db.renameDevice(username=username, deviceNameOld=devicename, deviceNameNew=devicenameNew)
+    if await db.run(db.checkDeviceToken, username=username, devicename=devicename, devicetoken=devicetoken):
+        response, result = await db.run(db.renameDevice, username=username, deviceNameOld=devicename, deviceNameNew=devicenameNew)
         if result:
             return {"message": response, "successfull": True}
         else:
@@ -147,74 +289,392 @@ async def device_rename(username: str = Form(), devicename: str = Form(), device
 
 ## Sending and Receiving--------------------------------------------------------------------------------------
 
+"""
+Function to check if each device of a list of target devices exists, the list was validated as TargetDevices before. Returns the list of devicenames.
+"""
+async def checkTargetDevices(username: str, targetDevicesList: list):
+    missing, result = await db.run(db.checkDeviceNamesExist, username=username, devicenames=targetDevicesList)
+    if not result:
+        return "Error occurred, could not check devices!", False
+    if missing:
+        return 'Device "' + missing[0] + '" does not exist! Request will not be executed!', False
+    return targetDevicesList, True
+
+"""
+Function to create a file share for each stored blob. The blobs are referenced first, then moved to their final location in the storage
+outside of any transaction, as uploads to an object store may take long, and then the shares are created in one transaction.
+If uploadId is given, the blob is the partial file of that resumable upload, which is only deleted once the share is committed.
+"""
+async def shareBlobs(username: str, targetDevicesList: list, blobs: list, autoOpen: bool, encrypted: bool, uploadId: str | None = None):
+    timestamps, reserved = await db.run(db.reserveBlobs, username=username, files=blobs)
+    result = reserved
+    for blob in blobs:
+        if not result:
+            break
+        await run_in_threadpool(dh.prepareBlob, blob)
+        if not await run_in_threadpool(dh.commitBlob, blob, keepFile=uploadId is not None):
+            timestamps, result = "Error occurred, could not store " + blob["filename"], False
+    if result:
+        timestamps, result = await db.run(db.newFileShares, username=username, targetDevices=targetDevicesList, files=blobs, autoOpen=autoOpen, encrypted=encrypted, uploadId=uploadId)
+    if result:
+        for blob in blobs:
+            await run_in_threadpool(dh.discardBlob, blob)
+    else:
+        # blobs that are not referenced anymore are deleted right away instead of by the next sweep
+        if reserved and await db.run(db.releaseBlobs, username=username, files=blobs):
+            for blobHash in {blob["hash"] for blob in blobs}:
+                await run_in_threadpool(dh.removeBlob, blobHash=blobHash)
+        # the partial file of an upload is kept until its share is committed, so the finalization can be retried
+        for blob in blobs:
+            await run_in_threadpool(dh.discardBlob, blob, keepFile=uploadId is not None)
+    if result:
+        return {"message": f"Successfuly uploaded {[blob['filename'] for blob in blobs]}", "shares": timestamps}, True
+    else:
+        return timestamps, False
+
 """
 Function to upload and store shared data under consideration of the data type.
 """
 @app.post("/beamit/share")
-async def beamit_upload(username: str = Form(), devicename: str = Form(), devicetoken: str = Form(), targetDevices: str = Form(), autoOpen: bool = Form(), encrypted: bool = Form(), files: list[UploadFile] | None = None, text: str | None = Form(default=None), url: str | None = Form(default=None)):
+async def beamit_upload(username: UsernameForm, devicename: DevicenameForm, targetDevices: TargetDevicesForm, devicetoken: str = Depends(formDeviceToken), autoOpen: bool = Form(), encrypted: bool = Form(), files: list[UploadFile] | None = None, text: str | None = Form(default=None), url: str | None = Form(default=None)):
     # Check if the device token is valid for the given device name and username.
-    if db.checkDeviceToken(username=username, devicename=devicename, devicetoken=devicetoken):
-        targetDevicesregex = "^\{([a-zA-Z0-9-_, ]{4,20})*\}$"
-        if not re.match(targetDevicesregex, targetDevices):
-            return {"message": "List of devicenames is not valid. Devicenames must be a List of devices, e.g. {devicename1, devicename2}.", "successfull": False}
-        # Split targetDevices string into a list and check if each device exists
-        targetDevicesList = targetDevices.replace(" ", "").strip('}{').split(',')
-        for target in targetDevicesList:
-            if not db.checkDeviceNameExists(username=username, devicename=target):
-                return {"message": 'Device "' + target + '" does not exist! Request will not be executed!', "successfull": False}
+    if await db.run(db.checkDeviceToken, username=username, devicename=devicename, devicetoken=devicetoken):
+        targetDevicesList, result = await checkTargetDevices(username=username, targetDevicesList=targetDevices)
+        if not result:
+            return {"message": targetDevicesList, "successfull": False}
         # If only files are present in the request, store them and create a file share
         if files != None and text == None and url == None:
-            response, result = dh.storeFiles(username, files)
+            response, result = await run_in_threadpool(dh.storeFiles, username, files)
             if result:
-                for file in files:
-                    db.newFileShare(username=username, targetDevices=targetDevices, filename=file.filename, autoOpen=autoOpen, encrypted=encrypted)
-                return {"message": response, "successfull": True}
-            else:
-                return {"message": response, "successfull": False}
+                response, result = await shareBlobs(username=username, targetDevicesList=targetDevicesList, blobs=response, autoOpen=autoOpen, encrypted=encrypted)
+            return {"message": response, "successfull": result}
         # If only text is present in the request, create a text share
         elif files == None and text != None and url == None: 
-            return {"message": "", "successfull": db.newTextShare(username=username, targetDevices=targetDevices, text=text, autoOpen=autoOpen, encrypted=encrypted)}
+            return {"message": "", "successfull": await db.run(db.newTextShare, username=username, targetDevices=targetDevicesList, text=text, autoOpen=autoOpen, encrypted=encrypted)}
         # If only a URL is present in the request, create a URL share
         elif files == None and text == None and url != None: 
-            return {"message": "", "successfull": db.newUrlShare(username=username, targetDevices=targetDevices, url=url, autoOpen=autoOpen, encrypted=encrypted)}
+            return {"message": "", "successfull": await db.run(db.newUrlShare, username=username, targetDevices=targetDevicesList, url=url, autoOpen=autoOpen, encrypted=encrypted)}
         # If more than one sharedata is present in the request, return an error message
         else:
             return {"message": "More than one ShareData detected - check shared Data and send again", "successfull": False}
     else:
         return {"message": "Device-User-Combination not vaild!", "successfull": False}
 
+"""
+Function to upload a single file as the raw request body. The file is written to disk while it is received, without multipart parsing.
+The device token is passed in the Authorization header, all other parameters as query parameters.
+"""
+@app.post("/beamit/shareStream")
+async def beamit_upload_stream(request: Request, username: Username, devicename: Devicename, targetDevices: TargetDevices, filename: str, autoOpen: bool, encrypted: bool, devicetoken: str = Depends(headerDeviceToken)):
+    # Check if the device token is valid for the given device name and username.
+    if await db.run(db.checkDeviceToken, username=username, devicename=devicename, devicetoken=devicetoken):
+        targetDevicesList, result = await checkTargetDevices(username=username, targetDevicesList=targetDevices)
+        if not result:
+            return {"message": targetDevicesList, "successfull": False}
+        # Uploads announcing a size above the limit or the remaining storage quota are rejected before the body is read
+        contentLength = request.headers.get("content-length")
+        contentLength = int(contentLength) if contentLength is not None and contentLength.isdigit() else None
+        response, result = await dh.storeStream(username=username, filename=filename, stream=request.stream(), contentLength=contentLength)
+        if result:
+            response, result = await shareBlobs(username=username, targetDevicesList=targetDevicesList, blobs=[response], autoOpen=autoOpen, encrypted=encrypted)
+        return {"message": response, "successfull": result}
+    else:
+        return {"message": "Device-User-Combination not vaild!", "successfull": False}
+
+"""
+Function to start a resumable upload of a file with the given size. Returns the uploadId used to send the chunks of the file.
+"""
+@app.post("/beamit/upload/initiate")
+async def beamit_upload_initiate(username: UsernameForm, devicename: DevicenameForm, targetDevices: TargetDevicesForm, devicetoken: str = Depends(formDeviceToken), filename: str = Form(), size: int = Form(), autoOpen: bool = Form(), encrypted: bool = Form()):
+    # Check if the device token is valid for the given device name and username.
+    if await db.run(db.checkDeviceToken, username=username, devicename=devicename, devicetoken=devicetoken):
+        targetDevicesList, result = await checkTargetDevices(username=username, targetDevicesList=targetDevices)
+        if not result:
+            return {"message": targetDevicesList, "successfull": False}
+        filename = os.path.basename(filename)
+        if filename in ("", ".", ".."):
+            return {"message": "Filename is not valid", "successfull": False}
+        if size < 0 or (dh.maxUploadSize and size > dh.maxUploadSize):
+            return {"message": "File " + filename + " exceeds the upload limit of " + str(dh.maxUploadSize) + " bytes", "successfull": False}
+        # The quota is checked again when the upload is finalized, as other uploads may have used it up in the meantime
+        quota, result = await db.run(db.getRemainingQuota, username=username)
+        if not result:
+            return {"message": "Error occurred, could not check the storage quota!", "successfull": False}
+        message = dh.checkQuota(quota, size=size, files=1)
+        if message is not None:
+            return {"message": message, "successfull": False}
+        uploadId = secrets.token_urlsafe(16)
+        if not await run_in_threadpool(dh.createUpload, uploadId=uploadId, size=size):
+            return {"message": "Error occurred, could not create upload!", "successfull": False}
+        if await db.run(db.newUpload, username=username, uploadId=uploadId, filename=filename, size=size, targetDevices=targetDevicesList, autoOpen=autoOpen, encrypted=encrypted):
+            return {"message": {"uploadId": uploadId}, "successfull": True}
+        else:
+            await run_in_threadpool(dh.removeUpload, uploadId=uploadId)
+            return {"message": "Error occurred, could not create upload!", "successfull": False}
+    else:
+        return {"message": "Device-User-Combination not vaild!", "successfull": False}
+
+"""
+Function to upload a chunk of a resumable upload as the raw request body, written to the file at the given offset.
+The device token is passed in the Authorization header, all other parameters as query parameters.
+"""
+@app.put("/beamit/upload/{uploadId}")
+async def beamit_upload_chunk(request: Request, uploadId: str, username: Username, devicename: Devicename, offset: int, devicetoken: str = Depends(headerDeviceToken)):
+    # Check if the device token is valid for the given device name and username.
+    if await db.run(db.checkDeviceToken, username=username, devicename=devicename, devicetoken=devicetoken):
+        upload, result = await db.run(db.getUpload, username=username, uploadId=uploadId)
+        if not result:
+            return {"message": upload, "successfull": False}
+        if offset < 0 or offset > upload[1]:
+            return {"message": "Offset is not valid for a file of " + str(upload[1]) + " bytes", "successfull": False}
+        response, result = await dh.storeChunk(uploadId=uploadId, offset=offset, size=upload[1], stream=request.stream())
+        return {"message": response, "successfull": result}
+    else:
+        return {"message": "Device-User-Combination not vaild!", "successfull": False}
+
+"""
+Function to query the byte ranges of a resumable upload the server has received so far.
+"""
+@app.post("/beamit/upload/status")
+async def beamit_upload_status(username: UsernameForm, devicename: DevicenameForm, devicetoken: str = Depends(formDeviceToken), uploadId: str = Form()):
+    # Check if the device token is valid for the given device name and username.
+    if await db.run(db.checkDeviceToken, username=username, devicename=devicename, devicetoken=devicetoken):
+        upload, result = await db.run(db.getUpload, username=username, uploadId=uploadId)
+        if not result:
+            return {"message": upload, "successfull": False}
+        ranges, result = await db.run(db.getUploadRanges, uploadId=uploadId)
+        if result:
+            return {"message": {"size": upload[1], "received": ranges}, "successfull": True}
+        else:
+            return {"message": ranges, "successfull": False}
+    else:
+        return {"message": "Device-User-Combination not vaild!", "successfull": False}
+
+"""
+Function to complete a resumable upload after all chunks were received. The file is moved to the user's folder and shared with the target devices.
+"""
+@app.post("/beamit/upload/finalize")
+async def beamit_upload_finalize(username: UsernameForm, devicename: DevicenameForm, devicetoken: str = Depends(formDeviceToken), uploadId: str = Form()):
+    # Check if the device token is valid for the given device name and username.
+    if await db.run(db.checkDeviceToken, username=username, devicename=devicename, devicetoken=devicetoken):
+        upload, result = await db.run(db.getUpload, username=username, uploadId=uploadId)
+        if not result:
+            return {"message": upload, "successfull": False}
+        filename, size, targetDevicesList, autoOpen, encrypted = upload
+        ranges, result = await db.run(db.getUploadRanges, uploadId=uploadId)
+        if not result:
+            return {"message": ranges, "successfull": False}
+        if size > 0 and ranges != [[0, size]]:
+            return {"message": {"size": size, "received": ranges}, "successfull": False}
+        # devices removed or renamed since the upload was initiated are skipped, otherwise the upload could never be shared
+        missing, result = await db.run(db.checkDeviceNamesExist, username=username, devicenames=targetDevicesList)
+        if not result:
+            return {"message": "Error occurred, could not check devices!", "successfull": False}
+        targetDevicesList = [device for device in targetDevicesList if device not in missing]
+        if not targetDevicesList:
+            return {"message": "None of the target devices of the upload exists anymore", "successfull": False}
+        blob, result = await run_in_threadpool(dh.finalizeUpload, uploadId=uploadId, filename=filename)
+        if not result:
+            return {"message": blob, "successfull": False}
+        # the upload is removed in the transaction creating the share, so it is kept if sharing fails and shared only once
+        response, result = await shareBlobs(username=username, targetDevicesList=targetDevicesList, blobs=[blob], autoOpen=autoOpen, encrypted=encrypted, uploadId=uploadId)
+        return {"message": response, "successfull": result}
+    else:
+        return {"message": "Device-User-Combination not vaild!", "successfull": False}
+
+"""
+Function to cancel a resumable upload and delete the chunks received so far.
+"""
+@app.post("/beamit/upload/abort")
+async def beamit_upload_abort(username: UsernameForm, devicename: DevicenameForm, devicetoken: str = Depends(formDeviceToken), uploadId: str = Form()):
+    # Check if the device token is valid for the given device name and username.
+    if await db.run(db.checkDeviceToken, username=username, devicename=devicename, devicetoken=devicetoken):
+        upload, result = await db.run(db.getUpload, username=username, uploadId=uploadId)
+        if not result:
+            return {"message": upload, "successfull": False}
+        await db.run(db.removeUpload, uploadId=uploadId)
+        await run_in_threadpool(dh.removeUpload, uploadId=uploadId)
+        return {"message": "Upload aborted", "successfull": True}
+    else:
+        return {"message": "Device-User-Combination not vaild!", "successfull": False}
+
 """
 Function to check if the provided user, device name, and device token combination is valid and if available data exists for that user and device.
+The data can be fetched in pages of at most limit entries, each page starting after the timestamp since, e.g. the timestamp of the last entry of
+the previous page. "more" is true if there are further entries. With metadataOnly the data of text and url entries is omitted.
+The response has an ETag header. If it is sent back in If-None-Match and the page did not change, the response is 304 Not Modified without a body.
 """
 @app.post("/beamit/checkAvailableData")
-async def beamit_check(username: str = Form(), devicename: str = Form(), devicetoken: str = Form()):
+async def beamit_check(username: UsernameForm, devicename: DevicenameForm, devicetoken: str = Depends(formDeviceToken), since: str | None = Form(default=None), limit: int | None = Form(default=None), metadataOnly: bool = Form(default=False), if_none_match: str | None = Header(default=None)):
     # Check if the provided device user combination is valid using the checkDeviceToken function
-    if db.checkDeviceToken(username=username, devicename=devicename, devicetoken=devicetoken):
-        response, result = db.checkAvailableData(username=username, devicename=devicename)
-        if result:
-            return {"message": response, "successfull": True}
+    if await db.run(db.checkDeviceToken, username=username, devicename=devicename, devicetoken=devicetoken):
+        if limit is not None and not 0 < limit <= maxPageSize:
+            return {"message": "Limit must be between 1 and " + str(maxPageSize), "successfull": False}
+        response, result = await db.run(db.getPendingShares, username=username, devicename=devicename, since=since, limit=limit, metadataOnly=metadataOnly, etag=if_none_match)
+        if not result:
+            return {"message": response, "successfull": False}
+        if response["shares"] is None:
+            return responses.Response(status_code=304, headers={"etag": response["etag"]})
+        if response["shares"]:
+            content = {"message": response["shares"], "more": response["more"], "successfull": True}
         else:
-            return{"message": response, "successfull": False}
+            content = {"message": "No shared data for " + devicename, "more": False, "successfull": False}
+        return responses.JSONResponse(content=jsonable_encoder(content), headers={"etag": response["etag"]})
     else:
         return {"message": "Device-User-Combination not vaild!", "successfull": False}
 
 """
 Function to receive data from a device for a specific user and device combination.
+Files support Range and If-Range requests, so an interrupted download can be resumed. A file is kept on the server until it was acknowledged with
+/beamit/acknowledge by all target devices or the retention time is over.
+Files stored compressed are sent as they are with Content-Encoding gzip if the client accepts gzip, otherwise they are decompressed while
+they are sent. Files that are decompressed or read from a remote storage do not support Range requests.
+With redirect the response is a redirect to a URL of the storage the file can be downloaded from, if the storage supports it.
+Files on the local disk are sent as configured in the [DOWNLOAD] section, see download.py, a fronting proxy may send them instead.
 """
 @app.post("/beamit/receive")
-async def beamit_receive(background_tasks: BackgroundTasks, username: str = Form(), devicename: str = Form(), devicetoken: str = Form(), timestamp: str = Form(), ):
+async def beamit_receive(username: UsernameForm, devicename: DevicenameForm, devicetoken: str = Depends(formDeviceToken), timestamp: str = Form(), redirect: bool = Form(default=False), accept_encoding: str | None = Header(default=None)):
     # Check if the provided device user combination is valid using the checkDeviceToken function
-    if db.checkDeviceToken(username=username, devicename=devicename, devicetoken=devicetoken):
-        response, result = db.getShare(username=username, devicename=devicename, timestamp=timestamp)
+    if await db.run(db.checkDeviceToken, username=username, devicename=devicename, devicetoken=devicetoken):
+        response, result = await db.run(db.getShare, username=username, devicename=devicename, timestamp=timestamp)
         if result:
             if response[0][3] == "file":
-                filename = response[0][4]
-                background_tasks.add_task(func=dh.removeFile, username=username, filename=filename)
-                return responses.FileResponse(dh.getFilePath(username=username, filename=filename), media_type='application/octet-stram', filename=filename)
+                filename, blobHash = response[0][4], response[0][7]
+                file = await run_in_threadpool(dh.getFile, username=username, filename=filename, blobHash=blobHash)
+                sendCompressed = file["encoding"] == "gzip" and compression.accepts(accept_encoding, "gzip")
+                # The storage sends compressed files with Content-Encoding gzip, so only clients accepting gzip are redirected to them
+                if redirect and file["url"] is not None and (file["encoding"] is None or sendCompressed):
+                    return responses.RedirectResponse(file["url"], status_code=303)
+                headers = {}
+                # The content hash of a blob is a strong validator for If-Range, the compressed file is a different representation with its own validator
+                if blobHash is not None:
+                    headers["etag"] = '"' + blobHash + ('-gzip"' if sendCompressed else '"')
+                if file["encoding"] is not None:
+                    headers["vary"] = "Accept-Encoding"
+                if sendCompressed:
+                    headers["content-encoding"] = "gzip"
+                if file["path"] is not None and (file["encoding"] is None or sendCompressed):
+                    return delivery.response(file["path"], filename=filename, headers=headers, compressed=sendCompressed)
+                headers["content-disposition"] = "attachment; filename*=utf-8''" + quote(filename)
+                return responses.StreamingResponse(dh.readFile(file, decompress=not sendCompressed), media_type='application/octet-stream', headers=headers)
             else:
                 return {"message": response, "successfull": True}
         else:
             return {"message": response, "successfull": False}
     else:
         return {"message": "Device-User-Combination not vaild!", "successfull": False}
-        
\ No newline at end of file
+
+"""
+Function to acknowledge the complete receipt of a file. The file is deleted once all target devices acknowledged it.
+"""
+@app.post("/beamit/acknowledge")
+async def beamit_acknowledge(background_tasks: BackgroundTasks, username: UsernameForm, devicename: DevicenameForm, devicetoken: str = Depends(formDeviceToken), timestamp: str = Form()):
+    # Check if the provided device user combination is valid using the checkDeviceToken function
+    if await db.run(db.checkDeviceToken, username=username, devicename=devicename, devicetoken=devicetoken):
+        response, result = await db.run(db.acknowledgeShare, username=username, devicename=devicename, timestamp=timestamp)
+        if result:
+            if response is not None and response[3] == "file":
+                background_tasks.add_task(func=dh.removeFile, username=username, filename=response[4], blobHash=response[7])
+            return {"message": "Receipt acknowledged", "successfull": True}
+        else:
+            return {"message": response, "successfull": False}
+    else:
+        return {"message": "Device-User-Combination not vaild!", "successfull": False}
+
+"""
+Function to receive many pending entries in one request, e.g. after a device was offline. All text and url entries pending for the device,
+or only those with the given timestamps, are returned and marked as delivered at once. With archive the response is a zip archive that
+additionally contains the pending files and a shares.json listing all entries, the files have to be acknowledged afterwards as usual.
+"""
+@app.post("/beamit/receiveBatch")
+async def beamit_receive_batch(username: UsernameForm, devicename: DevicenameForm, devicetoken: str = Depends(formDeviceToken), timestamps: list[str] | None = Form(default=None), archive: bool = Form(default=False)):
+    # Check if the provided device user combination is valid using the checkDeviceToken function
+    if await db.run(db.checkDeviceToken, username=username, devicename=devicename, devicetoken=devicetoken):
+        response, result = await db.run(db.receiveShares, username=username, devicename=devicename, timestamps=timestamps, files=archive)
+        if not result:
+            return {"message": response, "successfull": False}
+        if not response["shares"] and not response["files"]:
+            return {"message": "No shared data for " + devicename, "successfull": False}
+        if archive:
+            return responses.StreamingResponse(dh.archiveShares(username=username, shares=response["shares"], files=response["files"]), media_type="application/zip", headers={"content-disposition": 'attachment; filename="beamit.zip"'})
+        return {"message": response["shares"], "successfull": True}
+    else:
+        return {"message": "Device-User-Combination not vaild!", "successfull": False}
+
+"""
+Function to wait for new data of a device (long-poll). Returns the available data as soon as there is any, at the latest after timeout seconds.
+"""
+@app.post("/beamit/waitForData")
+async def beamit_wait(username: UsernameForm, devicename: DevicenameForm, devicetoken: str = Depends(formDeviceToken), timeout: float = Form(default=30)):
+    # Check if the provided device user combination is valid using the checkDeviceToken function
+    if await db.run(db.checkDeviceToken, username=username, devicename=devicename, devicetoken=devicetoken):
+        # Subscribe before checking, so no share created in between is missed
+        queue = notifier.subscribe(username=username, devicename=devicename)
+        try:
+            response, result = await db.run(db.checkAvailableData, username=username, devicename=devicename)
+            if not result:
+                try:
+                    await asyncio.wait_for(queue.get(), timeout=min(max(timeout, 0), longPollMaxTimeout))
+                    response, result = await db.run(db.checkAvailableData, username=username, devicename=devicename)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            notifier.unsubscribe(username=username, devicename=devicename, queue=queue)
+        return {"message": response, "successfull": result}
+    else:
+        return {"message": "Device-User-Combination not vaild!", "successfull": False}
+
+"""
+WebSocket to get notified about new data. The first message has to be a JSON object with username, devicename and devicetoken,
+the devicetoken may instead be passed in the Authorization header of the handshake.
+The server answers with the available data and sends it again every time new data for the device arrives.
+"""
+@app.websocket("/beamit/subscribe")
+async def beamit_subscribe(websocket: WebSocket):
+    await websocket.accept()
+    try:
+        credentials = validation.subscription.model_validate(await websocket.receive_json())
+        username, devicename = credentials.username, credentials.devicename
+        devicetoken = bearerToken(websocket.headers.get("authorization")) or credentials.devicetoken
+        if not devicetoken:
+            raise ValueError("devicetoken is missing")
+    except (ValidationError, ValueError):
+        await websocket.send_json({"message": "Subscription must contain a valid username, devicename and devicetoken", "successfull": False})
+        await websocket.close()
+        return
+    except WebSocketDisconnect:
+        return
+    # Check if the provided device user combination is valid using the checkDeviceToken function
+    if not await db.run(db.checkDeviceToken, username=username, devicename=devicename, devicetoken=devicetoken):
+        await websocket.send_json({"message": "Device-User-Combination not vaild!", "successfull": False})
+        await websocket.close()
+        return
+    queue = notifier.subscribe(username=username, devicename=devicename)
+    receiver = asyncio.ensure_future(websocket.receive_text())
+    waiter = None
+    try:
+        response, result = await db.run(db.checkAvailableData, username=username, devicename=devicename)
+        await websocket.send_json(jsonable_encoder({"message": response, "successfull": result}))
+        while True:
+            waiter = asyncio.ensure_future(queue.get())
+            done, pending = await asyncio.wait({receiver, waiter}, return_when=asyncio.FIRST_COMPLETED)
+            # Messages from the client are ignored, a disconnect raises WebSocketDisconnect
+            if receiver in done:
+                receiver.result()
+                receiver = asyncio.ensure_future(websocket.receive_text())
+            if waiter in done:
+                # Several shares created at once are sent together
+                while not queue.empty():
+                    queue.get_nowait()
+                response, result = await db.run(db.checkAvailableData, username=username, devicename=devicename)
+                if result:
+                    await websocket.send_json(jsonable_encoder({"message": response, "successfull": True}))
+            else:
+                waiter.cancel()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        receiver.cancel()
+        if waiter is not None:
+            waiter.cancel()
+        notifier.unsubscribe(username=username, devicename=devicename, queue=queue)
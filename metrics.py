@@ -0,0 +1,83 @@
+import os
+import time
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+
+"""
+Prometheus metrics of the server. If the environment variable PROMETHEUS_MULTIPROC_DIR is set before this module is imported, every worker
+process writes its samples to that folder and render() aggregates the samples of all workers. run.py sets it up when starting several
+workers, a single worker keeps its metrics in memory.
+"""
+
+# request latency per route template, so path parameters like the uploadId do not create a new series per request
+requestDuration = Histogram("beamit_request_duration_seconds", "Duration of HTTP requests until the response was sent completely", ["method", "route", "status"], buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60))
+requestBytes = Counter("beamit_request_bytes", "Bytes received in request bodies", ["route"])
+responseBytes = Counter("beamit_response_bytes", "Bytes sent in response bodies", ["route"])
+dbQueryDuration = Histogram("beamit_db_query_duration_seconds", "Duration of database methods, including the wait for a pooled connection", ["query"], buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5))
+# statements by the database method that sent them, statements of methods called without db.run are counted as "direct"
+dbStatements = Counter("beamit_db_statements", "SQL statements sent to the database", ["query"])
+dbQueryErrors = Counter("beamit_db_query_errors", "Database methods that raised an exception", ["query"])
+tokenCacheRequests = Counter("beamit_token_cache_requests", "Device token checks by token cache result", ["result"])
+pendingShares = Gauge("beamit_pending_shares", "Shares not yet delivered to their target devices, counted on every scrape", multiprocess_mode="mostrecent")
+
+"""
+Function that returns the current metrics of all workers in the Prometheus text format and its content type.
+"""
+def render():
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+"""
+Function to remove the samples of live gauges of a worker that exits.
+"""
+def markProcessDead(pid: int):
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        multiprocess.mark_process_dead(pid)
+
+"""
+ASGI middleware that records the latency and the body sizes of all HTTP requests by route. The request is measured until the last
+chunk of the response was sent, so streamed uploads and file downloads are included completely.
+"""
+class metricsmiddleware():
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        counts = {"request": 0, "response": 0, "status": 500, "length": None}
+
+        async def countingReceive():
+            message = await receive()
+            if message["type"] == "http.request":
+                counts["request"] += len(message.get("body", b""))
+            return message
+
+        async def countingSend(message):
+            if message["type"] == "http.response.start":
+                counts["status"] = message["status"]
+                counts["length"] = dict(message.get("headers", [])).get(b"content-length")
+            elif message["type"] == "http.response.pathsend" and counts["length"] is not None:
+                # the server sends the file itself, so the size is taken from the Content-Length
+                counts["response"] += int(counts["length"])
+            elif message["type"] == "http.response.body":
+                counts["response"] += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, countingReceive, countingSend)
+        finally:
+            # the router stores the matched route in the scope, requests without a matching route share one label
+            route = scope.get("route")
+            routePath = getattr(route, "path", "unmatched")
+            requestDuration.labels(scope["method"], routePath, str(counts["status"])).observe(time.perf_counter() - start)
+            if counts["request"]:
+                requestBytes.labels(routePath).inc(counts["request"])
+            if counts["response"]:
+                responseBytes.labels(routePath).inc(counts["response"])
@@ -1,22 +1,49 @@
 from typing import Tuple
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
 import os
 import hashlib
 import hmac
 import base64
 
+# PBKDF2 iterations used for new password hashes, existing hashes keep the iterations they were created with
+iterations = 100000
+executor = None
+
+"""
+Create the bounded thread pool used by the async functions and set the iterations for new password hashes.
+max_workers limits how many passwords are hashed concurrently, further requests wait for a free worker.
+"""
+def init(max_workers: int = 2, new_iterations: int = 100000):
+    global executor, iterations
+    executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="pwcrypt")
+    iterations = new_iterations
+
 """
 Generate randomly a salt and hash the provided password. Return the salt and hash to store in the database.
 """
-def hash_new_password(password: str) -> Tuple[str, str]:
+def hash_new_password(password: str, iterations: int = 100000) -> Tuple[str, str]:
     salt = os.urandom(16)
-    pw_hash = hashlib.pbkdf2_hmac('sha256', password.encode(), salt, 100000)
+    pw_hash = hashlib.pbkdf2_hmac('sha256', password.encode(), salt, iterations)
     return base64.b64encode(salt).decode('utf-8'), base64.b64encode(pw_hash).decode('utf-8')
 
 """
 Given a previously-stored salt and hash, and a password provided by a user trying to log in, check whether the password is correct.
 """
-def is_correct_password(salt: str, pw_hash: str, password: str) -> bool:
-    return hmac.compare_digest(base64.b64decode(pw_hash), hashlib.pbkdf2_hmac('sha256', password.encode(), base64.b64decode(salt), 100000))
+def is_correct_password(salt: str, pw_hash: str, password: str, iterations: int = 100000) -> bool:
+    return hmac.compare_digest(base64.b64decode(pw_hash), hashlib.pbkdf2_hmac('sha256', password.encode(), base64.b64decode(salt), iterations))
+
+"""
+Hash a new password with the configured iterations in the thread pool, so the event loop is not blocked.
+"""
+async def hash_new_password_async(password: str) -> Tuple[str, str]:
+    return await asyncio.get_running_loop().run_in_executor(executor, hash_new_password, password, iterations)
+
+"""
+Check a password in the thread pool, so the event loop is not blocked.
+"""
+async def is_correct_password_async(salt: str, pw_hash: str, password: str, iterations: int = 100000) -> bool:
+    return await asyncio.get_running_loop().run_in_executor(executor, is_correct_password, salt, pw_hash, password, iterations)
 
 """
 Prompt the user to input a password, generates a salt and hashed password using the 'hash_new_password' function. 
@@ -30,4 +57,4 @@ if __name__ == '__main__':
     print("Password hash: " + pw_hash)
 
     pw2 = input("Insert Password to check with generated salt and hash: ")
-    print(is_correct_password(salt, pw_hash, pw2))
\ No newline at end of file
+    print(is_correct_password(salt, pw_hash, pw2))
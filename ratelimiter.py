@@ -0,0 +1,70 @@
+import threading
+import time
+from collections import deque
+
+"""
+Sliding window rate limiter. A key is blocked once maxAttempts attempts were recorded for it within the last window seconds.
+The limits are local to one worker process.
+"""
+class ratelimiter():
+    maxAttempts = 0
+    window = 0
+    # keys without attempts in the current window are dropped when more than maxKeys keys are tracked
+    maxKeys = 100000
+    attempts = None
+    lock = None
+    def __init__(self, maxAttempts: int = 10, window: float = 60) -> None:
+        self.maxAttempts = maxAttempts
+        self.window = window
+        self.attempts = {}
+        self.lock = threading.Lock()
+
+    """
+    Checks if another attempt is allowed for the key, without recording it.
+    """
+    def allow(self, key) -> bool:
+        if self.maxAttempts <= 0:
+            return True
+        with self.lock:
+            attempts = self.attempts.get(key)
+            if attempts is None:
+                return True
+            self.__expire(attempts, time.monotonic())
+            return len(attempts) < self.maxAttempts
+
+    """
+    Records an attempt for the key.
+    """
+    def hit(self, key):
+        if self.maxAttempts <= 0:
+            return
+        now = time.monotonic()
+        with self.lock:
+            if key not in self.attempts and len(self.attempts) >= self.maxKeys:
+                self.__prune(now)
+            attempts = self.attempts.setdefault(key, deque())
+            self.__expire(attempts, now)
+            attempts.append(now)
+
+    """
+    Removes all recorded attempts of the key, e.g. after a successful login.
+    """
+    def reset(self, key):
+        with self.lock:
+            self.attempts.pop(key, None)
+
+    """
+    Method to drop the attempts of a key that are older than window seconds.
+    """
+    def __expire(self, attempts: deque, now: float):
+        while attempts and attempts[0] <= now - self.window:
+            attempts.popleft()
+
+    """
+    Method to drop all keys without attempts in the current window.
+    """
+    def __prune(self, now: float):
+        for key in list(self.attempts):
+            self.__expire(self.attempts[key], now)
+            if not self.attempts[key]:
+                del self.attempts[key]
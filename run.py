@@ -4,6 +4,7 @@ from fastapi import FastAPI
 import uvicorn
 import argparse
 import os
+import glob
 
 from databaseconnector import dbconnectors_postgresql
 from datahandler import datahandler
@@ -11,7 +12,32 @@ from datahandler import datahandler
 app = FastAPI()
 
 """
-Method to check for TLS-certificates and databaseconnection and start main:app. 
+Function that returns the number of CPUs the process may run on, which is the default number of workers.
+"""
+def cpuCount():
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+"""
+Function that prepares the folder the workers write their metrics to, if several workers are started. The sample files of old processes
+in it are deleted, other files are kept, as the folder may be set by the operator. A single worker serves main:app in this process, which imported the metrics before, so they stay in memory.
+Returns the folder or None.
+"""
+def prepareMetrics(workers: int):
+    if workers <= 1:
+        return None
+    metricsdir = os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", os.path.abspath("./prometheus"))
+    os.makedirs(metricsdir, exist_ok=True)
+    for samples in glob.glob(os.path.join(metricsdir, "*.db")):
+        os.remove(samples)
+    return metricsdir
+
+"""
+Method to check for TLS-certificates and databaseconnection and start main:app.
+The server is configured in the [SERVER] section of db.conf, the command line arguments override it. Every worker is a separate process
+that opens its own database pool on startup. On SIGTERM or SIGINT the workers stop accepting connections and wait up to gracefultimeout
+seconds for running requests like uploads to finish before they shut down.
 """
 if __name__ == '__main__':
     logger = logging.getLogger("initlog")
@@ -20,6 +46,10 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('-cert')
     parser.add_argument('-key')
+    parser.add_argument('-host')
+    parser.add_argument('-port', type=int)
+    parser.add_argument('-workers', type=int)
+    parser.add_argument('-reload', action='store_true', help="Restart the server on code changes, for development only")
     args = parser.parse_args()
 
     db = dbconnectors_postgresql(logger=logger)
@@ -31,9 +61,25 @@ if __name__ == '__main__':
             args.key = "beamit-tls.key"
 
     dbconfig = dh.getDatabaseConfig('db.conf')
-    if not db.initdb(host="localhost", port=5432, dbname=dbconfig['DBCONFIG']['name'], user=dbconfig['DBCONFIG']['user'], password=dbconfig['DBCONFIG']['password']):
+    # The tables are created once before the workers start, the connection is closed again so no worker inherits it
+    if not db.initdb(host=dbconfig['DBCONFIG'].get('host', fallback="localhost"), port=dbconfig['DBCONFIG'].getint('port', fallback=5432), dbname=dbconfig['DBCONFIG']['name'], user=dbconfig['DBCONFIG']['user'], password=dbconfig['DBCONFIG']['password'], minconn=1, maxconn=1):
         print("Database error, exiting...")
         sys.exit(1)
     db.closedb()
-    
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True, workers=2, ssl_certfile=args.cert, ssl_keyfile=args.key)
\ No newline at end of file
+    # the workers inherit the environment and skip creating the tables again
+    os.environ["BEAMIT_SCHEMA_READY"] = "1"
+
+    host = args.host or dbconfig.get('SERVER', 'host', fallback="0.0.0.0")
+    port = args.port or dbconfig.getint('SERVER', 'port', fallback=8000)
+    # 0 workers means one per CPU, the reloader only supports a single process
+    workers = args.workers if args.workers is not None else dbconfig.getint('SERVER', 'workers', fallback=0)
+    workers = 1 if args.reload else workers or cpuCount()
+    prepareMetrics(workers)
+    # 0 means no limit, above the limit new requests are answered with 503
+    limitConcurrency = dbconfig.getint('SERVER', 'limitconcurrency', fallback=0) or None
+
+    uvicorn.run("main:app", host=host, port=port, reload=args.reload, workers=workers, ssl_certfile=args.cert, ssl_keyfile=args.key,
+                backlog=dbconfig.getint('SERVER', 'backlog', fallback=2048),
+                timeout_keep_alive=dbconfig.getint('SERVER', 'keepalive', fallback=5),
+                limit_concurrency=limitConcurrency,
+                timeout_graceful_shutdown=dbconfig.getint('SERVER', 'gracefultimeout', fallback=30))
@@ -0,0 +1,115 @@
+from logging import Logger
+from databaseconnector import dbconnectors_postgresql
+import asyncio
+import json
+import psycopg2
+
+"""
+Listens for notifications about new shares on a dedicated database connection and wakes up the devices subscribed in this process.
+Every server process runs its own listener, so a share created by one worker reaches subscribers of all workers.
+Notifications about changed device tokens drop the tokens from the token cache of this process.
+"""
+class sharenotifier():
+    logger = None
+    db = None
+    connection = None
+    connectionFd = None
+    reconnectHandle = None
+    subscribers: dict = {}
+    # seconds to wait before reconnecting after the listening connection was lost
+    reconnectDelay = 5
+    def __init__(self, logger: Logger, dbconnector: dbconnectors_postgresql) -> None:
+        self.logger = logger
+        self.db = dbconnector
+        self.subscribers = {}
+
+    """
+    Opens the listening connection and registers it with the event loop.
+    """
+    async def start(self):
+        try:
+            self.connection = await asyncio.get_running_loop().run_in_executor(None, self.db.newConnection)
+            with self.connection.cursor() as cursor:
+                cursor.execute('LISTEN "' + self.db.shareChannel + '";')
+                cursor.execute('LISTEN "' + self.db.tokenChannel + '";')
+            self.connectionFd = self.connection.fileno()
+            asyncio.get_running_loop().add_reader(self.connectionFd, self.__onNotify)
+            # tokens may have changed while no connection was listening
+            self.db.tokenCache.clear()
+            self.logger.debug("Listening for new shares")
+            return True
+        except psycopg2.Error as e:
+            self.logger.error("Could not listen for new shares: " + str(e))
+            self.connection = None
+            self.__scheduleReconnect()
+            return False
+
+    """
+    Closes the listening connection.
+    """
+    async def stop(self):
+        if self.reconnectHandle is not None:
+            self.reconnectHandle.cancel()
+            self.reconnectHandle = None
+        if self.connection is not None:
+            asyncio.get_running_loop().remove_reader(self.connectionFd)
+            self.connection.close()
+            self.connection = None
+
+    """
+    Registers a queue that receives the timestamps of new shares for the device.
+    """
+    def subscribe(self, username: str, devicename: str) -> asyncio.Queue:
+        queue = asyncio.Queue()
+        self.subscribers.setdefault((username, devicename), set()).add(queue)
+        return queue
+
+    """
+    Removes a queue registered by subscribe.
+    """
+    def unsubscribe(self, username: str, devicename: str, queue: asyncio.Queue):
+        queues = self.subscribers.get((username, devicename))
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self.subscribers[(username, devicename)]
+
+    """
+    Method called by the event loop when the listening connection is readable. Dispatches all pending notifications.
+    """
+    def __onNotify(self):
+        try:
+            self.connection.poll()
+        except psycopg2.Error as e:
+            self.logger.error("Lost listening connection: " + str(e))
+            asyncio.get_running_loop().remove_reader(self.connectionFd)
+            self.connection.close()
+            self.connection = None
+            # notifications may have been missed, so let every subscriber check for data
+            for queues in self.subscribers.values():
+                for queue in queues:
+                    queue.put_nowait(None)
+            self.db.tokenCache.clear()
+            self.__scheduleReconnect()
+            return
+        while self.connection.notifies:
+            notify = self.connection.notifies.pop(0)
+            try:
+                payload = json.loads(notify.payload)
+            except ValueError:
+                self.logger.error("Invalid notification: " + notify.payload)
+                continue
+            if notify.channel == self.db.tokenChannel:
+                self.db.tokenCache.invalidate(username=payload["Username"], devicename=payload["DeviceName"])
+                continue
+            for queue in self.subscribers.get((payload["Username"], payload["DeviceName"]), ()):
+                queue.put_nowait(payload["Timestamp"])
+
+    """
+    Method to open the listening connection again after reconnectDelay seconds.
+    """
+    def __scheduleReconnect(self):
+        def reconnect():
+            self.reconnectHandle = None
+            asyncio.ensure_future(self.start())
+        self.reconnectHandle = asyncio.get_running_loop().call_later(self.reconnectDelay, reconnect)
@@ -0,0 +1,134 @@
+from logging import Logger
+from databaseconnector import dbconnectors_postgresql
+from datahandler import datahandler
+import asyncio
+import random
+import time
+
+from fastapi.concurrency import run_in_threadpool
+
+"""
+Background task that deletes shares which are expired, above the share limit of their user or without target devices, together with their files.
+Rows are deleted in batches of batchSize, so a sweep never holds many locks at once. Every reconcileInterval seconds the stored files are
+additionally compared with the database to delete files that no share references anymore. Every worker process runs a sweeper, an advisory
+lock in the database makes sure only one of them sweeps at a time.
+"""
+class sharesweeper():
+    logger = None
+    db = None
+    dh = None
+    task = None
+    # seconds between two sweeps and between two comparisons of the stored files with the database
+    interval = 60
+    reconcileInterval = 60 * 60
+    batchSize = 1000
+    # seconds a received file is kept for resumed downloads if the device does not acknowledge it
+    receivedRetention = 24 * 60 * 60
+    # defaults for users without an entry in the "UserLimits" table, 0 keeps shares forever or allows any number of shares
+    shareTTL = 0
+    maxShares = 0
+    # seconds after which unfinished resumable uploads are deleted
+    uploadTTL = 24 * 60 * 60
+    lastReconcile = 0
+    # key of the advisory lock held while sweeping
+    lockKey = 0x6265616d6974
+    def __init__(self, logger: Logger, dbconnector: dbconnectors_postgresql, datahandler: datahandler) -> None:
+        self.logger = logger
+        self.db = dbconnector
+        self.dh = datahandler
+
+    """
+    Starts the sweeper in the background.
+    """
+    async def start(self):
+        # the first comparison is delayed by a random part of the interval, so restarted workers don't all compare the files at once
+        self.lastReconcile = time.monotonic() - random.uniform(0, self.reconcileInterval / 2)
+        self.task = asyncio.create_task(self.__run())
+
+    """
+    Stops the sweeper.
+    """
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    """
+    Deletes everything that is due once and returns what was reclaimed: the number of deleted shares, uploads, blobs and other files
+    and the bytes freed on disk. Returns None without deleting anything if another process is sweeping.
+    """
+    async def sweep(self, reconcile: bool = False):
+        report = {"shares": 0, "uploads": 0, "blobs": 0, "files": 0, "bytes": 0}
+        lock = await self.db.run(self.db.tryAdvisoryLock, key=self.lockKey)
+        if lock is None:
+            return None
+        try:
+            await self.__sweep(report, reconcile)
+        finally:
+            lock.close()
+        return report
+
+    """
+    Deletes everything that is due once and adds what was reclaimed to report, called while the lock is held.
+    """
+    async def __sweep(self, report: dict, reconcile: bool):
+        blobHashes = set()
+        for method, kwargs in [(self.db.expireReceivedShares, {"retention": self.receivedRetention, "limit": self.batchSize}), (self.db.expireShares, {"defaultTTL": self.shareTTL, "limit": self.batchSize}), (self.db.evictShares, {"defaultMaxShares": self.maxShares, "limit": self.batchSize}), (self.db.removeOrphanedShares, {"limit": self.batchSize})]:
+            while True:
+                shareData, result = await self.db.run(method, **kwargs)
+                if not result:
+                    break
+                report["shares"] += len(shareData)
+                for share in shareData:
+                    if share[3] != "file":
+                        continue
+                    if share[7] is not None:
+                        blobHashes.add(share[7])
+                    elif await run_in_threadpool(self.dh.removeFile, username=share[1], filename=share[4]) == True:
+                        report["files"] += 1
+                if "limit" not in kwargs or len(shareData) < self.batchSize:
+                    break
+        # blobs of missed deletions are not referenced anymore either
+        unreferenced, result = await self.db.run(self.db.getUnreferencedBlobs, limit=self.batchSize)
+        if result:
+            blobHashes.update(unreferenced)
+        for blobHash in blobHashes:
+            size, result = await run_in_threadpool(self.dh.removeBlob, blobHash=blobHash)
+            if result and size:
+                report["blobs"] += 1
+                report["bytes"] += size
+        while True:
+            uploads, result = await self.db.run(self.db.expireUploads, ttl=self.uploadTTL, limit=self.batchSize)
+            if not result:
+                break
+            for uploadId in uploads:
+                await run_in_threadpool(self.dh.removeUpload, uploadId=uploadId)
+            report["uploads"] += len(uploads)
+            if len(uploads) < self.batchSize:
+                break
+        if reconcile:
+            for method, kwargs in [(self.dh.removeOrphanedBlobs, {"batchSize": self.batchSize}), (self.dh.removeStaleUploads, {"age": self.uploadTTL}), (self.dh.removeOrphanedFiles, {})]:
+                count, size = await run_in_threadpool(method, **kwargs)
+                report["files"] += count
+                report["bytes"] += size
+
+    """
+    Method that sweeps every interval seconds until the sweeper is stopped.
+    """
+    async def __run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            reconcile = time.monotonic() - self.lastReconcile >= self.reconcileInterval
+            try:
+                report = await self.sweep(reconcile=reconcile)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.logger.error("Sweep failed: " + str(e))
+                continue
+            if report is None:
+                continue
+            if reconcile:
+                self.lastReconcile = time.monotonic()
+            if any(report.values()):
+                self.logger.info("Sweeper reclaimed " + str(report["shares"]) + " shares, " + str(report["uploads"]) + " uploads, " + str(report["blobs"]) + " blobs and " + str(report["files"]) + " other files, " + str(report["bytes"]) + " bytes")
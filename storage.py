@@ -0,0 +1,115 @@
+import os
+import shutil
+from urllib.parse import quote
+
+"""
+Storage backends for the blobs of shared files. Blobs are addressed by keys like "ab/abcdef...", a backend stores them in a folder on the
+local disk or in an S3 compatible object store. Every backend offers the same methods:
+
+put(key, source, contentEncoding,   moves the local file source into the storage, with keep the source stays where it is
+    keep)
+open(key)                           returns a file object for reading the stored bytes in chunks
+exists(key), remove(key)            check for and delete a stored file, removing a missing file is no error
+list()                              yields the key and size of every stored file
+path(key)                           returns the local path of a stored file, None if the backend is not on the local disk
+url(key, filename)                  returns a URL to download the file directly from the backend, None if the backend can not serve downloads
+"""
+
+"""
+Backend that stores the files in a folder on the local disk. All workers of a server have to share this folder.
+"""
+class localstorage():
+    folder = ""
+    def __init__(self, folder: str) -> None:
+        self.folder = folder
+
+    def put(self, key: str, source: str, contentEncoding: str | None = None, keep: bool = False):
+        path = self.folder + key
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if not keep:
+            os.replace(source, path)
+            return
+        # copied next to the source first, so the stored file appears complete. A hard link would change with the source.
+        shutil.copyfile(source, source + ".copy")
+        os.replace(source + ".copy", path)
+
+    def open(self, key: str):
+        return open(self.folder + key, "rb")
+
+    def exists(self, key: str):
+        return os.path.exists(self.folder + key)
+
+    def remove(self, key: str):
+        try:
+            os.remove(self.folder + key)
+        except FileNotFoundError:
+            pass
+
+    def list(self):
+        if not os.path.isdir(self.folder):
+            return
+        for root, _, files in os.walk(self.folder):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    yield os.path.relpath(path, self.folder).replace(os.sep, "/"), os.path.getsize(path)
+                except FileNotFoundError:
+                    pass
+
+    def path(self, key: str):
+        return self.folder + key
+
+    def url(self, key: str, filename: str):
+        return None
+
+"""
+Backend that stores the files in a bucket of an S3 compatible object store, e.g. AWS S3 or MinIO, so several servers can share them.
+Files are uploaded in parts and read as streams, downloads can be served by the object store with presigned URLs valid for urlExpiry seconds.
+Requires the boto3 package.
+"""
+class s3storage():
+    client = None
+    bucket = ""
+    prefix = ""
+    urlExpiry = 300
+    def __init__(self, bucket: str, prefix: str = "", endpoint: str | None = None, region: str | None = None, accessKey: str | None = None, secretKey: str | None = None, urlExpiry: int = 300) -> None:
+        import boto3
+        from botocore.config import Config
+        self.client = boto3.client("s3", endpoint_url=endpoint or None, region_name=region or None, aws_access_key_id=accessKey or None, aws_secret_access_key=secretKey or None, config=Config(signature_version="s3v4"))
+        self.bucket = bucket
+        self.prefix = prefix
+        self.urlExpiry = urlExpiry
+
+    def put(self, key: str, source: str, contentEncoding: str | None = None, keep: bool = False):
+        extraArgs = {"ContentEncoding": contentEncoding} if contentEncoding is not None else None
+        self.client.upload_file(source, self.bucket, self.prefix + key, ExtraArgs=extraArgs)
+        if not keep:
+            os.remove(source)
+
+    def open(self, key: str):
+        return self.client.get_object(Bucket=self.bucket, Key=self.prefix + key)["Body"]
+
+    def exists(self, key: str):
+        from botocore.exceptions import ClientError
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.prefix + key)
+            return True
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+
+    def remove(self, key: str):
+        self.client.delete_object(Bucket=self.bucket, Key=self.prefix + key)
+
+    def list(self):
+        for page in self.client.get_paginator("list_objects_v2").paginate(Bucket=self.bucket, Prefix=self.prefix):
+            for entry in page.get("Contents", []):
+                yield entry["Key"][len(self.prefix):], entry["Size"]
+
+    def path(self, key: str):
+        return None
+
+    def url(self, key: str, filename: str):
+        disposition = "attachment; filename*=utf-8''" + quote(filename)
+        return self.client.generate_presigned_url("get_object", Params={"Bucket": self.bucket, "Key": self.prefix + key, "ResponseContentDisposition": disposition}, ExpiresIn=self.urlExpiry)
@@ -0,0 +1,58 @@
+import asyncio
+import gzip
+import os
+import unittest
+
+import compression
+
+class TestCompression(unittest.TestCase):
+    def testNegotiate(self):
+        self.assertEqual(compression.negotiate("gzip, deflate"), "gzip", "gzip not chosen")
+        self.assertIsNone(compression.negotiate("gzip;q=0, deflate"), "Refused encoding chosen")
+        self.assertIsNone(compression.negotiate(None), "Encoding chosen without Accept-Encoding")
+        self.assertEqual(compression.negotiate("*"), compression.supportedEncodings()[0], "Wildcard not accepted")
+
+    def testDecompressInBoundedChunks(self):
+        data = b"\0" * (8 * 1024 * 1024)
+        decompressor = compression.streamdecompressor("gzip", maxLength=1024 * 1024)
+        chunks = list(decompressor.decompress(gzip.compress(data)))
+        self.assertTrue(decompressor.finished(), "Stream not finished")
+        self.assertEqual(b"".join(chunks), data, "Decompressed data differs")
+        self.assertLessEqual(max(len(chunk) for chunk in chunks), 1024 * 1024, "Chunk larger than maxLength")
+
+    def testRoundTrip(self):
+        data = b"line of a log file\n" * 1000
+        for encoding in compression.supportedEncodings():
+            compressor = compression.streamcompressor(encoding)
+            compressed = compressor.compress(data) + compressor.flush()
+            decompressor = compression.streamdecompressor(encoding)
+            self.assertEqual(b"".join(decompressor.decompress(compressed)), data, encoding + " round trip failed")
+
+    def testIsCompressible(self):
+        text = b"line of a log file\n" * 1000
+        self.assertTrue(compression.isCompressible("server.log", text), "Text not compressible")
+        self.assertFalse(compression.isCompressible("photo.JPG", text), "Compressed file type compressed")
+        self.assertFalse(compression.isCompressible("random.bin", os.urandom(64 * 1024)), "Random data compressed")
+
+    def testMiddlewareKeepsScope(self):
+        body = gzip.compress(b"x" * 4096)
+        received = []
+        async def app(scope, receive, send):
+            # like the router, which stores the matched route in the scope
+            scope["route"] = "/upload"
+            received.append(dict(scope["headers"]))
+            while (await receive()).get("more_body"):
+                pass
+            await send({"type": "http.response.start", "status": 200, "headers": []})
+            await send({"type": "http.response.body", "body": b""})
+        async def receive():
+            return {"type": "http.request", "body": body, "more_body": False}
+        async def send(message):
+            pass
+        scope = {"type": "http", "method": "POST", "path": "/upload", "headers": [(b"content-encoding", b"gzip"), (b"content-length", str(len(body)).encode())]}
+        asyncio.run(compression.compressionmiddleware(app)(scope, receive, send))
+        self.assertEqual(scope.get("route"), "/upload", "Route not stored in the scope of the outer middleware")
+        self.assertNotIn(b"content-encoding", received[0], "Content-Encoding passed on with the decompressed body")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,20 @@
+import datetime
+import unittest
+
+from databaseconnector import pageTag
+
+class TestDatabaseConnector(unittest.TestCase):
+    def testPageTag(self):
+        start = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+        timestamps = [start + datetime.timedelta(seconds=second) for second in range(2)]
+        tag = pageTag(timestamps, False, False, 2)
+        self.assertEqual(tag, pageTag(list(timestamps), False, False, 2), "Same page has another ETag")
+        # a full page without further entries gets further entries later, the entries of the page stay the same
+        self.assertNotEqual(tag, pageTag(timestamps, False, True, 2), "Page with further entries has the same ETag")
+        self.assertNotEqual(tag, pageTag(timestamps, False, False, 3), "Page with another limit has the same ETag")
+        self.assertNotEqual(tag, pageTag(timestamps, False, False, None), "Unlimited page has the same ETag")
+        self.assertNotEqual(tag, pageTag(timestamps, True, False, 2), "Page without data has the same ETag")
+        self.assertNotEqual(tag, pageTag(timestamps[:1], False, False, 2), "Other page has the same ETag")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,38 @@
+import json
+import logging
+import os
+import tempfile
+import unittest
+
+from logutil import jsonformatter, rotatingfilehandler, samplingfilter
+
+class TestLogutil(unittest.TestCase):
+    def testSamplingDropsAndReports(self):
+        sampler = samplingfilter(interval=60, burst=2)
+        record = logging.LogRecord("log", logging.DEBUG, "file.py", 1, "message", None, None)
+        self.assertEqual([sampler.filter(record) for i in range(5)], [True, True, False, False, False], "Records above the burst not dropped")
+        warning = logging.LogRecord("log", logging.WARNING, "file.py", 1, "message", None, None)
+        self.assertTrue(sampler.filter(warning), "Warning dropped")
+        sampler.interval = 0
+        self.assertTrue(sampler.filter(record), "Record of a new window dropped")
+        self.assertEqual(record.dropped, 3, "Dropped records not reported")
+
+    def testJsonFormatter(self):
+        record = logging.LogRecord("log", logging.INFO, "file.py", 1, "user %s", ("alice",), None)
+        entry = json.loads(jsonformatter().format(record))
+        self.assertEqual(entry["message"], "user alice", "Message not formatted")
+        self.assertEqual(entry["level"], "INFO", "Wrong level")
+
+    def testRotationBySize(self):
+        with tempfile.TemporaryDirectory() as folder:
+            handler = rotatingfilehandler(folder=folder, maxBytes=100)
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            for i in range(10):
+                handler.emit(logging.LogRecord("log", logging.INFO, "file.py", 1, "x" * 30, None, None))
+            handler.close()
+            files = sorted(os.listdir(folder))
+            self.assertEqual(len(files), 3, "Files not rotated by size: " + str(files))
+            self.assertTrue(all(os.path.getsize(os.path.join(folder, file)) <= 124 for file in files), "File exceeds the size limit")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import asyncio
+import os
+import tempfile
+import unittest
+
+import metrics
+import run
+
+class TestMetrics(unittest.TestCase):
+    def request(self, app, path: str):
+        scope = {"type": "http", "method": "GET", "path": path, "headers": []}
+        messages = []
+        async def receive():
+            return {"type": "http.request", "body": b"", "more_body": False}
+        async def send(message):
+            messages.append(message)
+        asyncio.run(metrics.metricsmiddleware(app)(scope, receive, send))
+        return messages
+
+    def testSingleWorkerInProcess(self):
+        # uvicorn serves a single worker in the process of run.py, which imported the metrics before the folder could be set up
+        os.environ.pop("PROMETHEUS_MULTIPROC_DIR", None)
+        self.assertIsNone(run.prepareMetrics(1), "Metrics folder prepared for a single worker")
+        self.assertNotIn("PROMETHEUS_MULTIPROC_DIR", os.environ, "Multiprocess mode enabled for a single worker")
+        async def app(scope, receive, send):
+            scope["route"] = type("route", (), {"path": "/metrics-test"})()
+            await send({"type": "http.response.start", "status": 200, "headers": [(b"content-length", b"2")]})
+            await send({"type": "http.response.body", "body": b"ok"})
+        self.request(app, "/metrics-test")
+        output, _ = metrics.render()
+        self.assertIn(b'beamit_request_duration_seconds_count{method="GET",route="/metrics-test",status="200"} 1.0', output, "Request not counted")
+        self.assertIn(b'beamit_response_bytes_total{route="/metrics-test"} 2.0', output, "Response bytes not counted")
+
+    def testSeveralWorkers(self):
+        with tempfile.TemporaryDirectory() as folder:
+            os.environ["PROMETHEUS_MULTIPROC_DIR"] = os.path.join(folder, "prometheus")
+            try:
+                os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"])
+                open(os.path.join(os.environ["PROMETHEUS_MULTIPROC_DIR"], "counter_1.db"), "w").close()
+                open(os.path.join(os.environ["PROMETHEUS_MULTIPROC_DIR"], "notes.txt"), "w").close()
+                self.assertEqual(run.prepareMetrics(4), os.environ["PROMETHEUS_MULTIPROC_DIR"], "Configured folder not used")
+                self.assertEqual(os.listdir(os.environ["PROMETHEUS_MULTIPROC_DIR"]), ["notes.txt"], "Samples deleted or other files touched")
+                # a folder that does not exist yet is created
+                os.environ["PROMETHEUS_MULTIPROC_DIR"] = os.path.join(folder, "new")
+                self.assertTrue(os.path.isdir(run.prepareMetrics(2)), "Metrics folder not created")
+            finally:
+                del os.environ["PROMETHEUS_MULTIPROC_DIR"]
+
+if __name__ == '__main__':
+    unittest.main()
@@ -10,5 +10,13 @@ class TestConfig(unittest.TestCase):
 
         self.assertTrue(pwcrypt.is_correct_password(salt=salt, pw_hash=hash, password=password), "Serverurl not stored propery")
 
+    def testIterations(self):
+        password = "Testpassword"
+
+        salt, hash = pwcrypt.hash_new_password(password=password, iterations=1000)
+
+        self.assertTrue(pwcrypt.is_correct_password(salt=salt, pw_hash=hash, password=password, iterations=1000), "Password with custom iterations not accepted")
+        self.assertFalse(pwcrypt.is_correct_password(salt=salt, pw_hash=hash, password=password), "Password accepted with wrong iterations")
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,22 @@
+import unittest
+
+from ratelimiter import ratelimiter
+
+class TestRateLimiter(unittest.TestCase):
+    def testLimitAndReset(self):
+        limiter = ratelimiter(maxAttempts=3, window=60)
+        for attempt in range(3):
+            self.assertTrue(limiter.allow("key"), "Attempt " + str(attempt) + " blocked")
+            limiter.hit("key")
+        self.assertFalse(limiter.allow("key"), "Attempt above the limit allowed")
+        self.assertTrue(limiter.allow("otherkey"), "Other key blocked")
+        limiter.reset("key")
+        self.assertTrue(limiter.allow("key"), "Key blocked after reset")
+
+    def testWindowExpires(self):
+        limiter = ratelimiter(maxAttempts=1, window=0)
+        limiter.hit("key")
+        self.assertTrue(limiter.allow("key"), "Attempt outside of the window counted")
+
+if __name__ == '__main__':
+    unittest.main()
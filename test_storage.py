@@ -0,0 +1,96 @@
+import os
+import tempfile
+import unittest
+
+from storage import localstorage, s3storage
+
+try:
+    from moto import mock_aws
+except ImportError:
+    mock_aws = None
+
+class TestLocalStorage(unittest.TestCase):
+    def testPutListRemove(self):
+        with tempfile.TemporaryDirectory() as folder:
+            backend = localstorage(folder + "/blobs/")
+            source = os.path.join(folder, "upload.part")
+            with open(source, "wb") as f:
+                f.write(b"content")
+            backend.put("ab/abcdef", source)
+            self.assertFalse(os.path.exists(source), "Source file not moved")
+            self.assertTrue(backend.exists("ab/abcdef"), "Stored file missing")
+            with backend.open("ab/abcdef") as f:
+                self.assertEqual(f.read(), b"content", "Stored content differs")
+            self.assertEqual(list(backend.list()), [("ab/abcdef", 7)], "Listed files differ")
+            self.assertIsNone(backend.url("ab/abcdef", "file.txt"), "Local storage returned a download URL")
+            backend.remove("ab/abcdef")
+            backend.remove("ab/abcdef")
+            self.assertFalse(backend.exists("ab/abcdef"), "File not removed")
+
+    def testPutKeep(self):
+        with tempfile.TemporaryDirectory() as folder:
+            backend = localstorage(folder + "/blobs/")
+            source = os.path.join(folder, "upload.part")
+            with open(source, "wb") as f:
+                f.write(b"content")
+            backend.put("ab/abcdef", source, keep=True)
+            # the partial file of an upload may still be written to, which must not change the stored file
+            with open(source, "r+b") as f:
+                f.write(b"changed")
+            with backend.open("ab/abcdef") as f:
+                self.assertEqual(f.read(), b"content", "Stored file changed with the source")
+            self.assertEqual(sorted(os.listdir(folder)), ["blobs", "upload.part"], "Temporary copy left")
+
+@unittest.skipUnless(mock_aws, "moto is not installed")
+class TestS3Storage(unittest.TestCase):
+    def setUp(self):
+        self.mock = mock_aws()
+        self.mock.start()
+        self.backend = s3storage("beamit", prefix="blobs/", region="us-east-1", accessKey="testing", secretKey="testing")
+        self.backend.client.create_bucket(Bucket="beamit")
+        # objects outside of the prefix belong to someone else
+        self.backend.client.put_object(Bucket="beamit", Key="other/file", Body=b"other")
+        self.folder = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.folder.cleanup()
+        self.mock.stop()
+
+    def writeSource(self, content: bytes):
+        source = os.path.join(self.folder.name, "upload.part")
+        with open(source, "wb") as f:
+            f.write(content)
+        return source
+
+    def testPutListRemove(self):
+        source = self.writeSource(b"content")
+        self.backend.put("ab/abcdef", source)
+        self.assertFalse(os.path.exists(source), "Source file not removed")
+        self.assertTrue(self.backend.exists("ab/abcdef"), "Stored object missing")
+        self.assertFalse(self.backend.exists("ab/missing"), "Missing object exists")
+        self.assertEqual(self.backend.open("ab/abcdef").read(), b"content", "Stored content differs")
+        self.assertEqual(list(self.backend.list()), [("ab/abcdef", 7)], "Listed objects differ")
+        self.assertIsNone(self.backend.path("ab/abcdef"), "S3 storage returned a local path")
+        self.backend.remove("ab/abcdef")
+        self.backend.remove("ab/abcdef")
+        self.assertFalse(self.backend.exists("ab/abcdef"), "Object not removed")
+        self.assertTrue(self.backend.client.head_object(Bucket="beamit", Key="other/file"), "Object outside of the prefix removed")
+
+    def testPutKeepAndEncoding(self):
+        source = self.writeSource(b"compressed")
+        self.backend.put("ab/abcdef.gz", source, contentEncoding="gzip", keep=True)
+        self.assertTrue(os.path.exists(source), "Kept source file removed")
+        self.assertEqual(self.backend.client.head_object(Bucket="beamit", Key="blobs/ab/abcdef.gz")["ContentEncoding"], "gzip", "Content encoding not stored")
+
+    def testUrl(self):
+        self.backend.put("ab/abcdef", self.writeSource(b"content"))
+        url = self.backend.url("ab/abcdef", "my file.txt")
+        self.assertIn("X-Amz-Expires=300", url, "URL does not expire")
+        # moto answers requests to the signed URL, requests is installed with moto
+        import requests
+        response = requests.get(url)
+        self.assertEqual(response.content, b"content", "URL does not return the object")
+        self.assertEqual(response.headers["Content-Disposition"], "attachment; filename*=utf-8''my%20file.txt", "URL does not set the file name")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+import unittest
+
+from tokencache import tokencache
+
+class TestTokenCache(unittest.TestCase):
+    def testCheckAndInvalidate(self):
+        cache = tokencache(maxsize=10, ttl=60)
+        self.assertFalse(cache.check("user1", "device1", "token"), "Empty cache returned a hit")
+        cache.add("user1", "device1", "token")
+        cache.add("user1", "device2", "token2")
+        self.assertTrue(cache.check("user1", "device1", "token"), "Cached token not found")
+        self.assertFalse(cache.check("user1", "device1", "wrongtoken"), "Wrong token accepted")
+        cache.invalidate("user1", "device1")
+        self.assertFalse(cache.check("user1", "device1", "token"), "Invalidated token still accepted")
+        cache.invalidate("user1")
+        self.assertFalse(cache.check("user1", "device2", "token2"), "Token of removed user still accepted")
+        self.assertEqual(cache.getStats(), {"hits": 1, "misses": 4, "size": 0}, "Counters not correct")
+
+    def testExpiryAndEviction(self):
+        cache = tokencache(maxsize=2, ttl=0)
+        cache.add("user1", "device1", "token")
+        self.assertFalse(cache.check("user1", "device1", "token"), "Expired token accepted")
+        cache = tokencache(maxsize=2, ttl=60)
+        cache.add("user1", "device1", "token")
+        cache.add("user1", "device2", "token")
+        cache.add("user1", "device3", "token")
+        self.assertFalse(cache.check("user1", "device1", "token"), "Oldest entry not evicted")
+        self.assertEqual(cache.getStats()["size"], 2, "Cache exceeds maxsize")
+
+    def testGenerationAndClear(self):
+        cache = tokencache(maxsize=10, ttl=60)
+        generation = cache.generation
+        cache.invalidate("user1", "device1")
+        cache.add("user1", "device1", "token", generation=generation)
+        self.assertFalse(cache.check("user1", "device1", "token"), "Token read before an invalidation cached")
+        cache.add("user1", "device1", "token", generation=cache.generation)
+        self.assertTrue(cache.check("user1", "device1", "token"), "Token not cached")
+        cache.clear()
+        self.assertFalse(cache.check("user1", "device1", "token"), "Token accepted after clear")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,40 @@
+import time
+import unittest
+
+from pydantic import ValidationError
+
+import validation
+
+class TestValidation(unittest.TestCase):
+    def testNames(self):
+        self.assertTrue(validation.isUsername("alice1"), "Valid username rejected")
+        self.assertFalse(validation.isUsername("al"), "Short username accepted")
+        self.assertFalse(validation.isUsername("alice_1"), "Username with underscore accepted")
+        self.assertTrue(validation.isDevicename("my-phone.2"), "Valid devicename rejected")
+        self.assertFalse(validation.isDevicename("my phone"), "Devicename with space accepted")
+        self.assertFalse(validation.isDevicename("a" * 65), "Long devicename accepted")
+
+    def testDevicenameCharacters(self):
+        self.assertTrue(validation.isDevicename("my-phone"), "Devicename with hyphen rejected")
+        self.assertTrue(validation.isDevicename("my_phone.2"), "Devicename with underscore and dot rejected")
+        for devicename in ["ab:cd", "ab@cd", "ab[c]", "ab^cd", "ab\\cd"]:
+            self.assertFalse(validation.isDevicename(devicename), "Devicename " + devicename + " accepted")
+
+    def testTargetDevices(self):
+        self.assertEqual(validation.parseTargetDevices("{laptop, phone1}"), ["laptop", "phone1"], "Target devices not split")
+        self.assertIsNone(validation.parseTargetDevices("{}"), "Empty list accepted")
+        self.assertIsNone(validation.parseTargetDevices("laptop"), "List without braces accepted")
+        self.assertIsNone(validation.parseTargetDevices("{laptop,,phone1}"), "Empty devicename accepted")
+        # input that made the former nested pattern backtrack for a long time
+        start = time.perf_counter()
+        self.assertIsNone(validation.parseTargetDevices("{" + "abcd" * 2000 + "!"), "Malformed list accepted")
+        self.assertLess(time.perf_counter() - start, 0.1, "Rejecting a malformed list took too long")
+
+    def testSubscription(self):
+        credentials = validation.subscription.model_validate({"username": "alice1", "devicename": "laptop"})
+        self.assertIsNone(credentials.devicetoken, "Missing devicetoken not None")
+        with self.assertRaises(ValidationError):
+            validation.subscription.model_validate({"username": "a!", "devicename": "laptop"})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import hashlib
+import hmac
+import threading
+import time
+from collections import OrderedDict
+
+"""
+Bounded in-memory cache of validated device tokens. Entries expire after ttl seconds and the least recently used
+entry is dropped when maxsize is reached. Only a SHA-256 hash of the token is kept in memory.
+The cache is local to one worker process. Changed tokens are dropped in all workers through database notifications, ttl limits how long
+a token is accepted if a notification is missed.
+"""
+class tokencache():
+    maxsize = 0
+    ttl = 0
+    entries = None
+    lock = None
+    hits = 0
+    misses = 0
+    # counts invalidations, so a token read from the database before an invalidation is not cached after it
+    generation = 0
+    def __init__(self, maxsize: int = 10000, ttl: float = 30) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    """
+    Returns the SHA-256 hex digest of a device token.
+    """
+    @staticmethod
+    def hashToken(devicetoken: str) -> str:
+        return hashlib.sha256(devicetoken.encode()).hexdigest()
+
+    """
+    Checks if the token of the device is cached and not expired. Counts hits and misses.
+    """
+    def check(self, username: str, devicename: str, devicetoken: str) -> bool:
+        tokenhash = self.hashToken(devicetoken)
+        with self.lock:
+            entry = self.entries.get((username, devicename))
+            if entry is not None and entry[1] > time.monotonic() and hmac.compare_digest(entry[0], tokenhash):
+                self.entries.move_to_end((username, devicename))
+                self.hits += 1
+                return True
+            self.misses += 1
+            return False
+
+    """
+    Adds a validated token to the cache, evicting the least recently used entry if the cache is full.
+    If generation is given, the token is only added if nothing was invalidated since generation was read.
+    """
+    def add(self, username: str, devicename: str, devicetoken: str, generation: int | None = None):
+        if self.maxsize <= 0:
+            return
+        tokenhash = self.hashToken(devicetoken)
+        with self.lock:
+            if generation is not None and generation != self.generation:
+                return
+            self.entries[(username, devicename)] = (tokenhash, time.monotonic() + self.ttl)
+            self.entries.move_to_end((username, devicename))
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    """
+    Removes the cached token of a device, or of all devices of the user if no devicename is given.
+    """
+    def invalidate(self, username: str, devicename: str | None = None):
+        with self.lock:
+            self.generation += 1
+            if devicename is not None:
+                self.entries.pop((username, devicename), None)
+            else:
+                for key in [key for key in self.entries if key[0] == username]:
+                    del self.entries[key]
+
+    """
+    Removes all cached tokens.
+    """
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+
+    """
+    Returns the hit and miss counters and the current number of cached entries.
+    """
+    def getStats(self) -> dict:
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self.entries)}
@@ -0,0 +1,77 @@
+import re
+from typing import Annotated
+
+from pydantic import AfterValidator, BaseModel, StringConstraints
+
+"""
+Validation of user and device names in requests. The patterns are compiled once and only contain a bounded character class, so checking
+a name takes linear time in its length. Endpoints use the annotated types below, which pydantic checks with its linear time regex engine
+before the device token or the database are accessed.
+"""
+
+usernameMaxLength = 20
+devicenameMaxLength = 64
+# Upper limit for the number of devices in one list of target devices
+maxTargetDevices = 100
+usernamePattern = re.compile("[a-zA-Z0-9]{4,20}")
+# the hyphen after 0-9 cannot start a range, so it is a literal like _ and .
+devicenamePattern = re.compile("[a-zA-Z0-9-_.]{4,64}")
+
+usernameMessage = "Username is not valid. Username must be a combination of 4 to 20 uppercase letters, lowercase letters, and numbers"
+devicenameMessage = "Devicename is not valid. Devicename must be a combination of 4 to 64 uppercase letters, lowercase letters, numbers, dots, hyphens and underscores"
+targetDevicesMessage = "List of devicenames is not valid. Devicenames must be a List of devices, e.g. {devicename1, devicename2}."
+
+"""
+Function that returns if a string is a valid username.
+"""
+def isUsername(username: str):
+    return len(username) <= usernameMaxLength and usernamePattern.fullmatch(username) is not None
+
+"""
+Function that returns if a string is a valid device name.
+"""
+def isDevicename(devicename: str):
+    return len(devicename) <= devicenameMaxLength and devicenamePattern.fullmatch(devicename) is not None
+
+"""
+Function that splits a list of target devices like {devicename1, devicename2} into the device names. Returns None if the list is not valid.
+"""
+def parseTargetDevices(targetDevices: str):
+    targetDevices = targetDevices.strip()
+    if len(targetDevices) > maxTargetDevices * (devicenameMaxLength + 2) or not targetDevices.startswith("{") or not targetDevices.endswith("}"):
+        return None
+    devicenames = [devicename.strip() for devicename in targetDevices[1:-1].split(",")]
+    if len(devicenames) > maxTargetDevices or not all(isDevicename(devicename) for devicename in devicenames):
+        return None
+    return devicenames
+
+def checkTargetDevices(targetDevices: str):
+    devicenames = parseTargetDevices(targetDevices)
+    if devicenames is None:
+        raise ValueError(targetDevicesMessage)
+    return devicenames
+
+# Types of request parameters, e.g. username: Username = Form(). A parameter of type TargetDevices is passed to the endpoint as list.
+Username = Annotated[str, StringConstraints(max_length=usernameMaxLength, pattern="^" + usernamePattern.pattern + "$")]
+Devicename = Annotated[str, StringConstraints(max_length=devicenameMaxLength, pattern="^" + devicenamePattern.pattern + "$")]
+TargetDevices = Annotated[str, AfterValidator(checkTargetDevices)]
+
+"""
+Credentials sent as first message of a websocket subscription. The devicetoken may instead be passed in the Authorization header.
+"""
+class subscription(BaseModel):
+    username: Username
+    devicename: Devicename
+    devicetoken: str | None = None
+
+"""
+Function that returns the message for a failed validation of the request parameter name.
+"""
+def errorMessage(name: str):
+    if name == "username":
+        return usernameMessage
+    if name in ("devicename", "devicenameNew", "targetDevice"):
+        return devicenameMessage
+    if name == "targetDevices":
+        return targetDevicesMessage
+    return "Parameter " + name + " is missing or not valid"